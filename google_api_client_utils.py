@@ -0,0 +1,201 @@
+#!/usr/bin/python
+import os
+import sys
+import time
+import hashlib
+import tempfile
+import threading
+import datetime as dt
+import httplib2
+from googleapiclient import discovery
+from googleapiclient.discovery_cache.base import Cache
+
+from oauth2client.client import GoogleCredentials
+
+################################################################################
+#
+#   GOOGLE API CLIENT REGISTRY
+#
+#   The *_get_api_client functions of every library obtain their clients here
+#
+#   Clients are keyed by (service, version, credentials), so asking for a
+#   different version of an API (e.g. cloudresourcemanager v1 and v2) no longer
+#   throws away the client built for the other one
+#
+#   Each client owns an httplib2.Http object, which is not thread-safe, hence
+#   the registry keeps a pool with one client per key and per thread. Code run
+#   from the google_parallel_utils worker threads or from the prefetching
+#   threads of google_pagination_utils always gets a client of its own
+#
+#   Building a client requires the discovery document of the API. The documents
+#   are cached on disk (see DiscoveryDocumentCache), so building a client only
+#   requires network I/O the first time or once the cached document has expired
+#
+#   Credentials are loaded once per process (see credentials_get) and shared by
+#   all the clients of every library, whatever thread they belong to
+#
+###############################################################################
+
+# Names of the credentials that can be used to build a client
+APPLICATION_DEFAULT_CREDENTIALS = "application-default"
+DIRECTORY_CREDENTIALS = "directory"
+
+# { credentialsName: function that returns the credentials }
+# Other libraries register their own credentials, e.g. google_directory_utils registers DIRECTORY_CREDENTIALS
+CREDENTIALS_LOADERS = { APPLICATION_DEFAULT_CREDENTIALS: GoogleCredentials.get_application_default }
+
+# { credentialsName: credentials } loaded once and shared by all the threads and libraries
+CREDENTIALS = {}
+CREDENTIALS_LOCK = threading.Lock()
+
+# Access tokens that expire within this number of seconds are refreshed before handing the credentials out
+CREDENTIALS_REFRESH_MARGIN = 300
+
+# Scope requested for credentials that require one (e.g. service account keys used as application default credentials)
+CREDENTIALS_DEFAULT_SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+# Per thread dict { (serviceName, version, credentialsName): API client }
+API_CLIENTS = threading.local()
+
+# The cached discovery documents are stored in this directory, which can be overridden via environment variable
+DISCOVERY_CACHE_DIR = os.environ.get("GRB_GCP_DISCOVERY_CACHE_DIR", os.path.join(os.path.expanduser('~'), '.cache', 'grb-gcp-python', 'discovery'))
+
+# Seconds after which a cached discovery document is downloaded again
+DISCOVERY_CACHE_TTL = int(os.environ.get("GRB_GCP_DISCOVERY_CACHE_TTL", 24 * 3600))
+
+# Part of the cache file names. Increase it when the format of the cache changes to ignore the old files
+DISCOVERY_CACHE_FORMAT_VERSION = 1
+
+# Maximum number of calls allowed in a single batch HTTP request, shared by the batch functions of every library
+# https://developers.google.com/api-client-library/python/guide/batch
+BATCH_MAX_SIZE = 100
+
+
+
+#
+# On-disk cache of discovery documents, implementing the googleapiclient discovery_cache interface
+#
+# - Each document is stored in a file named after the format version and a hash of its URL
+#   (the URL contains the service name and the version of the API)
+# - Documents older than ttl seconds are ignored, hence they are downloaded and stored again
+# - Files are written to a temporary file and renamed, so concurrent scripts never read a partial document
+# - Documents already read are also kept in memory, so each thread building a client does not read the file again
+#
+class DiscoveryDocumentCache(Cache):
+
+    def __init__(self, cacheDir = DISCOVERY_CACHE_DIR, ttl = DISCOVERY_CACHE_TTL):
+        self.cacheDir = cacheDir
+        self.ttl = ttl
+        self.documents = {} # { url: (timestamp, content) }
+        self.lock = threading.Lock()
+
+    def get_path(self, url):
+        return os.path.join(self.cacheDir, "v{0}-{1}.json".format(DISCOVERY_CACHE_FORMAT_VERSION, hashlib.sha1(url).hexdigest()))
+
+    def get(self, url):
+
+        now = time.time()
+
+        with self.lock:
+            if url in self.documents and now - self.documents[url][0] < self.ttl:
+                return self.documents[url][1]
+
+        path = self.get_path(url)
+        try:
+            timestamp = os.path.getmtime(path)
+            if now - timestamp >= self.ttl:
+                return None # Expired
+            with open(path, 'r') as f:
+                content = f.read()
+        except (IOError, OSError):
+            return None # Not cached yet
+
+        with self.lock:
+            self.documents[url] = (timestamp, content)
+
+        return content
+
+    def set(self, url, content):
+
+        with self.lock:
+            self.documents[url] = (time.time(), content)
+
+        try:
+            if not os.path.exists(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            (fileDescriptor, temporaryPath) = tempfile.mkstemp(dir = self.cacheDir, suffix = ".tmp")
+            with os.fdopen(fileDescriptor, 'w') as f:
+                f.write(content)
+            os.rename(temporaryPath, self.get_path(url)) # Atomic replacement of the previous document
+        except (IOError, OSError) as e:
+            print "[WARNING] Discovery document for {0} could not be cached: {1}".format(url, e)
+
+
+DISCOVERY_CACHE = DiscoveryDocumentCache()
+
+
+
+#
+# Registers the function used to load the credentials with the given name
+#
+def api_client_register_credentials(credentialsName, credentialsLoader):
+    CREDENTIALS_LOADERS[credentialsName] = credentialsLoader
+
+
+
+#
+# Returns the credentials with the given name
+#
+# They are loaded (e.g. read from the credential store) the first time they are requested
+# and the same object is returned afterwards, to every thread and every library
+# The access token is only refreshed when it is missing or about to expire, otherwise no I/O is done at all
+#
+def credentials_get(credentialsName = APPLICATION_DEFAULT_CREDENTIALS):
+
+    with CREDENTIALS_LOCK:
+
+        if credentialsName not in CREDENTIALS:
+            credentials = CREDENTIALS_LOADERS[credentialsName]()
+            if hasattr(credentials, 'create_scoped_required') and credentials.create_scoped_required():
+                credentials = credentials.create_scoped(CREDENTIALS_DEFAULT_SCOPES)
+            CREDENTIALS[credentialsName] = credentials
+
+        credentials = CREDENTIALS[credentialsName]
+        credentials_refresh_if_needed(credentials)
+
+    return credentials
+
+
+
+#
+# Refreshes the access token of the credentials if there is none yet or if it expires within CREDENTIALS_REFRESH_MARGIN seconds
+# Authorized HTTP objects also refresh the token when a request is rejected, this only avoids that round trip
+#
+def credentials_refresh_if_needed(credentials):
+
+    tokenExpiry = getattr(credentials, 'token_expiry', None) # Naive UTC datetime
+
+    if ( getattr(credentials, 'access_token', None) is None
+         or ( tokenExpiry is not None and tokenExpiry - dt.datetime.utcnow() < dt.timedelta(seconds = CREDENTIALS_REFRESH_MARGIN) ) ):
+        credentials.refresh(httplib2.Http())
+
+
+
+#
+# Returns the API client for a service and version built for the current thread with the given credentials
+# The client is built the first time it is requested by each thread and reused afterwards
+#
+def api_client_get(serviceName, version, credentialsName = APPLICATION_DEFAULT_CREDENTIALS):
+
+    clients = getattr(API_CLIENTS, 'clients', None)
+    if clients is None:
+        clients = {}
+        API_CLIENTS.clients = clients
+
+    key = (serviceName, version, credentialsName)
+
+    if key not in clients:
+        credentials = credentials_get(credentialsName)
+        clients[key] = discovery.build(serviceName, version, credentials = credentials, cache = DISCOVERY_CACHE)
+
+    return clients[key]
@@ -1,73 +1,102 @@
 #!/usr/bin/python
 import json
-import httplib2
+import threading
 import google_constants as constants
-from googleapiclient import discovery
-
-from oauth2client.client import GoogleCredentials
 
+import google_api_client_utils as apiClientUtils
 import google_directory_utils as directory_utils
+import google_parallel_utils as parallelUtils
+import google_pagination_utils as paginationUtils
 
-CLOUDRESOURCEMANAGER_API_CLIENT = None
-CLOUDRESOURCEMANAGER_API_CLIENT_VERSION = None
+# Field masks (partial responses) for the project get/list functions below
+# The list functions filter the projects by lifecycleState, hence their masks must include it
+CLOUDRESOURCEMANAGER_PROJECT_ID_FIELDS = "projectId,lifecycleState"
+CLOUDRESOURCEMANAGER_PROJECT_LABELS_FIELDS = "projectId,lifecycleState,labels"
+CLOUDRESOURCEMANAGER_PROJECT_SUMMARY_FIELDS = "projectId,name,lifecycleState"
 
 #
 # API at https://developers.google.com/apis-explorer/#p/cloudresourcemanager/v1/
 #
+# The clients are stored per thread and per version in google_api_client_utils, hence the functions
+# in this module can be called from the google_parallel_utils worker threads
+# The v2 API (folders) is used with the credentials of the directory_utils OAuth flow
+#
 def cloudresourcemanager_get_api_client(version = "v1"):
-    global CLOUDRESOURCEMANAGER_API_CLIENT
-    global CLOUDRESOURCEMANAGER_API_CLIENT_VERSION
-
-    if CLOUDRESOURCEMANAGER_API_CLIENT == None or CLOUDRESOURCEMANAGER_API_CLIENT_VERSION != version:
 
-        if (version == "v2"):
-            credentials = directory_utils.get_credentials()
-            http = credentials.authorize(httplib2.Http())
-            CLOUDRESOURCEMANAGER_API_CLIENT = discovery.build('cloudresourcemanager', version = version, http = http)
+    if (version == "v2"):
+        return apiClientUtils.api_client_get('cloudresourcemanager', version, apiClientUtils.DIRECTORY_CREDENTIALS)
+    else:
+        return apiClientUtils.api_client_get('cloudresourcemanager', version)
 
-        else:
-            credentials = GoogleCredentials.get_application_default()
-            CLOUDRESOURCEMANAGER_API_CLIENT = discovery.build('cloudresourcemanager', version = version, credentials = credentials)
 
-        CLOUDRESOURCEMANAGER_API_CLIENT_VERSION = version
 
-    return CLOUDRESOURCEMANAGER_API_CLIENT
+#
+# Yields all folders under a specified parent as the pages are retrieved
+#
+def cloudresourcemanager_iter_folders(parent, requestedPageSize = 0):
 
+    service = cloudresourcemanager_get_api_client(version = "v2")
+    return paginationUtils.paginate(service.folders().list, 'folders', parent = parent, pageSize = requestedPageSize)
 
 
 #
 # Returns all folders under a specified parent
 #
 def cloudresourcemanager_get_folders(parent, requestedPageSize = 0):
+    return list(cloudresourcemanager_iter_folders(parent, requestedPageSize))
 
-    service = cloudresourcemanager_get_api_client(version = "v2")
-    folders = []
-    nextPageToken = None
-
-    while True:
 
-        result = service.folders().list(parent = parent, pageSize=requestedPageSize, pageToken=nextPageToken).execute()
 
-        if 'folders' in result:
-            folders.extend(result['folders'])
+#
+#   Helper method that checks if a project has a label set to a value
+#
+def checkIfProjectHasLabel(project, label, value):
 
-            if ('nextPageToken' not in result or result['nextPageToken'] is None): # No more pages
-                return folders
-            else: # There are more pages
-                nextPageToken = result['nextPageToken']
+    projectResource = cloudresourcemanager_get_project(project, CLOUDRESOURCEMANAGER_PROJECT_LABELS_FIELDS)
+    return ( label in projectResource['labels'] and projectResource['labels'][label] == value )
 
-        else: # No (more) folders found
-            return folders
 
 
+###########################################################
+#
+# Batch HTTP Requests
+#
+###########################################################
 
 #
-#   Helper method that checks if a project has a label set to a value
+# Executes one call per request ID packing them in batch HTTP requests of up to batchSize calls each
+# requestBuilder(service, requestId) must return the (non executed) HttpRequest for the given ID
 #
-def checkIfProjectHasLabel(project, label, value):
+# The request IDs are usually project IDs, so that the callbacks can map each response back to its project
+# Returns a dict { requestId: response } and a dict { requestId: exception }
+#
+def cloudresourcemanager_execute_batch(requestIds, requestBuilder, version = "v1", batchSize = apiClientUtils.BATCH_MAX_SIZE):
 
-    projectResource = cloudresourcemanager_get_project(project)
-    return ( label in projectResource['labels'] and projectResource['labels'][label] == value )
+    service = cloudresourcemanager_get_api_client(version = version)
+    responses = {}
+    errors = {}
+
+    def callback(requestId, response, exception):
+        if exception is not None:
+            errors[requestId] = exception
+        else:
+            responses[requestId] = response
+
+    # Request IDs must be unique within a batch
+    uniqueRequestIds = []
+    seenRequestIds = set()
+    for requestId in requestIds:
+        if requestId not in seenRequestIds:
+            seenRequestIds.add(requestId)
+            uniqueRequestIds.append(requestId)
+
+    for start in range(0, len(uniqueRequestIds), batchSize):
+        batch = service.new_batch_http_request(callback = callback)
+        for requestId in uniqueRequestIds[start:start + batchSize]:
+            batch.add(requestBuilder(service, requestId), request_id = requestId)
+        batch.execute()
+
+    return responses, errors
 
 
 
@@ -75,37 +104,45 @@ def checkIfProjectHasLabel(project, label, value):
 # Returns a project resource object
 # https://developers.google.com/resources/api-libraries/documentation/cloudresourcemanager/v1/python/latest/cloudresourcemanager_v1.projects.html#get
 #
-def cloudresourcemanager_get_project(projectId):
-    return cloudresourcemanager_get_api_client().projects().get(projectId = projectId).execute()
+# fields is an optional mask to retrieve only part of the resource, e.g. CLOUDRESOURCEMANAGER_PROJECT_LABELS_FIELDS
+#
+def cloudresourcemanager_get_project(projectId, fields = None):
+    return cloudresourcemanager_get_api_client().projects().get(projectId = projectId, fields = fields).execute()
+
+
+#
+# Returns a dict { projectId: project resource object } and a dict { projectId: exception }
+# The projects.get calls are packed in batch HTTP requests of up to BATCH_MAX_SIZE calls each
+#
+def cloudresourcemanager_batch_get_projects(projectIds, batchSize = apiClientUtils.BATCH_MAX_SIZE, fields = None):
+    return cloudresourcemanager_execute_batch(projectIds, lambda service, projectId: service.projects().get(projectId = projectId, fields = fields), batchSize = batchSize)
 
 
 #
 # The projects.list() method specifies that there is a limit to the number of projects returned on each call
 # A nextPageToken will be return in case the list has been truncated
 #
-def cloudresourcemanager_get_projects(requestedPageSize = 0, projectFilter = constants.PROJECT_FILTER, lifecycleState = "ACTIVE"):
+# Yields the projects in the given lifecycle state as the pages are retrieved
+# List Filter Examples can be found at:
+# https://developers.google.com/resources/api-libraries/documentation/cloudresourcemanager/v1/python/latest/cloudresourcemanager_v1.projects.html#list
+#
+# fields is an optional mask applied to each project, which must include lifecycleState
+#
+def cloudresourcemanager_iter_projects(requestedPageSize = 0, projectFilter = constants.PROJECT_FILTER, lifecycleState = "ACTIVE", fields = None):
 
     service = cloudresourcemanager_get_api_client()
-    projects = []
-    nextPageToken = None
 
-    while True:
-        # List Filter Examples can be found at:
-        # https://developers.google.com/resources/api-libraries/documentation/cloudresourcemanager/v1/python/latest/cloudresourcemanager_v1.projects.html#list
-        result = service.projects().list(filter = projectFilter, pageSize=requestedPageSize, pageToken=nextPageToken).execute()
+    for currentProject in paginationUtils.paginate(service.projects().list, 'projects', filter = projectFilter, pageSize = requestedPageSize,
+                                                   fields = paginationUtils.paginate_fields('projects', fields)):
+        if (currentProject['lifecycleState'] == lifecycleState):
+            yield currentProject
 
-        if 'projects' in result:
-            for currentProject in result['projects']:
-                if (currentProject['lifecycleState'] == lifecycleState):
-                    projects.append(currentProject)
 
-            if ('nextPageToken' not in result or result['nextPageToken'] is None): # No more pages
-                return projects
-            else: # There are more pages
-                nextPageToken = result['nextPageToken']
-
-        else: # No (more) projects found
-            return projects
+#
+# Returns the list of projects in the given lifecycle state that match the filter
+#
+def cloudresourcemanager_get_projects(requestedPageSize = 0, projectFilter = constants.PROJECT_FILTER, lifecycleState = "ACTIVE", fields = None):
+    return list(cloudresourcemanager_iter_projects(requestedPageSize, projectFilter, lifecycleState, fields))
 
 
 #
@@ -114,8 +151,7 @@ def cloudresourcemanager_get_projects(requestedPageSize = 0, projectFilter = con
 def cloudresourcemanager_get_project_ids(requestedPageSize = 0, projectFilter = constants.PROJECT_FILTER, lifecycleState = "ACTIVE"):
 
     result = []
-    projects = cloudresourcemanager_get_projects( requestedPageSize = requestedPageSize, projectFilter = projectFilter, lifecycleState = lifecycleState)
-    for project in projects:
+    for project in cloudresourcemanager_iter_projects( requestedPageSize = requestedPageSize, projectFilter = projectFilter, lifecycleState = lifecycleState, fields = CLOUDRESOURCEMANAGER_PROJECT_ID_FIELDS):
         result.append(project['projectId'])
 
     return result
@@ -206,14 +242,15 @@ def search_labels(labels,requested_label):
 # Returns a list of IamPolicy objects
 # https://developers.google.com/resources/api-libraries/documentation/cloudresourcemanager/v1/python/latest/cloudresourcemanager_v1.projects.html#getIamPolicy
 #
-def cloudresourcemanager_get_all_projects_iam_policies():
-
-    iamPolicies = []
+# The policies are retrieved concurrently by up to maxWorkers threads. If the policy of any project could not be
+# retrieved, the errors are reported and the first one is raised, hence the list is never missing a project
+#
+def cloudresourcemanager_get_all_projects_iam_policies(maxWorkers = parallelUtils.DEFAULT_MAX_WORKERS):
 
-    for projectId in cloudresourcemanager_get_all_project_ids():
-        iamPolicies.append( cloudresourcemanager_get_project_iam_policy(projectId) )
+    results = parallelUtils.parallel_map(cloudresourcemanager_get_project_iam_policy, cloudresourcemanager_get_all_project_ids(), maxWorkers)
+    parallelUtils.parallel_print_errors(results, "Project")
 
-    return iamPolicies
+    return parallelUtils.parallel_get_values(results)
 
 
 
@@ -225,6 +262,14 @@ def cloudresourcemanager_get_project_iam_policy(projectId):
     return cloudresourcemanager_get_api_client().projects().getIamPolicy(resource=projectId, body={}).execute()
 
 
+#
+# Returns a dict { projectId: iamPolicy object } and a dict { projectId: exception }
+# The getIamPolicy calls are packed in batch HTTP requests of up to BATCH_MAX_SIZE calls each
+#
+def cloudresourcemanager_batch_get_project_iam_policies(projectIds, batchSize = apiClientUtils.BATCH_MAX_SIZE):
+    return cloudresourcemanager_execute_batch(projectIds, lambda service, projectId: service.projects().getIamPolicy(resource = projectId, body = {}), batchSize = batchSize)
+
+
 #
 # Sets the iamPolicy object for a project
 # https://developers.google.com/resources/api-libraries/documentation/cloudresourcemanager/v1/python/latest/cloudresourcemanager_v1.projects.html#getIamPolicy
@@ -250,16 +295,15 @@ def cloudresourcemanager_get_project_iam_bindings(projectId):
 # Returns a list of iamBindings lists for each project
 # https://developers.google.com/resources/api-libraries/documentation/cloudresourcemanager/v1/python/latest/cloudresourcemanager_v1.projects.html#getIamPolicy
 #
-def cloudresourcemanager_get_all_projects_iam_bindings():
-
-    iamBindings = []
+# Like cloudresourcemanager_get_all_projects_iam_policies, the first error is raised once all the projects have been requested
+# Projects whose policy has no bindings (possibly lack of permissions) are left out, as they always were
+#
+def cloudresourcemanager_get_all_projects_iam_bindings(maxWorkers = parallelUtils.DEFAULT_MAX_WORKERS):
 
-    for projectId in cloudresourcemanager_get_all_project_ids():
-        bindings = cloudresourcemanager_get_project_iam_bindings(projectId)
-        if bindings is not None:
-            iamBindings.append(bindings)
+    results = parallelUtils.parallel_map(cloudresourcemanager_get_project_iam_bindings, cloudresourcemanager_get_all_project_ids(), maxWorkers)
+    parallelUtils.parallel_print_errors(results, "Project")
 
-    return iamBindings
+    return [ bindings for bindings in parallelUtils.parallel_get_values(results) if bindings is not None ]
 
 
 #
@@ -274,6 +318,17 @@ def cloudresourcemanager_get_project_binding( projectId, role ):
         if binding is not None and binding['role'] == role:
             return binding
 
+#
+# Returns all members of the binding for a specific role in an already retrieved iamPolicy object
+#
+def cloudresourcemanager_get_policy_binding_members(policy, role):
+    members = []
+    if policy is not None and 'bindings' in policy:
+        for binding in policy['bindings']:
+            if binding is not None and binding['role'] == role:
+                members.extend(binding['members'])
+    return members
+
 #
 # Returns all members of a binding for a given project
 #
@@ -371,27 +426,70 @@ def cloudresourcemanager_add_member_to_project_binding ( projectId, role, member
 #
 ###########################################################
 
+# The list of available constraints only depends on the type of resource (and the organisation), not on the resource itself
+# Hence it is retrieved once per resource type and cached here: { "projects": [constraintName, ...] }
+ORGANISATION_POLICY_CONSTRAINTS = {}
+ORGANISATION_POLICY_CONSTRAINTS_LOCK = threading.Lock()
+
+
+#
+# Returns the names of the Org Policy constraints that can be applied to a resource type, e.g. "projects"
+# https://developers.google.com/resources/api-libraries/documentation/cloudresourcemanager/v1/python/latest/cloudresourcemanager_v1.projects.html#listAvailableOrgPolicyConstraints
+#
+# The constraints are listed for sampleResourcePath the first time and the cached list is returned afterwards
+#
+def cloudresourcemanager_get_available_organisation_policy_constraints(resourceType, sampleResourcePath):
+
+    with ORGANISATION_POLICY_CONSTRAINTS_LOCK:
+
+        if resourceType not in ORGANISATION_POLICY_CONSTRAINTS:
+
+            service = cloudresourcemanager_get_api_client()
+            collection = getattr(service, resourceType)()
+            constraints = []
+            nextPageToken = None
+
+            while True:
+                body = { "pageToken": nextPageToken } if nextPageToken is not None else {}
+                result = collection.listAvailableOrgPolicyConstraints(resource = sampleResourcePath, body = body).execute()
+
+                for constraint in result.get("constraints", []):
+                    constraints.append(constraint["name"])
+
+                nextPageToken = result.get("nextPageToken")
+                if not nextPageToken: # No more pages
+                    break
+
+            ORGANISATION_POLICY_CONSTRAINTS[resourceType] = constraints
+
+        return ORGANISATION_POLICY_CONSTRAINTS[resourceType]
+
+
 #
 # Returns an orgPolicy object for a project
 # https://developers.google.com/resources/api-libraries/documentation/cloudresourcemanager/v1/python/latest/cloudresourcemanager_v1.projects.html#listAvailableOrgPolicyConstraints
 # https://developers.google.com/resources/api-libraries/documentation/cloudresourcemanager/v1/python/latest/cloudresourcemanager_v1.projects.html#getEffectiveOrgPolicy
 #
-# This process is extremely slow - It takes several seconds to retrieve the information for each project
+# Retrieving one effective policy per constraint used to take several seconds per project
+# The constraint list is now cached per resource type and all the getEffectiveOrgPolicy calls
+# for the project are packed in batch HTTP requests (one round trip per BATCH_MAX_SIZE constraints)
 #
 def cloudresourcemanager_get_project_organisation_policy(projectId):
 
     resourcePath = "projects/{0}".format(projectId)
 
-    availablePolicyConstraints = cloudresourcemanager_get_api_client().projects().listAvailableOrgPolicyConstraints(resource=resourcePath, body={}).execute()
-    policy = []
+    constraints = cloudresourcemanager_get_available_organisation_policy_constraints("projects", resourcePath)
+
+    if constraints:
 
-    if "constraints" in availablePolicyConstraints:
+        responses, errors = cloudresourcemanager_execute_batch(constraints, lambda service, constraint: service.projects().getEffectiveOrgPolicy(resource = resourcePath, body = { "constraint": constraint }))
 
-        for constraint in availablePolicyConstraints["constraints"]:
+        if errors:
+            raise Exception("The effective Org Policy for project {0} could not be retrieved: {1}".format(projectId, errors.values()[0]))
 
-            body = '''{{ "constraint": "{0}" }}'''.format(constraint["name"])
-            policyForConstraint = cloudresourcemanager_get_api_client().projects().getEffectiveOrgPolicy(resource=resourcePath, body=json.loads(body)).execute()
-            policy.append(policyForConstraint)
+        policy = []
+        for constraint in constraints:
+            policy.append(responses[constraint])
 
         return policy
 
@@ -399,15 +497,37 @@ def cloudresourcemanager_get_project_organisation_policy(projectId):
         return {}
 
 
+#
+# Returns a dict { projectId: list of effective orgPolicy objects } and a dict { projectId: exception }
+# The projects are evaluated concurrently, each one of them with batched getEffectiveOrgPolicy calls
+#
+def cloudresourcemanager_get_projects_organisation_policies(projectIds, maxWorkers = parallelUtils.DEFAULT_MAX_WORKERS):
+
+    orgPolicies = {}
+    errors = {}
+
+    for result in parallelUtils.parallel_map(cloudresourcemanager_get_project_organisation_policy, projectIds, maxWorkers):
+        if result[parallelUtils.RESULT_ERROR] is None:
+            orgPolicies[result[parallelUtils.RESULT_ITEM]] = result[parallelUtils.RESULT_VALUE]
+        else:
+            errors[result[parallelUtils.RESULT_ITEM]] = result[parallelUtils.RESULT_ERROR]
+
+    return orgPolicies, errors
+
+
 #
 # Returns a list of effective orgPolicy objects
 # https://developers.google.com/resources/api-libraries/documentation/cloudresourcemanager/v1/python/latest/cloudresourcemanager_v1.projects.html#getEffectiveOrgPolicy
 #
-def cloudresourcemanager_get_all_projects_organisation_policies():
+def cloudresourcemanager_get_all_projects_organisation_policies(maxWorkers = parallelUtils.DEFAULT_MAX_WORKERS):
 
     orgPolicies = []
 
-    for projectId in cloudresourcemanager_get_all_project_ids():
-        orgPolicies.append( cloudresourcemanager_get_project_organisation_policy(projectId) )
+    results = parallelUtils.parallel_map(cloudresourcemanager_get_project_organisation_policy, cloudresourcemanager_get_all_project_ids(), maxWorkers)
+    parallelUtils.parallel_print_errors(results, "Project")
+
+    for result in results:
+        if result[parallelUtils.RESULT_ERROR] is None:
+            orgPolicies.append(result[parallelUtils.RESULT_VALUE])
 
     return orgPolicies
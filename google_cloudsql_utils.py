@@ -4,10 +4,10 @@ import re
 import time
 import json
 
-import googleapiclient.discovery as discovery
 from googleapiclient.errors import HttpError
 
-from oauth2client.client import GoogleCredentials
+import google_api_client_utils as apiClientUtils
+import google_pagination_utils as paginationUtils
 
 # TODO oauth2client is deprecated. Use google.auth
 #import google.auth
@@ -20,19 +20,14 @@ from oauth2client.client import GoogleCredentials
 #
 ####################################################
 
-# Singleton style global variables
-# Only one API client is stored at a time
-CLOUDSQL_API_CLIENT = None
-CLOUDSQL_API_CLIENT_VERSION = None
+# Field masks (partial responses) for the instance get/list functions below
+CLOUDSQL_INSTANCE_SUMMARY_FIELDS = "name,state,databaseVersion"
+CLOUDSQL_INSTANCE_SSL_FIELDS = "name,settings/ipConfiguration/requireSsl"
 
 # [START cloudsql_get_api_client]
+# The clients are stored per thread and per version in google_api_client_utils
 def cloudsql_get_api_client(version = "v1beta4"):
-    global CLOUDSQL_API_CLIENT
-    global CLOUDSQL_API_CLIENT_VERSION
-    if CLOUDSQL_API_CLIENT == None or CLOUDSQL_API_CLIENT_VERSION != version:
-        CLOUDSQL_API_CLIENT = discovery.build('sqladmin', version, credentials = GoogleCredentials.get_application_default())
-        CLOUDSQL_API_CLIENT_VERSION = version
-    return CLOUDSQL_API_CLIENT
+    return apiClientUtils.api_client_get('sqladmin', version)
 # [END cloudsql_get_api_client]
 
 ###########################################
@@ -50,35 +45,29 @@ def cloudsql_delete_instance(project, instanceName):
 
 
 # [START cloudsql_list_instances]
-def cloudsql_list_instances (project):
-    items = []
-    nextPageToken = None
-    while True:
-        result = {}
-        try:
-            result = cloudsql_get_api_client().instances().list(project=project, pageToken=nextPageToken).execute()  # maxResults is 500 by default
-        except HttpError as e:
-            print "[ERROR] HTTPError {0} Message:{1}".format(e.resp.status, json.loads(e.content)['error']['message'])
-            raise e
-        except:
-            print "[ERROR] Unknown Error listing CloudSQL instances on project {0}".format(project)
-            raise
-
-        if 'items' in result:
-            items = items + result['items']
-            if ('nextPageToken' not in result or result['nextPageToken'] is None): # No more pages
-                return items
-            else: # There are more pages
-                nextPageToken = result['nextPageToken']
-        else: # No (more) VMs found
-            return items
+# Yields the CloudSQL instances of a project as the pages are retrieved (maxResults is 500 by default)
+# fields is an optional mask applied to each instance, e.g. CLOUDSQL_INSTANCE_SSL_FIELDS
+def cloudsql_iter_instances (project, fields = None):
+    try:
+        for instance in paginationUtils.paginate(cloudsql_get_api_client().instances().list, 'items', project=project, fields=paginationUtils.paginate_fields('items', fields)):
+            yield instance
+    except HttpError as e:
+        print "[ERROR] HTTPError {0} Message:{1}".format(e.resp.status, json.loads(e.content)['error']['message'])
+        raise e
+    except Exception:
+        print "[ERROR] Unknown Error listing CloudSQL instances on project {0}".format(project)
+        raise
+
+
+def cloudsql_list_instances (project, fields = None):
+    return list(cloudsql_iter_instances(project, fields))
 # [END cloudsql_list_instances]
 
 
 # [START cloudsql_get_instance]
 # Return an Operation resoruce JSON object.
-def cloudsql_get_instance(project, instanceName):
-    return cloudsql_get_api_client().instances().get(project=project, instance=instanceName).execute()
+def cloudsql_get_instance(project, instanceName, fields = None):
+    return cloudsql_get_api_client().instances().get(project=project, instance=instanceName, fields=fields).execute()
 # [END cloudsql_get_instance]
 
 
@@ -121,12 +110,16 @@ def cloudsql_delete_database(project, instanceName, databaseName):
 
 
 # [START cloudsql_list_databases]
-def cloudsql_list_databases (project, instanceName):
+# fields is an optional mask applied to each database
+def cloudsql_list_databases (project, instanceName, fields = None):
     items = []
 
+    if fields is not None:
+        fields = "items({0})".format(fields) # databases.list returns every database in a single response
+
     result = {}
     try:
-        result = cloudsql_get_api_client().databases().list(project=project, instance=instanceName).execute()  # maxResults is 500 by default
+        result = cloudsql_get_api_client().databases().list(project=project, instance=instanceName, fields=fields).execute()  # maxResults is 500 by default
     except HttpError as e:
         print "[ERROR] HTTPError {0} Message:{1}".format(e.resp.status, json.loads(e.content)['error']['message'])
         raise e
@@ -142,6 +135,6 @@ def cloudsql_list_databases (project, instanceName):
 
 
 # [START cloudsql_get_database]
-def cloudsql_get_database(project, instanceName, databaseName):
-    return cloudsql_get_api_client().databases().get(project=project, instance=instanceName, database=databaseName).execute()
+def cloudsql_get_database(project, instanceName, databaseName, fields = None):
+    return cloudsql_get_api_client().databases().get(project=project, instance=instanceName, database=databaseName, fields=fields).execute()
 # [END cloudsql_get_database]
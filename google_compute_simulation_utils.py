@@ -0,0 +1,310 @@
+#!/usr/bin/python
+import json
+import random
+import threading
+import google_constants as constants
+import google_api_client_utils as apiClientUtils
+import google_parallel_utils as parallelUtils
+import google_compute_utils as computeUtils
+from google_compute_utils import (COMPUTE_ALL_ZONES, RUNNING, TERMINATED, COMPUTE_INSTANCE_NOT_FOUND, COMPUTE_INSTANCE_SCHEDULER_FIELDS,
+                                  COMPUTE_START_OPERATION, COMPUTE_STOP_OPERATION, COMPUTE_ALLOWED_OPERATIONS,
+                                  COMPUTE_BULK_OPERATIONS_PER_SECOND, OPERATION_DONE, OPERATION_RESULT_INSTANCE,
+                                  OPERATION_RESULT_OPERATION, OPERATION_RESULT_STATUS, OPERATION_RESULT_ERROR,
+                                  compute_get_resource_zone, compute_get_resource_metadata_value)
+
+################################################################################
+#
+#   SIMULATED COMPUTE BACKEND
+#
+#   In-memory replacement for google_compute_utils, used to dry-run the scripts
+#   (e.g. google_compute_instance_scheduler.py --simulate) over synthetic fleets
+#   without touching any real instance
+#
+#   - The constants and the functions that only work on resources already in
+#     hand (compute_get_resource_zone, compute_get_resource_metadata_value...)
+#     are imported by name from google_compute_utils. A script that uses
+#     another one must add it to that import
+#   - The functions that call the Compute API are replaced below with versions
+#     with the same signature that work on SIMULATION_INSTANCES. Operations
+#     complete immediately
+#   - Every API request that the real function would have sent is counted in
+#     SIMULATION_API_CALLS, by method, e.g. "instances.get"
+#
+###############################################################################
+
+# { (project, zone, instanceName): instance resource }
+SIMULATION_INSTANCES = {}
+
+# { project: [ (project, zone, instanceName) ] } so that listing a project does not go through the whole fleet
+SIMULATION_PROJECT_INSTANCES = {}
+
+# { API method: number of requests }
+SIMULATION_API_CALLS = {}
+
+# [ (operationName, (project, zone, instanceName)) ] performed since the last simulation_reset_operations
+SIMULATION_OPERATIONS = []
+
+SIMULATION_LOCK = threading.Lock()
+
+# Zones where the instances of the generated fleets are created
+SIMULATION_ZONES = ["europe-west1-b", "europe-west1-c", "europe-west1-d"]
+
+# Activity windows assigned to the instances of the generated fleets
+SIMULATION_SCHEDULES = [
+    "08:00 18:00 * * MON-FRI",
+    "07:30 20:30 * * MON-FRI",
+    "09:00 17:00 * * MON,WED,FRI",
+    "06:00 22:00 * * *",
+    "00:00 23:59 * * MON-FRI",
+    "10:00 16:00 * * SAT,SUN",
+]
+
+# Default number of results per page of the list methods
+SIMULATION_PAGE_SIZE = 500
+
+
+
+#
+# Replaces the simulated instances with a generated fleet of projectCount projects with instancesPerProject instances each
+#
+# Every instance gets one of the schedules and, with probability dependencyRatio, depends on up to maxDependencies
+# instances with the same schedule created before it in the same project (hence the dependency graph has no cycles),
+# like an application server and its database would
+# With probability crossScheduleRatio those dependencies are drawn from all the instances created before it instead,
+# whatever their schedule, so that some instances are due while their dependencies are not running (or stopped) yet
+# The startup dependencies are mirrored as shutdown dependencies: the database is not stopped until its servers are
+#
+def simulation_generate_fleet(projectCount, instancesPerProject, schedules = SIMULATION_SCHEDULES, dependencyRatio = 0.2,
+                              maxDependencies = 2, zones = SIMULATION_ZONES, seed = None, crossScheduleRatio = 0.0):
+
+    generator = random.Random(seed)
+    SIMULATION_INSTANCES.clear()
+    SIMULATION_PROJECT_INSTANCES.clear()
+
+    for projectNumber in range(projectCount):
+
+        project = "sim-project-{0:04d}".format(projectNumber)
+        projectInstances = []
+        instancesBySchedule = {}
+        shutdownDependencies = {}
+
+        for instanceNumber in range(instancesPerProject):
+
+            instanceName = "sim-vm-{0:05d}".format(instanceNumber)
+            zone = generator.choice(zones)
+            schedule = generator.choice(schedules)
+            metadataItems = []
+
+            candidates = instancesBySchedule.setdefault(schedule, [])
+            if generator.random() < crossScheduleRatio:
+                candidates = projectInstances
+            if candidates and generator.random() < dependencyRatio:
+                dependencies = generator.sample(candidates, min(len(candidates), generator.randint(1, maxDependencies)))
+                metadataItems.append({ "key": constants.STARTUP_DEPENDENCIES_KEY,
+                                       "value": ",".join( "{0}#{1}".format(dependency[1], dependency[2]) for dependency in dependencies ) })
+                for dependency in dependencies:
+                    shutdownDependencies.setdefault(dependency, []).append("{0}#{1}".format(zone, instanceName))
+
+            metadataItems.append({ "key": constants.ACTIVITY_WINDOW_KEY, "value": schedule })
+
+            instanceKey = (project, zone, instanceName)
+            SIMULATION_INSTANCES[instanceKey] = {
+                "name": instanceName,
+                "zone": "projects/{0}/zones/{1}".format(project, zone),
+                "status": generator.choice([RUNNING, TERMINATED]),
+                "labels": {},
+                "metadata": { "items": metadataItems },
+            }
+            projectInstances.append(instanceKey)
+            instancesBySchedule[schedule].append(instanceKey)
+
+        SIMULATION_PROJECT_INSTANCES[project] = sorted(projectInstances)
+
+        for instanceKey, dependents in shutdownDependencies.items():
+            SIMULATION_INSTANCES[instanceKey]['metadata']['items'].append({ "key": constants.SHUTDOWN_DEPENDENCIES_KEY, "value": ",".join(dependents) })
+
+    return SIMULATION_INSTANCES
+
+
+
+#
+# Returns the API calls counted since the last reset and starts counting again
+#
+def simulation_reset_api_calls():
+    with SIMULATION_LOCK:
+        apiCalls = dict(SIMULATION_API_CALLS)
+        SIMULATION_API_CALLS.clear()
+    return apiCalls
+
+
+
+#
+# Returns the operations performed since the last reset and starts recording again
+#
+def simulation_reset_operations():
+    with SIMULATION_LOCK:
+        operations = list(SIMULATION_OPERATIONS)
+        del SIMULATION_OPERATIONS[:]
+    return operations
+
+
+
+def simulation_count_api_call(method, count = 1):
+    with SIMULATION_LOCK:
+        SIMULATION_API_CALLS[method] = SIMULATION_API_CALLS.get(method, 0) + count
+
+
+
+#
+# Returns a copy of the resource, restricted to the top level fields of the mask (if any), like a partial response
+#
+def simulation_copy_resource(resource, fields = None):
+
+    resource = json.loads(json.dumps(resource))
+
+    if fields is not None:
+        fieldNames = set( field.strip().split("/")[0] for field in fields.split(",") )
+        resource = dict( (key, value) for key, value in resource.items() if key in fieldNames )
+
+    return resource
+
+
+
+def simulation_get_project_instances(project, zone):
+    return [ SIMULATION_INSTANCES[instanceKey] for instanceKey in SIMULATION_PROJECT_INSTANCES.get(project, [])
+             if zone == COMPUTE_ALL_ZONES or instanceKey[1] == zone ]
+
+
+
+###########################################################
+#
+# google_compute_utils interface
+#
+###########################################################
+
+def compute_iter_instances (project, zone, prefetchDepth = 0, fields = None):
+
+    instances = simulation_get_project_instances(project, zone)
+    method = "instances.aggregatedList" if zone == COMPUTE_ALL_ZONES else "instances.list"
+    simulation_count_api_call(method, max(1, (len(instances) + SIMULATION_PAGE_SIZE - 1) // SIMULATION_PAGE_SIZE))
+
+    for instance in instances:
+        yield simulation_copy_resource(instance, fields)
+
+
+def compute_list_instances (project, zone, prefetchDepth = 0, fields = None):
+    return list(compute_iter_instances(project, zone, prefetchDepth, fields))
+
+
+def compute_iter_aggregated_instances (project, prefetchDepth = 0, fields = None):
+    return compute_iter_instances(project, COMPUTE_ALL_ZONES, prefetchDepth, fields)
+
+
+def compute_list_aggregated_instances (project, prefetchDepth = 0, fields = None):
+    return list(compute_iter_aggregated_instances(project, prefetchDepth, fields))
+
+
+
+def compute_get_instance(project, zone, instanceName, fields = None):
+
+    simulation_count_api_call("instances.get")
+
+    if (project, zone, instanceName) not in SIMULATION_INSTANCES:
+        raise Exception("404 - The resource 'projects/{0}/zones/{1}/instances/{2}' was not found".format(project, zone, instanceName))
+
+    return simulation_copy_resource(SIMULATION_INSTANCES[(project, zone, instanceName)], fields)
+
+
+
+def compute_batch_get_instances(instances, fields = None, batchSize = apiClientUtils.BATCH_MAX_SIZE):
+
+    instances = list(set(instances))
+    responses = {}
+    errors = {}
+
+    simulation_count_api_call("batch", (len(instances) + batchSize - 1) // batchSize)
+    simulation_count_api_call("instances.get", len(instances))
+
+    for instance in instances:
+        if instance in SIMULATION_INSTANCES:
+            responses[instance] = simulation_copy_resource(SIMULATION_INSTANCES[instance], fields)
+        else:
+            errors[instance] = Exception("404 - The resource 'projects/{0}/zones/{1}/instances/{2}' was not found".format(*instance))
+
+    return responses, errors
+
+
+
+#
+# The cache logic is that of google_compute_utils, only the batch requests are simulated
+#
+def compute_get_instance_statuses(instanceStatuses, instances, batchSize = apiClientUtils.BATCH_MAX_SIZE, batchGetInstances = None):
+    return computeUtils.compute_get_instance_statuses(instanceStatuses, instances, batchSize, batchGetInstances or compute_batch_get_instances)
+
+
+
+def compute_get_metadata_value(project, zone, instanceName, metadataKey, instanceResource = None, refresh = False):
+
+    if instanceResource is None or refresh:
+        fetchedResource = compute_get_instance(project, zone, instanceName, "metadata")
+        if instanceResource is None:
+            instanceResource = fetchedResource
+        else:
+            instanceResource['metadata'] = fetchedResource.get('metadata', {})
+
+    return compute_get_resource_metadata_value(instanceResource, metadataKey)
+
+
+
+#
+# Starts or stops the instances, which reach their final status immediately
+# The requests are counted like those of the real function: one per instance, one wait per operation and the batched status GETs
+#
+def compute_perform_operation_on_instances(instances, operationName, targetOperationStatus = OPERATION_DONE,
+                                           maxRequestsPerSecond = COMPUTE_BULK_OPERATIONS_PER_SECOND, maxWorkers = parallelUtils.DEFAULT_MAX_WORKERS):
+
+    if operationName not in COMPUTE_ALLOWED_OPERATIONS:
+        print "[ERROR] Operation {0} is not allowed".format(operationName)
+        return []
+
+    instances = list(instances)
+    if not instances:
+        return []
+
+    print "[INFO] {0} Compute Instances - Invoking {1} operation".format(len(instances), operationName)
+
+    results = []
+
+    for instance in instances:
+
+        result = { OPERATION_RESULT_INSTANCE: instance,
+                   OPERATION_RESULT_OPERATION: None,
+                   OPERATION_RESULT_STATUS: None,
+                   OPERATION_RESULT_ERROR: None }
+
+        simulation_count_api_call("instances.start" if operationName == COMPUTE_START_OPERATION else "instances.stop")
+
+        if instance in SIMULATION_INSTANCES:
+            simulation_count_api_call("zoneOperations.wait")
+            SIMULATION_INSTANCES[instance]['status'] = RUNNING if operationName == COMPUTE_START_OPERATION else TERMINATED
+            result[OPERATION_RESULT_OPERATION] = "operation-{0}-{1}".format(operationName.lower(), instance[2])
+            result[OPERATION_RESULT_STATUS] = SIMULATION_INSTANCES[instance]['status']
+            with SIMULATION_LOCK:
+                SIMULATION_OPERATIONS.append((operationName, instance))
+            print "[INFO] Compute Instance {0} - Operation: {1} - Status: {2}".format(instance[2], operationName, result[OPERATION_RESULT_STATUS])
+        else:
+            result[OPERATION_RESULT_ERROR] = Exception("404 - The resource 'projects/{0}/zones/{1}/instances/{2}' was not found".format(*instance))
+            print "[ERROR] Compute Instance {0} - Operation: {1} - Error: {2}".format(instance[2], operationName, result[OPERATION_RESULT_ERROR])
+
+        results.append(result)
+
+    simulation_count_api_call("batch", (len(instances) + apiClientUtils.BATCH_MAX_SIZE - 1) // apiClientUtils.BATCH_MAX_SIZE)
+    simulation_count_api_call("instances.get", len(instances))
+
+    return results
+
+
+
+def compute_perform_operation_on_instance(project, zone, instanceName, operationName, targetOperationStatus = OPERATION_DONE):
+    compute_perform_operation_on_instances([(project, zone, instanceName)], operationName, targetOperationStatus)
+    return True
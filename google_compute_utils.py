@@ -3,8 +3,10 @@ import sys
 import re
 import time
 import json
-import googleapiclient.discovery as discovery
 from googleapiclient.errors import HttpError
+import google_api_client_utils as apiClientUtils
+import google_pagination_utils as paginationUtils
+import google_parallel_utils as parallelUtils
 
 #####################################################
 #
@@ -15,12 +17,6 @@ PET_OR_CATTLE_LABEL="pet_or_cattle"
 PET_VALUE="pet"
 CATTLE_VALUE="cattle"
 
-# Singleton style global variables
-# Only one API client is stored at a time
-COMPUTE_API_CLIENT = None
-COMPUTE_API_CLIENT_VERSION = None
-
-
 COMPUTE_START_OPERATION = "START"
 COMPUTE_STOP_OPERATION = "STOP"
 COMPUTE_ALLOWED_OPERATIONS = [COMPUTE_START_OPERATION, COMPUTE_STOP_OPERATION]
@@ -30,6 +26,37 @@ OPERATION_DONE = "DONE"
 OPERATION_RUNNING = "RUNNING"
 OPERATION_PENDING = "PENDING"
 
+# Values of the returnWhen argument of compute_wait_for_operations
+WAIT_ALL_COMPLETED = "ALL_COMPLETED"
+WAIT_FIRST_COMPLETED = "FIRST_COMPLETED"
+
+# Maximum number of start/stop requests per second submitted by compute_perform_operation_on_instances
+# The requests of a bulk operation are spread evenly, so that they do not exhaust the API rate quota of the project
+COMPUTE_BULK_OPERATIONS_PER_SECOND = 10
+
+# Keys of the result dicts returned by compute_perform_operation_on_instances
+OPERATION_RESULT_INSTANCE = "instance"
+OPERATION_RESULT_OPERATION = "operation"
+OPERATION_RESULT_STATUS = "status"
+OPERATION_RESULT_ERROR = "error"
+
+# Maximum number of operations waited for at the same time by compute_wait_for_operations, one long poll (and one thread) each
+COMPUTE_WAIT_MAX_WORKERS = 100
+
+# Seconds between polls of an operation when zoneOperations().wait cannot be used
+# The interval starts at the initial value and is multiplied by the backoff factor after every poll, up to the maximum
+OPERATION_POLL_INITIAL_INTERVAL = 1
+OPERATION_POLL_MAX_INTERVAL = 10
+OPERATION_POLL_BACKOFF = 1.5
+
+# Resource types accepted by compute_set_labels
+COMPUTE_INSTANCE_RESOURCE = "instance"
+COMPUTE_DISK_RESOURCE = "disk"
+
+# Times a label change is retried after its labelFingerprint has become stale (HTTP 412)
+COMPUTE_LABEL_FINGERPRINT_RETRIES = 3
+COMPUTE_LABEL_FINGERPRINT_FIELDS = "labels,labelFingerprint"
+
 # Compute Instace Statuses
 # PROVISIONING, STAGING, RUNNING, STOPPING, STOPPED, SUSPENDING, SUSPENDED, and TERMINATED.
 PROVISIONING = "PROVISIONING"
@@ -41,15 +68,25 @@ SUSPENDING = "SUSPENDING"
 SUSPENDED = "SUSPENDED"
 TERMINATED = "TERMINATED"
 
+# Field masks (partial responses) for the get/list functions below, i.e. the fields each script actually reads
+# The zone is always included, since compute_get_resource_zone relies on it when the instances of every zone are listed
+COMPUTE_INSTANCE_STATUS_FIELDS = "name,zone,status"
+COMPUTE_INSTANCE_LABELS_FIELDS = "name,zone,status,labels"
+COMPUTE_INSTANCE_SCHEDULER_FIELDS = "name,zone,status,labels,metadata"
+COMPUTE_INSTANCE_DELETION_FIELDS = "name,zone,status,labels,labelFingerprint,deletionProtection"
+COMPUTE_INSTANCE_SECURITY_AUDIT_FIELDS = "name,zone,metadata,canIpForward,serviceAccounts"
+COMPUTE_DISK_LABELS_FIELDS = "name,zone,labels"
+COMPUTE_DISK_DELETION_FIELDS = "name,zone,labels,labelFingerprint,users,lastAttachTimestamp,lastDetachTimestamp"
+COMPUTE_PROJECT_METADATA_FIELDS = "name,commonInstanceMetadata"
+
+# Value of the zone arguments that selects the resources of every zone, retrieved with a single aggregatedList
+COMPUTE_ALL_ZONES = "all"
+
 
 # [START compute_get_api_client]
+# The clients are stored per thread and per version in google_api_client_utils
 def compute_get_api_client(version = "v1"):
-    global COMPUTE_API_CLIENT
-    global COMPUTE_API_CLIENT_VERSION
-    if COMPUTE_API_CLIENT == None or COMPUTE_API_CLIENT_VERSION != version:
-        COMPUTE_API_CLIENT = discovery.build('compute', version)
-        COMPUTE_API_CLIENT_VERSION = version
-    return COMPUTE_API_CLIENT
+    return apiClientUtils.api_client_get('compute', version)
 # [END compute_get_api_client]
 
 
@@ -57,8 +94,11 @@ def compute_get_api_client(version = "v1"):
 # Returns the Compute Metadata for the Project
 # https://developers.google.com/resources/api-libraries/documentation/compute/v1/python/latest/compute_v1.projects.html#get
 #
-def compute_get_project(projectId):
-    return compute_get_api_client().projects().get(project = projectId).execute()
+# fields is an optional mask to retrieve only part of the resource, e.g. COMPUTE_PROJECT_METADATA_FIELDS
+# The get/list functions below accept the same argument (for the list functions it applies to each item)
+#
+def compute_get_project(projectId, fields = None):
+    return compute_get_api_client().projects().get(project = projectId, fields = fields).execute()
 
 
 # [START compute_delete_instance]
@@ -71,31 +111,62 @@ def compute_delete_instance(project, zone, name):
 
 
 # [START compute_list_instances]
-def compute_list_instances (project, zone):
-    items = []
-    nextPageToken = None
-    while True:
-        result = {}
-        try:
-            result = compute_get_api_client().instances().list(project=project, zone=zone, pageToken=nextPageToken).execute()  # maxResults is 500 by default
-        except HttpError as e:
-            print "[ERROR] HTTPError {0} Message:{1}".format(e.resp.status, json.loads(e.content)['error']['message'])
-            raise e
-        except:
-            print "[ERROR] Unknown Error listing VM on project {0} in zone {1}".format(project, zone)
-            raise
-
-        if 'items' in result:
-            items = items + result['items']
-            if ('nextPageToken' not in result or result['nextPageToken'] is None): # No more pages
-                return items
-            else: # There are more pages
-                nextPageToken = result['nextPageToken']
-        else: # No (more) VMs found
-            return items
+# Yields the instances in a zone as the pages are retrieved (maxResults is 500 by default)
+# With prefetchDepth > 0 the next pages are requested by a background thread while the current one is processed
+# With zone = COMPUTE_ALL_ZONES the instances of every zone are yielded, use compute_get_resource_zone to find out their zone
+def compute_iter_instances (project, zone, prefetchDepth = 0, fields = None):
+    if zone == COMPUTE_ALL_ZONES:
+        return compute_iter_aggregated_instances(project, prefetchDepth, fields)
+    return compute_iter_zone_instances(project, zone, prefetchDepth, fields)
+
+
+def compute_iter_zone_instances (project, zone, prefetchDepth = 0, fields = None):
+    try:
+        for instance in paginationUtils.paginate(lambda **arguments: compute_get_api_client().instances().list(**arguments), 'items', prefetchDepth = prefetchDepth,
+                                                 project=project, zone=zone, fields=paginationUtils.paginate_fields('items', fields)):
+            yield instance
+    except HttpError as e:
+        print "[ERROR] HTTPError {0} Message:{1}".format(e.resp.status, json.loads(e.content)['error']['message'])
+        raise e
+    except Exception:
+        print "[ERROR] Unknown Error listing VM on project {0} in zone {1}".format(project, zone)
+        raise
+
+
+def compute_list_instances (project, zone, prefetchDepth = 0, fields = None):
+    return list(compute_iter_instances(project, zone, prefetchDepth, fields))
 # [END compute_list_instances]
 
 
+# [START compute_list_aggregated_instances]
+# Yields the instances of every zone of the project using a single paginated aggregatedList
+# instead of one list call per zone. Zones without instances are skipped by the API response itself
+def compute_iter_aggregated_instances (project, prefetchDepth = 0, fields = None):
+    try:
+        for (scope, instance) in paginationUtils.paginate_aggregated(lambda **arguments: compute_get_api_client().instances().aggregatedList(**arguments), 'instances', prefetchDepth = prefetchDepth,
+                                                                     project=project, fields=paginationUtils.paginate_aggregated_fields('instances', fields)):
+            yield instance
+    except HttpError as e:
+        print "[ERROR] HTTPError {0} Message:{1}".format(e.resp.status, json.loads(e.content)['error']['message'])
+        raise e
+    except Exception:
+        print "[ERROR] Unknown Error listing VM on project {0} in all zones".format(project)
+        raise
+
+
+def compute_list_aggregated_instances (project, prefetchDepth = 0, fields = None):
+    return list(compute_iter_aggregated_instances(project, prefetchDepth, fields))
+# [END compute_list_aggregated_instances]
+
+
+#
+# Returns the name of the zone of an instance or disk resource, e.g. "europe-west1-b"
+# The zone field of the resources is the full URL of the zone
+#
+def compute_get_resource_zone(resource):
+    return resource['zone'].split('/')[-1]
+
+
 # [START compute_stop_instance]
 # Return an Operation resoruce JSON object.
 def compute_stop_instance(project, zone, instanceName):
@@ -130,7 +201,7 @@ def compute_perform_operation_on_instance(project, zone, instanceName, operation
 
     # Check the current status of the VM
     if result["status"] == OPERATION_DONE:
-        instanceResource = compute_get_instance(project, zone, instanceName)
+        instanceResource = compute_get_instance(project, zone, instanceName, COMPUTE_INSTANCE_STATUS_FIELDS)
         print "[INFO] Compute Instance {0} - Status: {1}".format(instanceName, instanceResource['status'])
 
     return True
@@ -141,14 +212,148 @@ def compute_perform_operation_on_instance(project, zone, instanceName, operation
 
 
 
+# [START compute_perform_operation_on_instances]
+#
+# Starts or stops many instances at once, each one given as a tuple (project, zone, instanceName)
+#
+# 1. The start/stop requests are submitted concurrently by up to maxWorkers threads, at no more than maxRequestsPerSecond
+# 2. All the returned operations are waited for together (see compute_wait_for_operations)
+# 3. The final status of all the instances is retrieved with batch HTTP requests
+#
+# Returns a list of dicts, in the same order as the instances:
+# { "instance": (project, zone, instanceName), "operation": operation name, "status": final instance status, "error": exception }
+# "error" is None when the operation succeeded. A failure on one instance does not affect the others
+#
+def compute_perform_operation_on_instances(instances, operationName, targetOperationStatus = OPERATION_DONE,
+                                           maxRequestsPerSecond = COMPUTE_BULK_OPERATIONS_PER_SECOND, maxWorkers = parallelUtils.DEFAULT_MAX_WORKERS):
+
+    if operationName not in COMPUTE_ALLOWED_OPERATIONS:
+        print "[ERROR] Operation {0} is not allowed".format(operationName)
+        return []
+
+    instances = list(instances)
+    if not instances:
+        return []
+
+    rateLimit = parallelUtils.parallel_rate_limiter(maxRequestsPerSecond)
+
+    def submit(instance):
+        (project, zone, instanceName) = instance
+        rateLimit()
+        if operationName == COMPUTE_START_OPERATION:
+            return compute_start_instance(project, zone, instanceName)
+        return compute_stop_instance(project, zone, instanceName)
+
+    print "[INFO] {0} Compute Instances - Invoking {1} operation".format(len(instances), operationName)
+
+    results = []
+    resultsByOperation = {} # { (project, zone, operationName): result dict }
+
+    for submission in parallelUtils.parallel_map(submit, instances, maxWorkers):
+        (project, zone, instanceName) = submission[parallelUtils.RESULT_ITEM]
+        result = { OPERATION_RESULT_INSTANCE: submission[parallelUtils.RESULT_ITEM],
+                   OPERATION_RESULT_OPERATION: None,
+                   OPERATION_RESULT_STATUS: None,
+                   OPERATION_RESULT_ERROR: submission[parallelUtils.RESULT_ERROR] }
+        if result[OPERATION_RESULT_ERROR] is None:
+            result[OPERATION_RESULT_OPERATION] = submission[parallelUtils.RESULT_VALUE]['name']
+            resultsByOperation[(project, zone, result[OPERATION_RESULT_OPERATION])] = result
+        results.append(result)
+
+    for waited in compute_wait_for_operations(resultsByOperation.keys(), targetOperationStatus = targetOperationStatus):
+        if waited[parallelUtils.RESULT_ERROR] is not None:
+            resultsByOperation[waited[parallelUtils.RESULT_ITEM]][OPERATION_RESULT_ERROR] = waited[parallelUtils.RESULT_ERROR]
+
+    (instanceResources, errors) = compute_batch_get_instances([ result[OPERATION_RESULT_INSTANCE] for result in results ], fields = COMPUTE_INSTANCE_STATUS_FIELDS)
+
+    for result in results:
+        instance = result[OPERATION_RESULT_INSTANCE]
+        if instance in instanceResources:
+            result[OPERATION_RESULT_STATUS] = instanceResources[instance]['status']
+        elif result[OPERATION_RESULT_ERROR] is None:
+            result[OPERATION_RESULT_ERROR] = errors.get(instance)
+
+        if result[OPERATION_RESULT_ERROR] is not None:
+            print "[ERROR] Compute Instance {0} - Operation: {1} - Error: {2}".format(instance[2], operationName, result[OPERATION_RESULT_ERROR])
+        else:
+            print "[INFO] Compute Instance {0} - Operation: {1} - Status: {2}".format(instance[2], operationName, result[OPERATION_RESULT_STATUS])
+
+    return results
+# [END compute_perform_operation_on_instances]
+
+
+
 # [START compute_get_instance]
 # Return an Operation resoruce JSON object.
-def compute_get_instance(project, zone, instanceName):
-    return compute_get_api_client().instances().get(project=project, zone=zone, instance=instanceName).execute()
+def compute_get_instance(project, zone, instanceName, fields = None):
+    return compute_get_api_client().instances().get(project=project, zone=zone, instance=instanceName, fields=fields).execute()
 # [END compute_get_instance]
 
 
 
+# [START compute_batch_get_instances]
+#
+# Returns a dict { (project, zone, instanceName): instance resource } and a dict { (project, zone, instanceName): exception }
+# The instances.get calls are packed in batch HTTP requests of up to batchSize calls each
+#
+def compute_batch_get_instances(instances, fields = None, batchSize = apiClientUtils.BATCH_MAX_SIZE):
+
+    service = compute_get_api_client()
+    instances = list(set(instances)) # Request IDs must be unique within a batch
+    responses = {}
+    errors = {}
+
+    # The request IDs are the positions of the instances in the list, converted back to the instance tuples in the callback
+    def callback(requestId, response, exception):
+        instance = instances[int(requestId)]
+        if exception is not None:
+            errors[instance] = exception
+        else:
+            responses[instance] = response
+
+    for start in range(0, len(instances), batchSize):
+        batch = service.new_batch_http_request(callback = callback)
+        for index in range(start, min(start + batchSize, len(instances))):
+            (project, zone, instanceName) = instances[index]
+            batch.add(service.instances().get(project=project, zone=zone, instance=instanceName, fields=fields), request_id = str(index))
+        batch.execute()
+
+    return responses, errors
+# [END compute_batch_get_instances]
+
+
+
+# [START compute_instance_status_cache]
+#
+# Instance status cache: a dict { (project, zone, instanceName): status } meant to last for a single run only,
+# since the statuses change over time. It is prefilled with the instances already listed and the missing
+# ones are retrieved with batch requests, so that each instance is requested at most once per run
+# Instances that could not be retrieved are cached as COMPUTE_INSTANCE_NOT_FOUND, so they are not requested again either
+#
+COMPUTE_INSTANCE_NOT_FOUND = None
+
+#
+# Returns a dict { (project, zone, instanceName): status } for the given instances, requesting only those not in the cache
+# Also returns the errors of the instances that had to be requested and could not be retrieved
+#
+# The missing instances are requested with batchGetInstances, compute_batch_get_instances unless another
+# implementation with the same signature is given (e.g. that of google_compute_simulation_utils)
+#
+def compute_get_instance_statuses(instanceStatuses, instances, batchSize = apiClientUtils.BATCH_MAX_SIZE, batchGetInstances = None):
+
+    missingInstances = set( instance for instance in instances if instance not in instanceStatuses )
+    errors = {}
+
+    if missingInstances:
+        (responses, errors) = (batchGetInstances or compute_batch_get_instances)(missingInstances, fields = COMPUTE_INSTANCE_STATUS_FIELDS, batchSize = batchSize)
+        for instance in missingInstances:
+            instanceStatuses[instance] = responses[instance]['status'] if instance in responses else COMPUTE_INSTANCE_NOT_FOUND
+
+    return dict( (instance, instanceStatuses[instance]) for instance in instances ), errors
+# [END compute_instance_status_cache]
+
+
+
 # [START compute_set_instance_label]
 def compute_set_instance_label(project, zone, instanceName, newLabelBody):
     return compute_get_api_client().instances().setLabels(project=project, zone=zone, instance=instanceName, body=newLabelBody).execute()
@@ -158,55 +363,218 @@ def compute_set_instance_label(project, zone, instanceName, newLabelBody):
 
 
 
+# [START compute_get_disk]
+def compute_get_disk(project, zone, diskName, fields = None):
+    return compute_get_api_client().disks().get(project=project, zone=zone, disk=diskName, fields=fields).execute()
+# [END compute_get_disk]
+
+
+
 # [START compute_set_disk_label]
 def compute_set_disk_label(project, zone, diskName, newLabelBody):
     return compute_get_api_client().disks().setLabels(project=project, zone=zone, resource=diskName, body=newLabelBody).execute()
 # [END compute_set_disk_label]
 
 
+
+# [START compute_set_labels]
+#
+# Applies many label changes at once and waits for all the resulting operations together
+#
+# labelChanges is a list of tuples (resourceType, project, resource, labelUpdates) where resourceType is
+# COMPUTE_INSTANCE_RESOURCE or COMPUTE_DISK_RESOURCE, resource is the instance or disk as listed (it must include
+# name, zone, labels and labelFingerprint) and labelUpdates a function that takes the current labels of the resource
+# and returns a dict with the labels to add or change, or None if the resource must be left as it is
+#
+# - The setLabels requests are submitted concurrently by up to maxWorkers threads, spaced to maxRequestsPerSecond in total
+# - Each request carries the labelFingerprint of the resource, so a label set by someone else since the listing is never overwritten.
+#   If the fingerprint has become stale (HTTP 412), the labels are read again, labelUpdates is called again with them
+#   (the labels set in the meantime may change the decision) and the request is sent again, up to maxRetries times
+# - Once submitted, the operations are waited for in bulk, hence the total time is that of the slowest operations
+#
+# Returns the google_parallel_utils result dicts, in the same order as labelChanges, whose "result" is the final Operation resource
+# A skipped change (labelUpdates returned None) has neither result nor error
+# A failed change is reported in the "error" of its result dict and does not stop the others
+#
+def compute_set_labels(labelChanges, maxRequestsPerSecond = COMPUTE_BULK_OPERATIONS_PER_SECOND, maxWorkers = parallelUtils.DEFAULT_MAX_WORKERS,
+                       maxRetries = COMPUTE_LABEL_FINGERPRINT_RETRIES):
+
+    labelChanges = list(labelChanges)
+    if not labelChanges:
+        return []
+
+    rateLimit = parallelUtils.parallel_rate_limiter(maxRequestsPerSecond)
+
+    def submit(labelChange):
+        (resourceType, project, resource, labelUpdates) = labelChange
+        zone = compute_get_resource_zone(resource)
+        labels = resource.get('labels', {})
+        labelFingerprint = resource.get('labelFingerprint')
+
+        for attempt in range(maxRetries + 1):
+            updates = labelUpdates(labels)
+            if updates is None:
+                return None
+
+            newLabels = dict(labels)
+            newLabels.update(updates)
+            newLabelBody = { "labels": newLabels, "labelFingerprint": labelFingerprint }
+
+            rateLimit()
+            try:
+                if resourceType == COMPUTE_INSTANCE_RESOURCE:
+                    operation = compute_set_instance_label(project, zone, resource['name'], newLabelBody)
+                else:
+                    operation = compute_set_disk_label(project, zone, resource['name'], newLabelBody)
+                return (project, zone, operation['name'])
+
+            except HttpError as e:
+                if e.resp.status != 412 or attempt == maxRetries:
+                    raise
+                print "[WARNING] Compute {0} {1} - The labels have changed since they were read, checking them again".format(resourceType, resource['name'])
+
+            rateLimit()
+            if resourceType == COMPUTE_INSTANCE_RESOURCE:
+                currentResource = compute_get_instance(project, zone, resource['name'], COMPUTE_LABEL_FINGERPRINT_FIELDS)
+            else:
+                currentResource = compute_get_disk(project, zone, resource['name'], COMPUTE_LABEL_FINGERPRINT_FIELDS)
+            labels = currentResource.get('labels', {})
+            labelFingerprint = currentResource.get('labelFingerprint')
+
+    results = parallelUtils.parallel_map(submit, labelChanges, maxWorkers)
+    resultsByOperation = dict( (result[parallelUtils.RESULT_VALUE], result) for result in results
+                               if result[parallelUtils.RESULT_ERROR] is None and result[parallelUtils.RESULT_VALUE] is not None )
+
+    for waited in compute_wait_for_operations(resultsByOperation.keys()):
+        result = resultsByOperation[waited[parallelUtils.RESULT_ITEM]]
+        result[parallelUtils.RESULT_VALUE] = waited[parallelUtils.RESULT_VALUE]
+        result[parallelUtils.RESULT_ERROR] = waited[parallelUtils.RESULT_ERROR]
+
+    return results
+# [END compute_set_labels]
+
+
+# [START compute_list_regions]
+def compute_list_regions (project, fields = None):
+    return list(paginationUtils.paginate(lambda **arguments: compute_get_api_client().regions().list(**arguments), 'items',
+                                         project=project, fields=paginationUtils.paginate_fields('items', fields)))
+# [END compute_list_regions]
+
+
 # [START compute_list_disks]
-def compute_list_disks (project, zone):
-    items = []
-    nextPageToken = None
-    while True:
-        result = compute_get_api_client().disks().list(project=project, zone=zone, pageToken=nextPageToken).execute()  # maxResults is 500 by default
-        if 'items' in result:
-            items = items + result['items']
-            if ('nextPageToken' not in result or result['nextPageToken'] is None): # No more pages
-                return items
-            else: # There are more pages
-                nextPageToken = result['nextPageToken']
-        else: # No (more) VMs found
-            return items
+# Yields the disks in a zone as the pages are retrieved (maxResults is 500 by default)
+# With prefetchDepth > 0 the next pages are requested by a background thread while the current one is processed
+# With zone = COMPUTE_ALL_ZONES the disks of every zone are yielded, use compute_get_resource_zone to find out their zone
+def compute_iter_disks (project, zone, prefetchDepth = 0, fields = None):
+    if zone == COMPUTE_ALL_ZONES:
+        return compute_iter_aggregated_disks(project, prefetchDepth, fields)
+    return paginationUtils.paginate(lambda **arguments: compute_get_api_client().disks().list(**arguments), 'items', prefetchDepth = prefetchDepth,
+                                    project=project, zone=zone, fields=paginationUtils.paginate_fields('items', fields))
+
+
+def compute_list_disks (project, zone, prefetchDepth = 0, fields = None):
+    return list(compute_iter_disks(project, zone, prefetchDepth, fields))
 # [END compute_list_disks]
 
 
+# [START compute_list_aggregated_disks]
+# Yields the disks of every zone of the project using a single paginated aggregatedList
+def compute_iter_aggregated_disks (project, prefetchDepth = 0, fields = None):
+    for (scope, disk) in paginationUtils.paginate_aggregated(lambda **arguments: compute_get_api_client().disks().aggregatedList(**arguments), 'disks', prefetchDepth = prefetchDepth,
+                                                             project=project, fields=paginationUtils.paginate_aggregated_fields('disks', fields)):
+        yield disk
+
+
+def compute_list_aggregated_disks (project, prefetchDepth = 0, fields = None):
+    return list(compute_iter_aggregated_disks(project, prefetchDepth, fields))
+# [END compute_list_aggregated_disks]
+
+
+
+#
+# Returns the value of a metadata key of an instance, or None if the key is not set
+#
+# When the caller already holds the instance resource (e.g. from compute_list_instances) it should pass it
+# as instanceResource, so that no API call is made. The instance is only fetched again when no resource
+# is given or when refresh is True (in which case the metadata of the given resource is updated as well)
+#
+def compute_get_metadata_value(project, zone, instanceName, metadataKey, instanceResource = None, refresh = False):
+
+    if instanceResource is None or refresh:
+        fetchedResource = compute_get_instance(project, zone, instanceName, "metadata")
+        if instanceResource is None:
+            instanceResource = fetchedResource
+        else:
+            instanceResource['metadata'] = fetchedResource.get('metadata', {})
+
+    return compute_get_resource_metadata_value(instanceResource, metadataKey)
+
+
+
+#
+# Returns a dict { metadataKey: value } built from the metadata items of an already fetched instance resource
+# The dict is built on every call and owned by the caller, which can keep it to look up several keys with a single scan
+#
+def compute_get_metadata_index(instanceResource):
+
+    metadataIndex = {}
+    for item in (instanceResource.get('metadata') or {}).get('items', []):
+        metadataIndex[item["key"]] = item.get("value")
+
+    return metadataIndex
+
 
-def compute_get_metadata_value(project, zone, instanceName, metadataKey):
 
-    itemValue = None
-    instanceResource = compute_get_instance(project, zone, instanceName)
+#
+# Returns the value of a metadata key of an already fetched instance resource, or None if the key is not set
+#
+def compute_get_resource_metadata_value(instanceResource, metadataKey):
 
-    if "items" in instanceResource['metadata']:
-        for item in instanceResource['metadata']['items']:
-            if item["key"] == metadataKey:
-                itemValue = item["value"]
+    for item in (instanceResource.get('metadata') or {}).get('items', []):
+        if item["key"] == metadataKey:
+            return item.get("value")
 
-    return itemValue
+    return None
 
 
 
 
 
 # [START compute_wait_for_operation]
-def compute_wait_for_operation(project, zone, operation, targetOperationStatus = OPERATION_DONE):
+#
+# Waits until the operation is DONE (or reaches targetOperationStatus) and returns the Operation resource
+#
+# zoneOperations().wait is a long poll: the server answers as soon as the operation is DONE (or after
+# about 2 minutes, in which case it is called again), hence there is no polling delay at all
+# The wait method cannot stop at other statuses (e.g. RUNNING), in which case, or if the method is not
+# available, zoneOperations().get is polled instead, with an interval that backs off from
+# OPERATION_POLL_INITIAL_INTERVAL to OPERATION_POLL_MAX_INTERVAL seconds
+#
+def compute_wait_for_operation(project, zone, operation, targetOperationStatus = OPERATION_DONE, showProgress = True):
+
+    useWait = ( targetOperationStatus == OPERATION_DONE )
+    pollInterval = OPERATION_POLL_INITIAL_INTERVAL
+
     while True:
-        sys.stdout.write('.')
-        sys.stdout.flush()
-        result = compute_get_api_client().zoneOperations().get(
-            project=project,
-            zone=zone,
-            operation=operation).execute()
+        if showProgress:
+            sys.stdout.write('.')
+            sys.stdout.flush()
+
+        if useWait:
+            try:
+                result = compute_get_api_client().zoneOperations().wait(
+                    project=project,
+                    zone=zone,
+                    operation=operation).execute()
+            except (HttpError, AttributeError) as e:
+                print "\n[WARNING] Operation {0} - zoneOperations().wait failed, polling instead: {1}".format(operation, e)
+                useWait = False
+                continue
+        else:
+            result = compute_get_api_client().zoneOperations().get(
+                project=project,
+                zone=zone,
+                operation=operation).execute()
 
         #if "warnings" in result and len(result['warnings'])>0:
         #    for warning in result['warnings']:
@@ -218,5 +586,43 @@ def compute_wait_for_operation(project, zone, operation, targetOperationStatus =
                 raise Exception(result['error'])
             return result
 
-        time.sleep(5)
+        if not useWait:
+            time.sleep(pollInterval)
+            pollInterval = min(pollInterval * OPERATION_POLL_BACKOFF, OPERATION_POLL_MAX_INTERVAL)
 # [END compute_wait_for_operation]
+
+
+
+# [START compute_wait_for_operations]
+#
+# Waits for many operations at once, each one given as a tuple (project, zone, operationName)
+#
+# Each operation is waited for by its own worker thread, so the total time is that of the slowest operation rather than
+# the sum of all of them. There are as many threads as operations, up to maxWorkers (COMPUTE_WAIT_MAX_WORKERS by default).
+# Beyond that the remaining operations are waited for as threads become free, by which time most of them are already DONE
+# Returns the google_parallel_utils result dicts, whose "result" is the final Operation resource,
+# in completion order: all of them with WAIT_ALL_COMPLETED or only the first one with WAIT_FIRST_COMPLETED
+# A failed operation is reported in the "error" of its result dict and does not stop the others
+#
+def compute_wait_for_operations(operations, returnWhen = WAIT_ALL_COMPLETED, targetOperationStatus = OPERATION_DONE, maxWorkers = COMPUTE_WAIT_MAX_WORKERS):
+
+    results = []
+    operations = list(operations)
+    if not operations:
+        return results
+
+    def wait(operation):
+        (project, zone, operationName) = operation
+        return compute_wait_for_operation(project, zone, operationName, targetOperationStatus, showProgress = False)
+
+    completed = parallelUtils.parallel_as_completed(wait, operations, min(len(operations), maxWorkers))
+    try:
+        for result in completed:
+            results.append(result)
+            if returnWhen == WAIT_FIRST_COMPLETED:
+                break
+    finally:
+        completed.close()
+
+    return results
+# [END compute_wait_for_operations]
@@ -70,17 +70,6 @@ SCHEDULER_SCHEDULE_REGEX = "^{0}\s+{0}\s+{1}\s+{2}\s+{3}$".format(TIME_REGEX, SC
 MONTHS = { "JAN":1, "FEB":2, "MAR":3, "APR":4, "MAY":5, "JUN":6, "JUL":7, "AUG":8, "SEP":9, "OCT":10, "NOV":11, "DEC":12 }
 DAYS_OF_WEEK = { "MON":0, "TUE":1, "WED":2, "THU":3, "FRI":4, "SAT":5, "SUN":6 }
 
-SCHEDULE_ENTRY_TYPE_LIST = "LIST"
-SCHEDULE_ENTRY_TYPE_LIST_WITH_RANGES = "LIST_WITH_RANGES"
-SCHEDULE_ENTRY_TYPE_RANGE = "RANGE"
-SCHEDULE_ENTRY_TYPE_SINGLE = "SINGLE"
-SCHEDULE_ENTRY_TYPE_ANY = "ANY"
-SCHEDULE_ENTRY_TYPE_TIME = "TIME"
-
-LESS_OR_EQUAL = "<="
-GREATER_OR_EQUAL = ">="
-EQUAL = "=="
-
 
 ###############################################
 #
@@ -1,10 +1,15 @@
 #!/usr/bin/python
+import os
 import sys
 import re
 import time
 import inspect
+import threading
+from google.api_core import grpc_helpers
 from google.cloud import dataproc_v1
 from google.cloud.dataproc_v1.gapic.transports import cluster_controller_grpc_transport
+import google_parallel_utils as parallelUtils
+import google_compute_utils as computeUtils
 
 
 
@@ -41,14 +46,57 @@ def clusterObjectToDict(clusterObj):
 
 
 
+# One ClusterControllerClient (and hence one gRPC channel) is kept per region and reused by every call
+# gRPC channels and the clients built on top of them are thread-safe
+DATAPROC_CLIENTS = {}
+DATAPROC_CLIENTS_LOCK = threading.Lock()
+
+# Keepalive pings keep the channels warm between calls, so that they are not silently dropped while idle
+DATAPROC_CHANNEL_OPTIONS = [
+    ('grpc.keepalive_time_ms', 30000),
+    ('grpc.keepalive_timeout_ms', 10000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+]
+
+# OAuth scopes requested for the credentials of the gRPC channels
+DATAPROC_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+# Seconds to wait for the label updates of the clusters to be done
+DATAPROC_LABEL_UPDATE_TIMEOUT = 300
+
+# Value of the regions argument to list the clusters of every region
+DATAPROC_ALL_REGIONS = "all"
+
+# { project: names of every region }, retrieved from the Compute API of each project the first time they are needed
+DATAPROC_PROJECT_REGIONS = {}
+DATAPROC_PROJECT_REGIONS_LOCK = threading.Lock()
+
+# Regions listed instead of every region when those of a project cannot be retrieved (e.g. the Compute API is not enabled)
+# Comma separated list, which can be set via environment variable. By default no region is listed in that case
+DATAPROC_FALLBACK_REGIONS = [ region.strip() for region in os.environ.get("GRB_GCP_DATAPROC_FALLBACK_REGIONS", "").split(",") if region.strip() ]
+
+DATAPROC_INACTIVE_FILTER = "status.state = INACTIVE"
+
+
 #
 # google.api_core.exceptions.InvalidArgument: 400 Region 'europe-west1' specified in request does not match endpoint region 'global'.
 # To use 'europe-west1' region, specify 'europe-west1' region in request and configure client to use 'europe-west1-dataproc.googleapis.com:443' endpoint.
 #
+# The client for each region is built the first time it is requested, the TLS and HTTP/2 setup of its channel is paid only once
+#
 def dataproc_get_client(region):
 
-    transport = cluster_controller_grpc_transport.ClusterControllerGrpcTransport(address="{0}-dataproc.googleapis.com:443".format(region))
-    return dataproc_v1.ClusterControllerClient(transport)
+    with DATAPROC_CLIENTS_LOCK:
+
+        if region not in DATAPROC_CLIENTS:
+            channel = grpc_helpers.create_channel("{0}-dataproc.googleapis.com:443".format(region),
+                                                  scopes = DATAPROC_SCOPES,
+                                                  options = DATAPROC_CHANNEL_OPTIONS)
+            transport = cluster_controller_grpc_transport.ClusterControllerGrpcTransport(channel = channel)
+            DATAPROC_CLIENTS[region] = dataproc_v1.ClusterControllerClient(transport)
+
+        return DATAPROC_CLIENTS[region]
 
 
 #
@@ -82,7 +130,7 @@ def dataproc_list_inactive_clusters(project, region):
     clusterList = []
 
     try:
-        clusterList = list(dataproc_get_client(region).list_clusters(project, region, filter_ = "status.state = INACTIVE"))
+        clusterList = list(dataproc_get_client(region).list_clusters(project, region, filter_ = DATAPROC_INACTIVE_FILTER))
     except Exception as e:
         print "\n[WARN] {0}".format(e.message)
         return []
@@ -94,6 +142,99 @@ def dataproc_list_inactive_clusters(project, region):
 
 
 
+#
+# Returns the list of regions to look for clusters in: the given ones or, if the list contains DATAPROC_ALL_REGIONS,
+# every region (as listed by the Compute API of the project the first time, and kept for the rest of the process)
+#
+# If the regions of the project cannot be listed, the error is reported and DATAPROC_FALLBACK_REGIONS is returned instead
+# (not kept, so that the next call tries again). The error is also appended to errors, if given, as a tuple (project, exception)
+#
+def dataproc_get_regions(project, regions, errors = None):
+
+    if DATAPROC_ALL_REGIONS not in regions:
+        return list(regions)
+
+    with DATAPROC_PROJECT_REGIONS_LOCK:
+        if project in DATAPROC_PROJECT_REGIONS:
+            return list(DATAPROC_PROJECT_REGIONS[project])
+
+    try:
+        projectRegions = sorted( region['name'] for region in computeUtils.compute_list_regions(project, fields = "name") )
+    except Exception as e:
+        print "[ERROR] [ Project {0} ] - The regions could not be listed, looking for Dataproc clusters in {1} instead: {2}".format(
+            project, DATAPROC_FALLBACK_REGIONS or "no region", e)
+        if errors is not None:
+            errors.append( (project, e) )
+        return list(DATAPROC_FALLBACK_REGIONS)
+
+    with DATAPROC_PROJECT_REGIONS_LOCK:
+        DATAPROC_PROJECT_REGIONS[project] = projectRegions
+
+    return list(projectRegions)
+
+
+
+#
+#   Yields the clusters of a project in several regions (see dataproc_get_regions) as dicts like those of dataproc_list_clusters
+#   with an additional "region" key
+#
+#   The regions are listed concurrently, each one through its own cached client (see dataproc_get_client), and the clusters
+#   are yielded as soon as the listing of their region is complete, hence the wall time is that of the slowest region
+#   A region that cannot be listed is reported and skipped, like in dataproc_list_clusters
+#
+#   If listedRegions is a list, the regions that could be listed are appended to it, so that the caller can tell
+#   a region without clusters from a region whose clusters are unknown
+#   If failedRegions is a list, the regions that could not be listed are appended to it as tuples (region, exception),
+#   or (DATAPROC_ALL_REGIONS, exception) if the regions of the project could not be retrieved (see dataproc_get_regions)
+#
+def dataproc_iter_clusters_in_regions(project, regions, filter_ = None, maxWorkers = parallelUtils.DEFAULT_MAX_WORKERS, listedRegions = None, failedRegions = None):
+
+    def listRegion(region):
+        if filter_ is None:
+            return list(dataproc_get_client(region).list_clusters(project, region))
+        return list(dataproc_get_client(region).list_clusters(project, region, filter_ = filter_))
+
+    regionErrors = []
+    regionsToList = dataproc_get_regions(project, regions, regionErrors)
+    if failedRegions is not None:
+        failedRegions.extend( (DATAPROC_ALL_REGIONS, e) for (failedProject, e) in regionErrors )
+
+    completed = parallelUtils.parallel_as_completed(listRegion, regionsToList, maxWorkers)
+    try:
+        for result in completed:
+            region = result[parallelUtils.RESULT_ITEM]
+            if result[parallelUtils.RESULT_ERROR] is not None:
+                print "\n[WARN] Region {0} - {1}".format(region, getattr(result[parallelUtils.RESULT_ERROR], 'message', result[parallelUtils.RESULT_ERROR]))
+                if failedRegions is not None:
+                    failedRegions.append( (region, result[parallelUtils.RESULT_ERROR]) )
+                continue
+            if listedRegions is not None:
+                listedRegions.append(region)
+            for clusterObj in result[parallelUtils.RESULT_VALUE]:
+                cluster = clusterObjectToDict(clusterObj)
+                cluster['region'] = region
+                yield cluster
+    finally:
+        completed.close()
+
+
+
+#
+# Returns the clusters of a project in several regions, sorted by region and name
+# The regions that could (or could not) be listed are appended to listedRegions (failedRegions), if given (see dataproc_iter_clusters_in_regions)
+#
+def dataproc_list_clusters_in_regions(project, regions, maxWorkers = parallelUtils.DEFAULT_MAX_WORKERS, listedRegions = None, failedRegions = None):
+    return sorted(dataproc_iter_clusters_in_regions(project, regions, maxWorkers = maxWorkers, listedRegions = listedRegions, failedRegions = failedRegions),
+                  key = lambda cluster: (cluster['region'], cluster['name']))
+
+
+
+def dataproc_list_inactive_clusters_in_regions(project, regions, maxWorkers = parallelUtils.DEFAULT_MAX_WORKERS, listedRegions = None, failedRegions = None):
+    return sorted(dataproc_iter_clusters_in_regions(project, regions, DATAPROC_INACTIVE_FILTER, maxWorkers, listedRegions, failedRegions),
+                  key = lambda cluster: (cluster['region'], cluster['name']))
+
+
+
 def dataproc_get_cluster(project, region, clusterName):
 
     cluster = None
@@ -107,25 +248,57 @@ def dataproc_get_cluster(project, region, clusterName):
 
 
 #
-# Not used because the script finishes before the callback completes, but could be used to trigger actions
+#   This function is better understood by looking at the REST API
+#   https://cloud.google.com/dataproc/docs/reference/rest/v1/projects.regions.clusters/patch
 #
-def dataproc_set_cluster_labels_callback(operation_future):
-    print "[DEBUG] Dataproc Set Cluster Labels callback result: {0}".format(operation_future.result())
-    return operation_future.result()
+#   Sets the labels of a single cluster and waits until the update is done (see dataproc_set_clusters_labels)
+#
+def dataproc_set_cluster_labels(project, region, clusterName, labels, timeout = DATAPROC_LABEL_UPDATE_TIMEOUT):
+
+    result = dataproc_set_clusters_labels(project, region, { clusterName: labels }, timeout)[0]
+
+    if result[parallelUtils.RESULT_ERROR] is not None:
+        print "\n[ERROR] {0}".format(result[parallelUtils.RESULT_ERROR])
+        raise result[parallelUtils.RESULT_ERROR] #Let the Exception flow up
+
+    return result[parallelUtils.RESULT_VALUE]
+
 
 
 #
-#   This function is better understood by looking at the REST API
-#   https://cloud.google.com/dataproc/docs/reference/rest/v1/projects.regions.clusters/patch
+#   Sets the labels of many clusters of a region at once
+#
+#   clustersLabels is a dict { clusterName: labels }. The update_cluster requests are submitted concurrently,
+#   each one returning the future of a long running operation, and then all the futures are waited for until
+#   they are done or the deadline (timeout seconds after the submission) has passed, whichever comes first
 #
-def dataproc_set_cluster_labels(project, region, clusterName, labels):
+#   Returns the google_parallel_utils result dicts, sorted by cluster name, whose "result" is the updated cluster
+#   (as returned by clusterObjectToDict). A cluster that could not be updated, or whose update was not done
+#   before the deadline, is reported in the "error" of its result dict and does not stop the others
+#
+def dataproc_set_clusters_labels(project, region, clustersLabels, timeout = DATAPROC_LABEL_UPDATE_TIMEOUT, maxWorkers = parallelUtils.DEFAULT_MAX_WORKERS):
 
-    changes = { "labels": labels}
     update_mask = { "paths": ["labels"] }
-    response = None
-    try:
-        response = dataproc_get_client(region).update_cluster(project, region, clusterName, changes, update_mask)
-        response.add_done_callback(dataproc_set_cluster_labels_callback)
-    except Exception as e:
-        print "\n[ERROR] {0}".format(e.message)
-        raise #Let the Exception flow up
+
+    def submit(clusterName):
+        return dataproc_get_client(region).update_cluster(project, region, clusterName, { "labels": clustersLabels[clusterName] }, update_mask)
+
+    results = parallelUtils.parallel_map(submit, sorted(clustersLabels), maxWorkers)
+    deadline = time.time() + timeout
+
+    for result in results:
+
+        if result[parallelUtils.RESULT_ERROR] is not None:
+            continue
+
+        operationFuture = result[parallelUtils.RESULT_VALUE]
+        result[parallelUtils.RESULT_VALUE] = None
+
+        try:
+            result[parallelUtils.RESULT_VALUE] = clusterObjectToDict(operationFuture.result(timeout = max(0, deadline - time.time())))
+        except Exception as e:
+            if not operationFuture.done():
+                e = Exception("The labels of the Dataproc Cluster {0} were not updated within {1} seconds".format(result[parallelUtils.RESULT_ITEM], timeout))
+            result[parallelUtils.RESULT_ERROR] = e
+
+    return results
@@ -3,15 +3,15 @@ import os,sys
 import json
 import httplib2
 import google_constants as constants
-from googleapiclient import discovery
+import google_api_client_utils as apiClientUtils
 
 import oauth2client
 from oauth2client import client
 from oauth2client import tools
 from oauth2client.file import Storage
 
-DIRECTORY_API_CLIENT = None
-DIRECTORY_API_CLIENT_VERSION = None
+import google_pagination_utils as paginationUtils
+
 
 
 #
@@ -51,21 +51,20 @@ def get_credentials():
     return credentials
 
 
+# The API clients built with DIRECTORY_CREDENTIALS (e.g. cloudresourcemanager v2) use these credentials
+# They are loaded from the credential store only once, by google_api_client_utils.credentials_get
+apiClientUtils.api_client_register_credentials(apiClientUtils.DIRECTORY_CREDENTIALS, get_credentials)
+
+
 
 #
 # API at https://developers.google.com/admin-sdk/directory/v1/reference/
 #
+# The clients are stored per thread in google_api_client_utils, hence the credentials
+# are only loaded when a thread builds its client
+#
 def directory_get_api_client(version = "directory_v1"):
-    global DIRECTORY_API_CLIENT
-    global DIRECTORY_API_CLIENT_VERSION
-
-    credentials = get_credentials()
-    http = credentials.authorize(httplib2.Http())
-
-    if DIRECTORY_API_CLIENT == None or DIRECTORY_API_CLIENT_VERSION != version:
-        DIRECTORY_API_CLIENT = discovery.build('admin', 'directory_v1', http=http)
-        DIRECTORY_API_CLIENT_VERSION = version
-    return DIRECTORY_API_CLIENT
+    return apiClientUtils.api_client_get('admin', version, apiClientUtils.DIRECTORY_CREDENTIALS)
 
 
 
@@ -83,70 +82,31 @@ def directory_get_group(groupKey):
 
 
 #
-# The projects.list() method specifies that there is a limit to the number of projects returned on each call
+# The list() methods specify that there is a limit to the number of items returned on each call
 # A nextPageToken will be return in case the list has been truncated
 #
-def directory_get_groups(requestedPageSize = 200):
-
-    service = directory_get_api_client()
-    groups = []
-    nextPageToken = None
-
-    while True:
-
-        result = service.groups().list(domain = "grbgcpdevops.net", maxResults=requestedPageSize, orderBy='email', pageToken=nextPageToken).execute()
-
-        if 'groups' in result:
-            groups.extend(result.get("groups"))
-
-            if ('nextPageToken' not in result or result['nextPageToken'] is None): # No more pages
-                return groups
-            else: # There are more pages
-                nextPageToken = result['nextPageToken']
-
-        else: # No (more) groups found
-            return groups
-
-
-def directory_get_group_members(groupKey, requestedPageSize = 200):
-
-    service = directory_get_api_client()
-    members = []
-    nextPageToken = None
-
-    while True:
-
-        result = service.members().list(groupKey=groupKey, maxResults=requestedPageSize, pageToken=nextPageToken).execute()
-
-        if 'members' in result:
-            members.extend(result.get("members"))
-
-            if ('nextPageToken' not in result or result['nextPageToken'] is None): # No more pages
-                return members
-            else: # There are more pages
-                nextPageToken = result['nextPageToken']
+# The directory_iter_* generators yield the items as the pages are retrieved
+# With prefetchDepth > 0 the next pages are requested by a background thread while the current one is processed
+#
+def directory_iter_groups(requestedPageSize = 200, prefetchDepth = 0):
+    return paginationUtils.paginate(lambda **arguments: directory_get_api_client().groups().list(**arguments), 'groups', prefetchDepth = prefetchDepth, domain = "grbgcpdevops.net", maxResults = requestedPageSize, orderBy = 'email')
 
-        else: # No (more) members found
-            return members
 
+def directory_get_groups(requestedPageSize = 200, prefetchDepth = 0):
+    return list(directory_iter_groups(requestedPageSize, prefetchDepth))
 
 
-def directory_get_users(requestedPageSize = 500):
+def directory_iter_group_members(groupKey, requestedPageSize = 200, prefetchDepth = 0):
+    return paginationUtils.paginate(lambda **arguments: directory_get_api_client().members().list(**arguments), 'members', prefetchDepth = prefetchDepth, groupKey = groupKey, maxResults = requestedPageSize)
 
-    users = []
-    nextPageToken = None
 
-    while True:
+def directory_get_group_members(groupKey, requestedPageSize = 200, prefetchDepth = 0):
+    return list(directory_iter_group_members(groupKey, requestedPageSize, prefetchDepth))
 
-        result = directory_get_api_client().users().list(domain="grbgcpdevops.net", maxResults=requestedPageSize, orderBy='email', pageToken=nextPageToken).execute()
 
-        if 'users' in result:
-            users.extend(result.get("users"))
+def directory_iter_users(requestedPageSize = 500, prefetchDepth = 0):
+    return paginationUtils.paginate(lambda **arguments: directory_get_api_client().users().list(**arguments), 'users', prefetchDepth = prefetchDepth, domain = "grbgcpdevops.net", maxResults = requestedPageSize, orderBy = 'email')
 
-            if ('nextPageToken' not in result or result['nextPageToken'] is None): # No more pages
-                return users
-            else: # There are more pages
-                nextPageToken = result['nextPageToken']
 
-        else: # No (more) users found
-            return users
+def directory_get_users(requestedPageSize = 500, prefetchDepth = 0):
+    return list(directory_iter_users(requestedPageSize, prefetchDepth))
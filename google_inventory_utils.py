@@ -0,0 +1,395 @@
+#!/usr/bin/python
+import os
+import sys
+import time
+import json
+import sqlite3
+import threading
+import google_constants as constants
+import google_cloudresourcemanager_utils as cloudResourceManagerUtils
+import google_compute_utils as computeUtils
+
+################################################################################
+#
+#   LOCAL INVENTORY CACHE
+#
+#   Projects (and their labels), folders and compute instances are stored in a
+#   local SQLite database, so that repeated runs of the scripts do not need to
+#   list the whole organisation again
+#
+#   - Every listing (e.g. the projects matching a filter, the folders under a
+#     parent or the instances in a zone) has a fetch timestamp
+#   - Listings older than the TTL are fetched again from the APIs the next time
+#     they are requested, and so are listings requested with refresh = True
+#   - Every stored resource keeps the timestamp of its last fetch
+#
+#   The inventory also holds the expiry index: the deletion date of every
+#   resource marked for deletion, indexed by date, so that the resources past
+#   their grace period can be found without listing any project
+#   Unlike the listings, the index cannot be fetched again from the APIs, hence
+#   it is neither dropped nor cleared with them. Its tables are migrated instead
+#   (see EXPIRY_INDEX_MIGRATIONS)
+#
+#   Use scripts/google_inventory_refresh.py to refresh or clear the inventory
+#
+###############################################################################
+
+# Location of the database, which can be overridden via environment variable
+INVENTORY_DB_PATH = os.environ.get("GRB_GCP_INVENTORY_DB", os.path.join(os.path.expanduser('~'), '.cache', 'grb-gcp-python', 'inventory.sqlite'))
+
+# Seconds after which a listing is considered stale
+INVENTORY_TTL = int(os.environ.get("GRB_GCP_INVENTORY_TTL", 3600))
+
+# Increase it whenever the schema changes. The inventory is only a cache, so the old tables are simply dropped
+INVENTORY_SCHEMA_VERSION = 1
+
+INVENTORY_TABLES = ["fetches", "projects", "project_labels", "project_listings", "folders", "instances"]
+
+INVENTORY_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS fetches ( scope TEXT PRIMARY KEY, fetchedAt REAL NOT NULL );
+
+CREATE TABLE IF NOT EXISTS projects ( projectId TEXT PRIMARY KEY, lifecycleState TEXT, resource TEXT NOT NULL, fetchedAt REAL NOT NULL );
+CREATE TABLE IF NOT EXISTS project_labels ( projectId TEXT NOT NULL, label TEXT NOT NULL, value TEXT, PRIMARY KEY (projectId, label) );
+CREATE INDEX IF NOT EXISTS project_labels_by_label ON project_labels ( label, value );
+CREATE TABLE IF NOT EXISTS project_listings ( scope TEXT NOT NULL, position INTEGER NOT NULL, projectId TEXT NOT NULL, PRIMARY KEY (scope, position) );
+
+CREATE TABLE IF NOT EXISTS folders ( name TEXT PRIMARY KEY, parent TEXT, resource TEXT NOT NULL, fetchedAt REAL NOT NULL );
+CREATE INDEX IF NOT EXISTS folders_by_parent ON folders ( parent );
+
+CREATE TABLE IF NOT EXISTS instances ( project TEXT NOT NULL, zone TEXT NOT NULL, name TEXT NOT NULL, status TEXT, resource TEXT NOT NULL, fetchedAt REAL NOT NULL, PRIMARY KEY (project, zone, name) );
+'''
+
+# Scripts that bring the expiry index tables from one version to the next: the first one creates them (version 1) and so on
+# Append a script whenever these tables change, the existing entries are kept. The version reached is stored in expiry_index_schema
+EXPIRY_INDEX_MIGRATIONS = [
+'''
+CREATE TABLE IF NOT EXISTS expiry_index ( resourceType TEXT NOT NULL, project TEXT NOT NULL, location TEXT NOT NULL, name TEXT NOT NULL, expiresOn TEXT NOT NULL, indexedAt REAL NOT NULL, PRIMARY KEY (resourceType, project, location, name) );
+CREATE INDEX IF NOT EXISTS expiry_index_by_date ON expiry_index ( expiresOn );
+CREATE TABLE IF NOT EXISTS expiry_index_syncs ( project TEXT NOT NULL, resourceType TEXT NOT NULL, syncedAt REAL NOT NULL, PRIMARY KEY (project, resourceType) );
+''',
+]
+
+# SQLite connections cannot be shared between threads, hence one is opened per thread
+INVENTORY_CONNECTIONS = threading.local()
+
+
+
+#
+# Returns the connection of the current thread to the inventory database, creating the schema if needed
+#
+def inventory_get_connection():
+
+    connection = getattr(INVENTORY_CONNECTIONS, 'connection', None)
+
+    if connection is None:
+
+        inventoryDir = os.path.dirname(INVENTORY_DB_PATH)
+        if inventoryDir and not os.path.exists(inventoryDir):
+            os.makedirs(inventoryDir)
+
+        connection = sqlite3.connect(INVENTORY_DB_PATH, timeout = 30)
+
+        if connection.execute("PRAGMA user_version").fetchone()[0] != INVENTORY_SCHEMA_VERSION:
+            with connection:
+                for table in INVENTORY_TABLES:
+                    connection.execute("DROP TABLE IF EXISTS {0}".format(table))
+            connection.execute("PRAGMA user_version = {0}".format(INVENTORY_SCHEMA_VERSION))
+
+        connection.executescript(INVENTORY_SCHEMA)
+        inventory_migrate_expiry_index(connection)
+        INVENTORY_CONNECTIONS.connection = connection
+
+    return connection
+
+
+
+#
+# Runs the EXPIRY_INDEX_MIGRATIONS scripts that have not been applied to the database yet
+#
+def inventory_migrate_expiry_index(connection):
+
+    with connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS expiry_index_schema ( version INTEGER NOT NULL )")
+        row = connection.execute("SELECT version FROM expiry_index_schema").fetchone()
+        version = row[0] if row is not None else 0
+
+    if version >= len(EXPIRY_INDEX_MIGRATIONS):
+        return
+
+    for migration in EXPIRY_INDEX_MIGRATIONS[version:]:
+        connection.executescript(migration)
+
+    with connection:
+        connection.execute("DELETE FROM expiry_index_schema")
+        connection.execute("INSERT INTO expiry_index_schema (version) VALUES (?)", (len(EXPIRY_INDEX_MIGRATIONS),))
+
+
+
+#
+# Returns True if the listing identified by scope was fetched less than ttl seconds ago
+#
+def inventory_is_fresh(connection, scope, ttl):
+    row = connection.execute("SELECT fetchedAt FROM fetches WHERE scope = ?", (scope,)).fetchone()
+    return row is not None and time.time() - row[0] < ttl
+
+
+
+def inventory_set_fetched(connection, scope, fetchedAt):
+    connection.execute("INSERT OR REPLACE INTO fetches (scope, fetchedAt) VALUES (?, ?)", (scope, fetchedAt))
+
+
+
+#
+# Removes every listing (and resource) from the inventory, or only the listings whose scope starts with scopePrefix
+# The next request for an invalidated listing will fetch it again from the APIs
+# The expiry index is kept, since it cannot be fetched again
+#
+def inventory_invalidate(scopePrefix = None):
+
+    connection = inventory_get_connection()
+
+    with connection:
+        if scopePrefix is None:
+            for table in INVENTORY_TABLES:
+                connection.execute("DELETE FROM {0}".format(table))
+        else:
+            connection.execute("DELETE FROM fetches WHERE substr(scope, 1, ?) = ?", (len(scopePrefix), scopePrefix))
+
+
+
+###########################################################
+#
+# Projects
+#
+###########################################################
+
+#
+# Returns the projects in the given lifecycle state that match the filter, like cloudresourcemanager_get_projects
+# The list is answered from the inventory unless it is older than ttl seconds or refresh is True
+#
+def inventory_get_projects(projectFilter = constants.PROJECT_FILTER, lifecycleState = "ACTIVE", ttl = INVENTORY_TTL, refresh = False):
+
+    connection = inventory_get_connection()
+    scope = "projects|{0}|{1}".format(projectFilter, lifecycleState)
+
+    if refresh or not inventory_is_fresh(connection, scope, ttl):
+
+        projects = cloudResourceManagerUtils.cloudresourcemanager_get_projects(projectFilter = projectFilter, lifecycleState = lifecycleState)
+        fetchedAt = time.time()
+
+        with connection:
+            connection.execute("DELETE FROM project_listings WHERE scope = ?", (scope,))
+            for position, project in enumerate(projects):
+                inventory_store_project(connection, project, fetchedAt)
+                connection.execute("INSERT INTO project_listings (scope, position, projectId) VALUES (?, ?, ?)", (scope, position, project['projectId']))
+            inventory_set_fetched(connection, scope, fetchedAt)
+
+        return projects
+
+    rows = connection.execute("SELECT p.resource FROM project_listings l JOIN projects p ON p.projectId = l.projectId WHERE l.scope = ? ORDER BY l.position", (scope,))
+    return [ json.loads(row[0]) for row in rows ]
+
+
+
+def inventory_store_project(connection, project, fetchedAt):
+
+    connection.execute("INSERT OR REPLACE INTO projects (projectId, lifecycleState, resource, fetchedAt) VALUES (?, ?, ?, ?)",
+                       (project['projectId'], project.get('lifecycleState'), json.dumps(project), fetchedAt))
+
+    connection.execute("DELETE FROM project_labels WHERE projectId = ?", (project['projectId'],))
+    for label, value in project.get('labels', {}).items():
+        connection.execute("INSERT INTO project_labels (projectId, label, value) VALUES (?, ?, ?)", (project['projectId'], label, value))
+
+
+
+#
+# Returns the IDs of the projects in the given lifecycle state that match the filter, like cloudresourcemanager_get_project_ids
+#
+def inventory_get_project_ids(projectFilter = constants.PROJECT_FILTER, lifecycleState = "ACTIVE", ttl = INVENTORY_TTL, refresh = False):
+    return [ project['projectId'] for project in inventory_get_projects(projectFilter, lifecycleState, ttl, refresh) ]
+
+
+
+#
+# Returns all ACTIVE projects accesible by the user, like cloudresourcemanager_get_all_projects
+#
+def inventory_get_all_projects(ttl = INVENTORY_TTL, refresh = False):
+    return inventory_get_projects(ttl = ttl, refresh = refresh)
+
+
+
+#
+# Returns the IDs of the stored projects that have a label set to a value
+# Only the projects already in the inventory are considered, no API call is made
+#
+def inventory_get_project_ids_with_label(label, value):
+    rows = inventory_get_connection().execute("SELECT projectId FROM project_labels WHERE label = ? AND value = ? ORDER BY projectId", (label, value))
+    return [ row[0] for row in rows ]
+
+
+
+###########################################################
+#
+# Folders
+#
+###########################################################
+
+#
+# Returns all folders under a specified parent, like cloudresourcemanager_get_folders
+#
+def inventory_get_folders(parent, ttl = INVENTORY_TTL, refresh = False):
+
+    connection = inventory_get_connection()
+    scope = "folders|{0}".format(parent)
+
+    if refresh or not inventory_is_fresh(connection, scope, ttl):
+
+        folders = cloudResourceManagerUtils.cloudresourcemanager_get_folders(parent)
+        fetchedAt = time.time()
+
+        with connection:
+            connection.execute("DELETE FROM folders WHERE parent = ?", (parent,))
+            for folder in folders:
+                connection.execute("INSERT OR REPLACE INTO folders (name, parent, resource, fetchedAt) VALUES (?, ?, ?, ?)", (folder['name'], parent, json.dumps(folder), fetchedAt))
+            inventory_set_fetched(connection, scope, fetchedAt)
+
+        return folders
+
+    rows = connection.execute("SELECT resource FROM folders WHERE parent = ? ORDER BY rowid", (parent,))
+    return [ json.loads(row[0]) for row in rows ]
+
+
+
+###########################################################
+#
+# Compute Instances
+#
+###########################################################
+
+#
+# Returns the compute instances of a project in a zone, like compute_list_instances
+# With zone = computeUtils.COMPUTE_ALL_ZONES the instances of every zone are returned (and stored under their own zone)
+#
+# The status of the stored instances is only as recent as their fetch, hence scripts
+# that act on instances (start, stop, label...) should keep using the API directly
+#
+def inventory_get_instances(project, zone, ttl = INVENTORY_TTL, refresh = False):
+
+    connection = inventory_get_connection()
+    scope = "instances|{0}|{1}".format(project, zone)
+
+    if refresh or not inventory_is_fresh(connection, scope, ttl):
+
+        instances = computeUtils.compute_list_instances(project, zone)
+        fetchedAt = time.time()
+
+        with connection:
+            if zone == computeUtils.COMPUTE_ALL_ZONES:
+                connection.execute("DELETE FROM instances WHERE project = ?", (project,))
+            else:
+                connection.execute("DELETE FROM instances WHERE project = ? AND zone = ?", (project, zone))
+            for instance in instances:
+                connection.execute("INSERT OR REPLACE INTO instances (project, zone, name, status, resource, fetchedAt) VALUES (?, ?, ?, ?, ?, ?)",
+                                   (project, computeUtils.compute_get_resource_zone(instance), instance['name'], instance.get('status'), json.dumps(instance), fetchedAt))
+            inventory_set_fetched(connection, scope, fetchedAt)
+
+        return instances
+
+    if zone == computeUtils.COMPUTE_ALL_ZONES:
+        rows = connection.execute("SELECT resource FROM instances WHERE project = ? ORDER BY zone, name", (project,))
+        return [ json.loads(row[0]) for row in rows ]
+
+    rows = connection.execute("SELECT resource FROM instances WHERE project = ? AND zone = ? ORDER BY name", (project, zone))
+    return [ json.loads(row[0]) for row in rows ]
+
+
+
+###########################################################
+#
+# Expiry index
+#
+###########################################################
+
+# Keys of the dicts returned by inventory_get_expiring_resources
+EXPIRY_RESOURCE_TYPE = "resourceType"
+EXPIRY_PROJECT = "project"
+EXPIRY_LOCATION = "location"
+EXPIRY_NAME = "name"
+EXPIRY_DATE = "expiresOn"
+
+#
+# Adds (or updates) a resource marked for deletion to the expiry index
+# location is the zone (or the region) of the resource and expiresOn the end of its grace period as YYYYMMDD
+#
+def inventory_index_expiry(resourceType, project, location, name, expiresOn):
+
+    connection = inventory_get_connection()
+
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO expiry_index (resourceType, project, location, name, expiresOn, indexedAt) VALUES (?, ?, ?, ?, ?, ?)",
+                           (resourceType, project, location, name, expiresOn, time.time()))
+
+
+
+#
+# Replaces the expiry index entries of a resource type in a project with those found in a listing of the resources
+#
+# entries is a list of tuples (location, name, expiresOn) with the resources of the listing that are marked for deletion
+# locations is the list of zones (or regions) covered by the listing, or None if it covered every location of the project
+# The entries of resources that are no longer marked, or no longer exist, in those locations are removed
+# The time of the sync is recorded for the project and resource type (see inventory_get_expiry_index_syncs)
+#
+def inventory_sync_expiry_index(resourceType, project, locations, entries):
+
+    connection = inventory_get_connection()
+    indexedAt = time.time()
+
+    with connection:
+        if locations is None:
+            connection.execute("DELETE FROM expiry_index WHERE resourceType = ? AND project = ?", (resourceType, project))
+        else:
+            for location in locations:
+                connection.execute("DELETE FROM expiry_index WHERE resourceType = ? AND project = ? AND location = ?", (resourceType, project, location))
+        for (location, name, expiresOn) in entries:
+            connection.execute("INSERT OR REPLACE INTO expiry_index (resourceType, project, location, name, expiresOn, indexedAt) VALUES (?, ?, ?, ?, ?, ?)",
+                               (resourceType, project, location, name, expiresOn, indexedAt))
+        connection.execute("INSERT OR REPLACE INTO expiry_index_syncs (project, resourceType, syncedAt) VALUES (?, ?, ?)", (project, resourceType, indexedAt))
+
+
+
+#
+# Returns the indexed resources whose grace period ends on or before the date until (YYYYMMDD), oldest first,
+# optionally only those of the given projects. It is a range query on the index, no API call is made
+#
+def inventory_get_expiring_resources(until, projects = None):
+
+    rows = inventory_get_connection().execute("SELECT resourceType, project, location, name, expiresOn FROM expiry_index WHERE expiresOn <= ? ORDER BY expiresOn, project, resourceType, name", (until,))
+
+    expiringResources = []
+    for row in rows:
+        if projects is None or row[1] in projects:
+            expiringResources.append({ EXPIRY_RESOURCE_TYPE: row[0], EXPIRY_PROJECT: row[1], EXPIRY_LOCATION: row[2], EXPIRY_NAME: row[3], EXPIRY_DATE: row[4] })
+
+    return expiringResources
+
+
+
+#
+# Returns the number of resources in the expiry index
+#
+def inventory_count_expiry_index():
+    return inventory_get_connection().execute("SELECT COUNT(*) FROM expiry_index").fetchone()[0]
+
+
+
+#
+# Returns a dict { project: { resourceType: time of the last sync } } with the projects whose listings have been synced
+# into the expiry index (see inventory_sync_expiry_index). A project that is not in the dict has never been synced
+#
+def inventory_get_expiry_index_syncs():
+
+    syncs = {}
+    for row in inventory_get_connection().execute("SELECT project, resourceType, syncedAt FROM expiry_index_syncs"):
+        syncs.setdefault(row[0], {})[row[1]] = row[2]
+
+    return syncs
@@ -0,0 +1,164 @@
+#!/usr/bin/python
+import sys
+import threading
+import Queue
+
+################################################################################
+#
+#   GOOGLE PAGINATION COMMON FUNCTIONS
+#
+#   Most list methods of the Google APIs return the results in pages
+#   A nextPageToken is returned in case the list has been truncated and
+#   it has to be passed to the next call to retrieve the following page
+#
+#   The generators below yield the items as soon as each page arrives,
+#   so callers can start processing on the first page and memory usage
+#   does not grow with the total number of items
+#
+#   Optionally, the pages can be prefetched by a background thread which
+#   requests page N+1 (using the nextPageToken of page N) while the caller
+#   is still processing page N. Up to prefetchDepth pages are kept in memory
+#
+###############################################################################
+
+# Types of the messages sent by the prefetching thread
+PREFETCH_PAGE = "PAGE"
+PREFETCH_END = "END"
+PREFETCH_ERROR = "ERROR"
+
+# Seconds to wait on the prefetch queue before checking again whether the other side has gone away
+PREFETCH_QUEUE_TIMEOUT = 1
+
+
+
+#
+# Yields every page (the whole response dict) returned by listMethod
+#
+# listMethod is called with the list arguments and the pageToken of the previous page
+# and must return a (non executed) HttpRequest, e.g. service.instances().list
+#
+# When prefetchDepth > 0 listMethod is called from a background thread, hence it should
+# obtain the (per thread) API client itself, e.g. lambda **arguments: get_api_client().instances().list(**arguments)
+#
+def paginate_pages(listMethod, prefetchDepth = 0, **listArguments):
+
+    if prefetchDepth > 0:
+        return paginate_prefetched_pages(listMethod, prefetchDepth, listArguments)
+
+    return paginate_sequential_pages(listMethod, listArguments)
+
+
+
+#
+# Yields the items found under itemsKey in every page returned by listMethod
+#
+def paginate(listMethod, itemsKey, prefetchDepth = 0, **listArguments):
+
+    for page in paginate_pages(listMethod, prefetchDepth, **listArguments):
+        for item in page.get(itemsKey, []):
+            yield item
+
+
+
+#
+# Yields (scope, item) for every item returned by an aggregatedList method
+#
+# The pages of aggregatedList contain a dict { scope: { resourceKey: [items], "warning": {...} } }
+# where scope is e.g. "zones/europe-west1-b". Scopes without resources only contain a warning and are skipped
+#
+def paginate_aggregated(listMethod, resourceKey, prefetchDepth = 0, **listArguments):
+
+    for page in paginate_pages(listMethod, prefetchDepth, **listArguments):
+        for scope, scopedList in sorted(page.get('items', {}).items()):
+            for item in scopedList.get(resourceKey, []):
+                yield (scope, item)
+
+
+
+#
+# Partial responses: the fields argument of the list methods selects the parts of the response that are returned
+# The helpers below turn a mask of the fields of each item, e.g. "name,status,labels", into the mask
+# of the whole page, which has to include the nextPageToken, otherwise the pagination would stop after the first page
+# https://developers.google.com/api-client-library/python/guide/performance#partial-response-fields-parameter
+#
+def paginate_fields(itemsKey, itemFields):
+
+    if itemFields is None:
+        return None
+
+    return "nextPageToken,{0}({1})".format(itemsKey, itemFields)
+
+
+def paginate_aggregated_fields(resourceKey, itemFields):
+
+    if itemFields is None:
+        return None
+
+    return "nextPageToken,items/*/{0}({1})".format(resourceKey, itemFields)
+
+
+
+#
+# Requests each page only after the previous one has been consumed
+#
+def paginate_sequential_pages(listMethod, listArguments):
+
+    nextPageToken = None
+
+    while True:
+
+        result = listMethod(pageToken = nextPageToken, **listArguments).execute()
+        yield result
+
+        nextPageToken = result.get('nextPageToken')
+        if not nextPageToken: # No more pages
+            return
+
+
+
+#
+# Requests the pages from a background thread, keeping up to prefetchDepth pages ahead of the caller
+# Exceptions raised while fetching are re-raised in the caller when it reaches the failed page
+#
+def paginate_prefetched_pages(listMethod, prefetchDepth, listArguments):
+
+    pageQueue = Queue.Queue(maxsize = prefetchDepth)
+    stopEvent = threading.Event() # Set when the caller stops iterating before the last page
+
+    def send(message):
+        while not stopEvent.is_set():
+            try:
+                pageQueue.put(message, timeout = PREFETCH_QUEUE_TIMEOUT)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    def fetcher():
+        try:
+            for page in paginate_sequential_pages(listMethod, listArguments):
+                if not send((PREFETCH_PAGE, page)):
+                    return
+            send((PREFETCH_END, None))
+        except Exception:
+            send((PREFETCH_ERROR, sys.exc_info()))
+
+    thread = threading.Thread(target = fetcher)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            try:
+                (messageType, value) = pageQueue.get(timeout = PREFETCH_QUEUE_TIMEOUT)
+            except Queue.Empty:
+                continue # Timeout used only so that the main thread can still receive KeyboardInterrupt
+
+            if messageType == PREFETCH_END:
+                return
+            elif messageType == PREFETCH_ERROR:
+                raise value[0], value[1], value[2]
+
+            yield value
+    finally:
+        stopEvent.set()
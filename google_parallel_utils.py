@@ -0,0 +1,187 @@
+#!/usr/bin/python
+import sys
+import time
+import threading
+import Queue
+
+################################################################################
+#
+#   GOOGLE PARALLEL COMMON FUNCTIONS
+#
+#   Bounded-concurrency fan-out engine used to run the same API call
+#   against many resources (typically projects) at the same time.
+#
+#   - The number of worker threads is capped by maxWorkers, so wall-clock time
+#     scales with ceil(len(items) / maxWorkers) rather than with len(items)
+#   - Each item is processed independently: an exception raised for one item
+#     is stored in its result and does not stop the rest of the sweep
+#   - Results are returned in the same order as the input items
+#
+#   The API clients returned by the *_get_api_client functions are stored per
+#   thread, hence each worker builds and reuses its own client (and its own
+#   httplib2.Http object, which is not thread-safe)
+#
+###############################################################################
+
+DEFAULT_MAX_WORKERS = 16
+
+# Keys of the result dicts returned by parallel_map
+RESULT_ITEM = "item"
+RESULT_VALUE = "result"
+RESULT_ERROR = "error"
+
+
+
+#
+# Runs function(item) for every item using at most maxWorkers threads
+#
+# Returns a list of dicts { "item": item, "result": value, "error": exception }
+# in the same order as the input items. "error" is None when the call succeeded.
+#
+def parallel_map(function, items, maxWorkers = DEFAULT_MAX_WORKERS):
+
+    items = list(items)
+    results = [None] * len(items)
+
+    workQueue = Queue.Queue()
+    for index, item in enumerate(items):
+        workQueue.put((index, item))
+
+    def worker():
+        while True:
+            try:
+                (index, item) = workQueue.get_nowait()
+            except Queue.Empty:
+                return
+
+            try:
+                results[index] = { RESULT_ITEM: item, RESULT_VALUE: function(item), RESULT_ERROR: None }
+            except Exception as e:
+                results[index] = { RESULT_ITEM: item, RESULT_VALUE: None, RESULT_ERROR: e }
+
+    threads = []
+    for i in range(max(1, min(maxWorkers, len(items)))):
+        thread = threading.Thread(target = worker)
+        thread.daemon = True # Do not block the interpreter exit on Ctrl+C
+        thread.start()
+        threads.append(thread)
+
+    # Join with a timeout so that the main thread can still receive KeyboardInterrupt
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(1)
+
+    return results
+
+
+
+#
+# Runs function(item) for every item using at most maxWorkers threads and yields the result dicts
+# of parallel_map as soon as each call finishes, i.e. in completion order rather than in input order
+#
+# The caller can stop iterating at any time (e.g. after the first result). No further items are started
+# after that, although the calls already running are left to finish in their (daemon) threads
+#
+def parallel_as_completed(function, items, maxWorkers = DEFAULT_MAX_WORKERS):
+
+    items = list(items)
+
+    workQueue = Queue.Queue()
+    for item in items:
+        workQueue.put(item)
+
+    resultQueue = Queue.Queue()
+    stopEvent = threading.Event() # Set when the caller stops iterating
+
+    def worker():
+        while not stopEvent.is_set():
+            try:
+                item = workQueue.get_nowait()
+            except Queue.Empty:
+                return
+
+            try:
+                resultQueue.put({ RESULT_ITEM: item, RESULT_VALUE: function(item), RESULT_ERROR: None })
+            except Exception as e:
+                resultQueue.put({ RESULT_ITEM: item, RESULT_VALUE: None, RESULT_ERROR: e })
+
+    for i in range(max(1, min(maxWorkers, len(items)))):
+        thread = threading.Thread(target = worker)
+        thread.daemon = True # Do not block the interpreter exit on Ctrl+C
+        thread.start()
+
+    try:
+        for i in range(len(items)):
+            while True:
+                try:
+                    result = resultQueue.get(timeout = 1) # Timeout used only so that the main thread can still receive KeyboardInterrupt
+                    break
+                except Queue.Empty:
+                    continue
+            yield result
+    finally:
+        stopEvent.set()
+
+
+
+#
+# Returns a function that, called before each API request, blocks the calling thread as long as needed so that
+# all the threads sharing it do not exceed maxCallsPerSecond calls per second in total
+# The calls are spaced evenly rather than in bursts. A maxCallsPerSecond of None or 0 disables the limit
+#
+def parallel_rate_limiter(maxCallsPerSecond):
+
+    lock = threading.Lock()
+    nextCallTime = [time.time()] # In a list so that the nested function can update it
+
+    def wait():
+        if not maxCallsPerSecond:
+            return
+
+        with lock:
+            now = time.time()
+            callTime = max(now, nextCallTime[0])
+            nextCallTime[0] = callTime + 1.0 / maxCallsPerSecond
+
+        if callTime > now:
+            time.sleep(callTime - now)
+
+    return wait
+
+
+
+#
+# Same as parallel_map but returns only the values, in order, raising the first error found
+#
+def parallel_map_values(function, items, maxWorkers = DEFAULT_MAX_WORKERS):
+    return parallel_get_values(parallel_map(function, items, maxWorkers))
+
+
+
+#
+# Returns the values of a parallel_map result list, in order, raising the first error found
+#
+def parallel_get_values(results):
+
+    values = []
+    for result in results:
+        if result[RESULT_ERROR] is not None:
+            raise result[RESULT_ERROR]
+        values.append(result[RESULT_VALUE])
+
+    return values
+
+
+
+#
+# Prints the errors stored in a parallel_map result list and returns the number of errors found
+#
+def parallel_print_errors(results, description = "Item"):
+
+    errors = 0
+    for result in results:
+        if result[RESULT_ERROR] is not None:
+            errors += 1
+            print "[ERROR] {0} {1} - {2}".format(description, result[RESULT_ITEM], result[RESULT_ERROR])
+
+    return errors
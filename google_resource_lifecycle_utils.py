@@ -0,0 +1,352 @@
+#!/usr/bin/python
+import re
+import datetime as dt
+import google_constants as constants
+import google_compute_utils as computeUtils
+import google_dataproc_utils as dataprocUtils
+import google_parallel_utils as parallelUtils
+import google_inventory_utils as inventoryUtils
+
+################################################################################
+#
+#   RESOURCE DELETION LIFECYCLE
+#
+#   Managed resources (Compute Disks, Compute Instances and Dataproc Clusters)
+#   go through the following lifecycle, driven by their labels:
+#
+#   1. A grace period is set by the owner in GRACE_PERIOD_LABEL
+#   2. Once the resource is no longer in use, it is marked for deletion, i.e.
+#      MARKED_FOR_DELETION_LABEL is set to the end date of the grace period
+#   3. Once that date has passed, the resource is expired and can be deleted
+#
+#   The resources of a project are gathered once in a snapshot, the three types
+#   being listed concurrently, and a single evaluation of the snapshot decides
+#   both which resources have to be marked and which ones have expired
+#
+#   The deletion dates found in the snapshots, and those of the resources being
+#   marked, are kept in the expiry index of the inventory, hence the expired
+#   resources of every project can be reported without listing anything
+#   (see inventory_get_expiring_resources)
+#
+###############################################################################
+
+# Resource types, as shown in the messages
+LIFECYCLE_DISK = "Compute Disk"
+LIFECYCLE_INSTANCE = "Compute Instance"
+LIFECYCLE_DATAPROC_CLUSTER = "Dataproc Cluster"
+LIFECYCLE_RESOURCE_TYPES = [LIFECYCLE_INSTANCE, LIFECYCLE_DISK, LIFECYCLE_DATAPROC_CLUSTER]
+
+# Keys of the evaluation dicts returned by lifecycle_evaluate
+EVALUATION_TYPE = "type"
+EVALUATION_RESOURCE = "resource"
+EVALUATION_GRACE_PERIOD = "gracePeriod"
+EVALUATION_MARKED_FOR_DELETION = "markedForDeletion" # The value of the label or None
+EVALUATION_MARK = "mark" # True if the resource has to be marked for deletion now
+EVALUATION_DELETION_DATE = "deletionDate" # YYYYMMDD, only set when the resource has to be marked
+EVALUATION_GRACE_PERIOD_END = "gracePeriodEnd" # YYYYMMDD, the date of the marked-for-deletion label or None
+EVALUATION_EXPIRED = "expired" # True if the resource was marked and its grace period is over
+
+# Keys of the snapshots under which the regions whose Dataproc clusters could actually be listed are kept,
+# and those that could not, as tuples (region, exception) (see dataproc_iter_clusters_in_regions)
+SNAPSHOT_DATAPROC_REGIONS = "dataprocRegions"
+SNAPSHOT_DATAPROC_FAILED_REGIONS = "dataprocFailedRegions"
+
+MARKED_FOR_DELETION_PATTERN = re.compile("{0}(\\d{{8}})".format(constants.MARKED_FOR_DELETION_VALUE_PREFIX))
+
+
+
+#
+# Returns the date (YYYYMMDD) at which a resource marked at the time now can be deleted given its grace period
+#
+def lifecycle_calculate_deletion_date(deletionGracePeriod, now = None):
+
+    if now is None:
+        now = dt.datetime.now()
+
+    if deletionGracePeriod == constants.GRACE_PERIOD_ONE_WEEK:
+        return (now + dt.timedelta(days=7)).strftime('%Y%m%d')
+    elif deletionGracePeriod == constants.GRACE_PERIOD_ONE_MONTH:
+        return (now + dt.timedelta(days=30)).strftime('%Y%m%d')
+
+    # A year from now if the grace period does not match any known policy
+    return (now + dt.timedelta(days=365)).strftime('%Y%m%d')
+
+
+
+#
+# Returns the end of the grace period of a resource marked for deletion or None if the resource is not marked (or the label is not valid)
+#
+def lifecycle_get_grace_period_end(resource):
+
+    markedForDeletionValue = (resource.get('labels') or {}).get(constants.MARKED_FOR_DELETION_LABEL)
+    if markedForDeletionValue is None:
+        return None
+
+    match = MARKED_FOR_DELETION_PATTERN.match(markedForDeletionValue)
+    if match is None:
+        print "[WARNING] {0} - Not a valid {1} label: {2}".format(resource['name'], constants.MARKED_FOR_DELETION_LABEL, markedForDeletionValue)
+        return None
+
+    return dt.datetime.strptime(match.group(1), "%Y%m%d")
+
+
+
+#
+# Lists the managed resources of a project, the three types at the same time
+# With zone = computeUtils.COMPUTE_ALL_ZONES the disks and instances of every zone are listed
+# The Dataproc clusters are listed in all the given regions, or in every region if they include dataprocUtils.DATAPROC_ALL_REGIONS
+#
+# Returns a dict { resource type: [resources] }. A type that could not be listed is reported and left out of the dict
+# The regions whose clusters could be listed are kept under SNAPSHOT_DATAPROC_REGIONS, a region that failed is not among them
+# but under SNAPSHOT_DATAPROC_FAILED_REGIONS, and reported
+#
+def lifecycle_get_snapshot(project, zone, regions):
+
+    listedRegions = []
+    failedRegions = []
+
+    listers = {
+        LIFECYCLE_INSTANCE: lambda: computeUtils.compute_list_instances(project, zone, fields = computeUtils.COMPUTE_INSTANCE_DELETION_FIELDS),
+        LIFECYCLE_DISK: lambda: computeUtils.compute_list_disks(project, zone, fields = computeUtils.COMPUTE_DISK_DELETION_FIELDS),
+        LIFECYCLE_DATAPROC_CLUSTER: lambda: dataprocUtils.dataproc_list_clusters_in_regions(project, regions, listedRegions = listedRegions, failedRegions = failedRegions),
+    }
+
+    snapshot = { SNAPSHOT_DATAPROC_REGIONS: listedRegions, SNAPSHOT_DATAPROC_FAILED_REGIONS: failedRegions }
+
+    for result in parallelUtils.parallel_map(lambda resourceType: listers[resourceType](), LIFECYCLE_RESOURCE_TYPES):
+        resourceType = result[parallelUtils.RESULT_ITEM]
+        if result[parallelUtils.RESULT_ERROR] is not None:
+            print "[ERROR] [ Project {0} ] - {1}s could not be listed: {2}".format(project, resourceType, result[parallelUtils.RESULT_ERROR])
+        else:
+            snapshot[resourceType] = result[parallelUtils.RESULT_VALUE]
+
+    for (region, error) in failedRegions:
+        print "[ERROR] [ Project {0} ] - {1}s could not be listed in region {2}: {3}".format(project, LIFECYCLE_DATAPROC_CLUSTER, region, error)
+
+    return snapshot
+
+
+
+#
+# Returns True if a resource that has a grace period and is not marked yet can be marked for deletion, i.e. it is not in use:
+# - A disk that is not attached to any instance
+# - An instance that is TERMINATED and not protected against deletion
+# - Any Dataproc cluster. Even when all the VMs in the cluster are stopped, the cluster is still ACTIVE
+#
+def lifecycle_is_unused(resourceType, resource):
+
+    if resourceType == LIFECYCLE_DISK:
+        return not resource.get('users')
+
+    if resourceType == LIFECYCLE_INSTANCE:
+        return resource['status'] == computeUtils.TERMINATED and not resource.get('deletionProtection', False)
+
+    return True
+
+
+
+#
+# Returns True if a resource with the given labels has to be marked for deletion: it has a grace period, is not marked yet
+# and is not in use (see lifecycle_is_unused)
+#
+def lifecycle_should_mark(resourceType, resource, labels):
+
+    gracePeriod = labels.get(constants.GRACE_PERIOD_LABEL, constants.GRACE_PERIOD_NOT_SET)
+
+    return ( labels.get(constants.MARKED_FOR_DELETION_LABEL) is None
+             and gracePeriod != constants.GRACE_PERIOD_NOT_SET
+             and gracePeriod != constants.DO_NOT_DELETE_VALUE
+             and lifecycle_is_unused(resourceType, resource) )
+
+
+
+#
+# Evaluates every resource of a snapshot at the time now
+# Returns a list of evaluation dicts (see the EVALUATION_ keys), in the order of LIFECYCLE_RESOURCE_TYPES
+#
+def lifecycle_evaluate(snapshot, now = None):
+
+    if now is None:
+        now = dt.datetime.now()
+
+    evaluations = []
+
+    for resourceType in LIFECYCLE_RESOURCE_TYPES:
+        for resource in snapshot.get(resourceType, []):
+
+            labels = resource.get('labels') or {}
+            gracePeriod = labels.get(constants.GRACE_PERIOD_LABEL, constants.GRACE_PERIOD_NOT_SET)
+            markedForDeletion = labels.get(constants.MARKED_FOR_DELETION_LABEL)
+
+            mark = lifecycle_should_mark(resourceType, resource, labels)
+
+            gracePeriodEnd = lifecycle_get_grace_period_end(resource)
+
+            evaluations.append({
+                EVALUATION_TYPE: resourceType,
+                EVALUATION_RESOURCE: resource,
+                EVALUATION_GRACE_PERIOD: gracePeriod,
+                EVALUATION_MARKED_FOR_DELETION: markedForDeletion,
+                EVALUATION_MARK: mark,
+                EVALUATION_DELETION_DATE: lifecycle_calculate_deletion_date(gracePeriod, now) if mark else None,
+                EVALUATION_GRACE_PERIOD_END: gracePeriodEnd.strftime('%Y%m%d') if gracePeriodEnd is not None else None,
+                EVALUATION_EXPIRED: gracePeriodEnd is not None and gracePeriodEnd <= now,
+            })
+
+    return evaluations
+
+
+
+#
+# Sets the marked-for-deletion label on the resources that have to be marked according to the evaluations of a project
+# The labels of the disks and instances are set concurrently and their operations waited for in bulk (see compute_set_labels)
+# and so are those of the Dataproc clusters (see dataproc_set_clusters_labels)
+#
+def lifecycle_apply_marks(project, evaluations):
+
+    toMark = [ evaluation for evaluation in evaluations if evaluation[EVALUATION_MARK] ]
+    computeEvaluations = [ evaluation for evaluation in toMark if evaluation[EVALUATION_TYPE] != LIFECYCLE_DATAPROC_CLUSTER ]
+
+    labelChanges = []
+    for evaluation in computeEvaluations:
+        resourceType = computeUtils.COMPUTE_DISK_RESOURCE if evaluation[EVALUATION_TYPE] == LIFECYCLE_DISK else computeUtils.COMPUTE_INSTANCE_RESOURCE
+        labelChanges.append( (resourceType, project, evaluation[EVALUATION_RESOURCE], lifecycle_get_mark_updater(evaluation)) )
+
+    for evaluation, result in zip(computeEvaluations, computeUtils.compute_set_labels(labelChanges)):
+        if result[parallelUtils.RESULT_ERROR] is None and result[parallelUtils.RESULT_VALUE] is None:
+            print "[INFO] [ Project {0} ] - {1} {2} - Its labels have changed and it no longer has to be marked for Deletion".format(
+                project, evaluation[EVALUATION_TYPE], evaluation[EVALUATION_RESOURCE]['name'])
+        else:
+            lifecycle_print_mark_result(project, evaluation, result[parallelUtils.RESULT_ERROR])
+
+    # The labels of the clusters of each region are updated at once too, and the updates waited for until they are done (or time out)
+    clusterEvaluations = {} # { region: { clusterName: evaluation } }
+    for evaluation in toMark:
+        if evaluation[EVALUATION_TYPE] == LIFECYCLE_DATAPROC_CLUSTER:
+            cluster = evaluation[EVALUATION_RESOURCE]
+            clusterEvaluations.setdefault(cluster['region'], {})[cluster['name']] = evaluation
+
+    for region in sorted(clusterEvaluations):
+
+        clustersLabels = {}
+        for clusterName, evaluation in clusterEvaluations[region].items():
+            labels = dict(evaluation[EVALUATION_RESOURCE].get('labels') or {})
+            labels[constants.MARKED_FOR_DELETION_LABEL] = constants.MARKED_FOR_DELETION_VALUE_PREFIX + evaluation[EVALUATION_DELETION_DATE]
+            clustersLabels[clusterName] = labels
+
+        for result in dataprocUtils.dataproc_set_clusters_labels(project, region, clustersLabels):
+            lifecycle_print_mark_result(project, clusterEvaluations[region][result[parallelUtils.RESULT_ITEM]], result[parallelUtils.RESULT_ERROR])
+
+
+
+#
+# Returns the labelUpdates function of compute_set_labels that marks the resource of an evaluation
+#
+# The labels the function is called with are the current ones, which may have changed since the evaluation
+# (e.g. a do-not-delete grace period or a marked-for-deletion label set by someone else), hence the decision
+# is taken again on them. The evaluation is updated accordingly, so that the outcome is reported with the actual date
+#
+def lifecycle_get_mark_updater(evaluation):
+
+    def labelUpdates(labels):
+
+        resourceType = evaluation[EVALUATION_TYPE]
+        if not lifecycle_should_mark(resourceType, evaluation[EVALUATION_RESOURCE], labels):
+            evaluation[EVALUATION_MARK] = False
+            evaluation[EVALUATION_DELETION_DATE] = None
+            return None
+
+        gracePeriod = labels.get(constants.GRACE_PERIOD_LABEL)
+        if gracePeriod != evaluation[EVALUATION_GRACE_PERIOD]:
+            evaluation[EVALUATION_GRACE_PERIOD] = gracePeriod
+            evaluation[EVALUATION_DELETION_DATE] = lifecycle_calculate_deletion_date(gracePeriod)
+
+        return { constants.MARKED_FOR_DELETION_LABEL: constants.MARKED_FOR_DELETION_VALUE_PREFIX + evaluation[EVALUATION_DELETION_DATE] }
+
+    return labelUpdates
+
+
+
+#
+# Prints the outcome of marking a resource and, if it has been marked, adds it to the expiry index
+#
+def lifecycle_print_mark_result(project, evaluation, error):
+
+    resourceType = evaluation[EVALUATION_TYPE]
+    resource = evaluation[EVALUATION_RESOURCE]
+
+    if error is not None:
+        print "[ERROR] [ Project {0} ] - {1} {2} could not be marked for Deletion: {3}".format(project, resourceType, resource['name'], error)
+    else:
+        print constants.MARKED_FOR_DELETION_MESSAGE.format(project, resourceType, resource['name'], evaluation[EVALUATION_DELETION_DATE])
+        inventoryUtils.inventory_index_expiry(resourceType, project, lifecycle_get_location(resourceType, resource), resource['name'], evaluation[EVALUATION_DELETION_DATE])
+
+
+
+#
+# Returns the zone of a disk or instance, or the region of a Dataproc cluster
+#
+def lifecycle_get_location(resourceType, resource):
+
+    if resourceType == LIFECYCLE_DATAPROC_CLUSTER:
+        return resource['region']
+
+    return computeUtils.compute_get_resource_zone(resource)
+
+
+
+#
+# Replaces the expiry index entries of the project with the deletion dates found in the snapshot (see inventory_sync_expiry_index)
+# Only the resource types present in the snapshot, and the locations it covers, are replaced. For the Dataproc clusters these are
+# the regions that could actually be listed, so the entries of a region that failed are kept until it can be listed again
+#
+def lifecycle_index_snapshot(project, zone, snapshot, evaluations):
+
+    for resourceType in LIFECYCLE_RESOURCE_TYPES:
+
+        if resourceType not in snapshot:
+            continue
+
+        if resourceType == LIFECYCLE_DATAPROC_CLUSTER:
+            locations = snapshot[SNAPSHOT_DATAPROC_REGIONS]
+        elif zone == computeUtils.COMPUTE_ALL_ZONES:
+            locations = None
+        else:
+            locations = [zone]
+
+        entries = [ (lifecycle_get_location(resourceType, evaluation[EVALUATION_RESOURCE]), evaluation[EVALUATION_RESOURCE]['name'], evaluation[EVALUATION_GRACE_PERIOD_END])
+                    for evaluation in evaluations if evaluation[EVALUATION_TYPE] == resourceType and evaluation[EVALUATION_GRACE_PERIOD_END] is not None ]
+
+        inventoryUtils.inventory_sync_expiry_index(resourceType, project, locations, entries)
+
+
+
+#
+# Prints the resources of the evaluations that are past their grace period and can be deleted
+# Returns the number of expired resources
+#
+def lifecycle_print_expired(evaluations):
+
+    expired = 0
+
+    for resourceType in LIFECYCLE_RESOURCE_TYPES:
+
+        typeEvaluations = [ evaluation for evaluation in evaluations if evaluation[EVALUATION_TYPE] == resourceType ]
+
+        print "\n\n[DEBUG] =============================="
+        print "[DEBUG] # of {0}s: {1}".format(resourceType, len(typeEvaluations))
+        print "[DEBUG] =============================="
+
+        for evaluation in typeEvaluations:
+
+            resourceName = evaluation[EVALUATION_RESOURCE]['name']
+
+            if evaluation[EVALUATION_MARKED_FOR_DELETION] is None:
+                print "[DEBUG] {0} {1} - Not Marked for Deletion.".format(resourceType, resourceName)
+            elif not evaluation[EVALUATION_EXPIRED]:
+                print "[DEBUG] {0} {1} - Marked for Deletion {2} but still within its grace period.".format(resourceType, resourceName, evaluation[EVALUATION_MARKED_FOR_DELETION])
+            else:
+                expired += 1
+                print "[INFO] {0} {1} - was marked for deletion {2} and is now past its grace period and CAN BE DELETED".format(resourceType, resourceName, evaluation[EVALUATION_MARKED_FOR_DELETION])
+
+    return expired
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+import re
+import threading
+import datetime as dt
+import google_constants as constants
+
+################################################################################
+#
+#   COMPILED ACTIVITY WINDOW SCHEDULES
+#
+#   An activity window is a crontab-like string set in the instance metadata:
+#
+#       START_TIME END_TIME DAY_OF_MONTH MONTH DAY_OF_WEEK
+#       e.g. "08:00 18:30 * * MON-FRI"
+#
+#   An instance is within its activity window when the month, the day of the
+#   month and the day of the week match and the time is between the start and
+#   the end times (both included)
+#
+#   Each schedule string is validated and parsed only once per process and the
+#   result is memoized, hence thousands of instances sharing a few schedules
+#   only cost a few parses. The compiled schedule is a dict where:
+#
+#   - The times are stored as minutes since midnight
+#   - The day of the month, month and day of the week fields are bitmasks,
+#     where bit N is set if the value N matches, so checking a value is O(1)
+#
+#   The times at which an instance has to be started or stopped next can be
+#   calculated from the compiled schedule as well (see schedule_next_transition)
+#
+###############################################################################
+
+# Keys of the compiled schedule dicts
+SCHEDULE_STRING = "schedule"
+SCHEDULE_START_MINUTE = "startMinute"
+SCHEDULE_END_MINUTE = "endMinute"
+SCHEDULE_DAYS_OF_MONTH = "daysOfMonth"
+SCHEDULE_MONTHS = "months"
+SCHEDULE_DAYS_OF_WEEK = "daysOfWeek"
+
+# Lowest and highest values of each field. Days of the week are numbered like datetime.weekday(), i.e. MON=0 .. SUN=6
+DAY_OF_MONTH_RANGE = (1, 31)
+MONTH_RANGE = (1, 12)
+DAY_OF_WEEK_RANGE = (0, 6)
+
+# { schedule string: compiled schedule or None if the string is not a valid schedule }
+COMPILED_SCHEDULES = {}
+COMPILED_SCHEDULES_LOCK = threading.Lock()
+
+SCHEDULE_PATTERN = re.compile(constants.SCHEDULER_SCHEDULE_REGEX)
+
+
+
+#
+# Returns the compiled schedule for a schedule string or None if it is not a valid schedule
+# The result is memoized by schedule string, including the invalid ones
+#
+def schedule_compile(schedule):
+
+    schedule = schedule.strip()
+
+    with COMPILED_SCHEDULES_LOCK:
+        if schedule in COMPILED_SCHEDULES:
+            return COMPILED_SCHEDULES[schedule]
+
+    compiledSchedule = None
+
+    if SCHEDULE_PATTERN.search(schedule):
+        fields = schedule.split()
+        compiledSchedule = {
+            SCHEDULE_STRING: schedule,
+            SCHEDULE_START_MINUTE: schedule_parse_time(fields[0]),
+            SCHEDULE_END_MINUTE: schedule_parse_time(fields[1]),
+            SCHEDULE_DAYS_OF_MONTH: schedule_parse_field(fields[2], DAY_OF_MONTH_RANGE),
+            SCHEDULE_MONTHS: schedule_parse_field(fields[3], MONTH_RANGE, constants.MONTHS),
+            SCHEDULE_DAYS_OF_WEEK: schedule_parse_field(fields[4], DAY_OF_WEEK_RANGE, constants.DAYS_OF_WEEK),
+        }
+
+    with COMPILED_SCHEDULES_LOCK:
+        COMPILED_SCHEDULES[schedule] = compiledSchedule
+
+    return compiledSchedule
+
+
+
+#
+# Converts a time entry (HH:MM) into minutes since midnight
+#
+def schedule_parse_time(timeField):
+    (hour, minute) = timeField.split(":")
+    return int(hour) * 60 + int(minute)
+
+
+
+#
+# Converts a field into a bitmask of the values it matches
+#
+# * => every value in fieldRange
+# 2 or MON => a single value
+# 2,15,27 or SUN,MON,TUE => a list of values
+# 2-12 or JAN-APR => a range of values (both ends included)
+# 1-5,20,25-31 => lists can contain ranges too
+#
+# The field has already passed the SCHEDULER_SCHEDULE_REGEX check, therefore it is presumed valid
+#
+def schedule_parse_field(field, fieldRange, names = None):
+
+    (lowestValue, highestValue) = fieldRange
+
+    if field == "*":
+        return schedule_bitmask(lowestValue, highestValue)
+
+    bitmask = 0
+    for entry in field.split(","):
+        if "-" in entry:
+            (firstValue, lastValue) = entry.split("-")
+            bitmask |= schedule_bitmask(schedule_parse_value(firstValue, names), schedule_parse_value(lastValue, names))
+        else:
+            bitmask |= 1 << schedule_parse_value(entry, names)
+
+    return bitmask
+
+
+
+def schedule_parse_value(value, names):
+
+    if value.isdigit():
+        return int(value)
+
+    return int(names[value.upper()])
+
+
+
+#
+# Returns a bitmask with the bits firstValue to lastValue set (none if firstValue > lastValue)
+#
+def schedule_bitmask(firstValue, lastValue):
+
+    if firstValue > lastValue:
+        return 0
+
+    return ( (1 << (lastValue - firstValue + 1)) - 1 ) << firstValue
+
+
+
+#
+# Returns True if the datetime when is within the compiled activity window
+# The comparison is done with minute precision, since the times of the schedules are HH:MM entries
+#
+def schedule_is_within(compiledSchedule, when):
+
+    minuteOfDay = when.hour * 60 + when.minute
+
+    return ( (compiledSchedule[SCHEDULE_MONTHS] >> when.month) & 1 == 1
+             and (compiledSchedule[SCHEDULE_DAYS_OF_MONTH] >> when.day) & 1 == 1
+             and (compiledSchedule[SCHEDULE_DAYS_OF_WEEK] >> when.weekday()) & 1 == 1
+             and compiledSchedule[SCHEDULE_START_MINUTE] <= minuteOfDay <= compiledSchedule[SCHEDULE_END_MINUTE] )
+
+
+
+###########################################################
+#
+# Next transitions
+#
+###########################################################
+
+# Number of days searched ahead for the next transition of a schedule
+# Schedules that match very few days (e.g. 29 FEB on a given day of the week) may have no transition within it
+SCHEDULE_SEARCH_DAYS = 8 * 366
+
+MINUTES_PER_DAY = 24 * 60
+
+
+
+#
+# Returns True if the day of the month, month and day of the week of the date day match the compiled schedule
+#
+def schedule_matches_day(compiledSchedule, day):
+
+    return ( (compiledSchedule[SCHEDULE_MONTHS] >> day.month) & 1 == 1
+             and (compiledSchedule[SCHEDULE_DAYS_OF_MONTH] >> day.day) & 1 == 1
+             and (compiledSchedule[SCHEDULE_DAYS_OF_WEEK] >> day.weekday()) & 1 == 1 )
+
+
+
+#
+# Returns True if the activity windows of consecutive matching days join into a single one, i.e. 00:00 to 23:59
+# In that case there are no transitions at midnight between two matching days
+#
+def schedule_spans_whole_day(compiledSchedule):
+    return compiledSchedule[SCHEDULE_START_MINUTE] == 0 and compiledSchedule[SCHEDULE_END_MINUTE] == MINUTES_PER_DAY - 1
+
+
+
+#
+# Returns the first time after when at which the instance enters its activity window (i.e. has to be started)
+# or None if there is none within SCHEDULE_SEARCH_DAYS
+#
+def schedule_next_start(compiledSchedule, when):
+
+    if compiledSchedule[SCHEDULE_START_MINUTE] > compiledSchedule[SCHEDULE_END_MINUTE]:
+        return None # The window is always empty
+
+    for dayOffset in range(SCHEDULE_SEARCH_DAYS):
+        day = when.date() + dt.timedelta(days = dayOffset)
+        if not schedule_matches_day(compiledSchedule, day):
+            continue
+        if schedule_spans_whole_day(compiledSchedule) and schedule_matches_day(compiledSchedule, day - dt.timedelta(days = 1)):
+            continue # Continuation of the window of the previous day
+        transition = dt.datetime.combine(day, dt.time()) + dt.timedelta(minutes = compiledSchedule[SCHEDULE_START_MINUTE])
+        if transition > when:
+            return transition
+
+    return None
+
+
+
+#
+# Returns the first time after when at which the instance leaves its activity window (i.e. has to be stopped),
+# which is the minute after the end time, or None if there is none within SCHEDULE_SEARCH_DAYS
+#
+def schedule_next_stop(compiledSchedule, when):
+
+    if compiledSchedule[SCHEDULE_START_MINUTE] > compiledSchedule[SCHEDULE_END_MINUTE]:
+        return None # The window is always empty
+
+    for dayOffset in range(-1, SCHEDULE_SEARCH_DAYS):
+        day = when.date() + dt.timedelta(days = dayOffset)
+        if not schedule_matches_day(compiledSchedule, day):
+            continue
+        if schedule_spans_whole_day(compiledSchedule) and schedule_matches_day(compiledSchedule, day + dt.timedelta(days = 1)):
+            continue # The window goes on the next day
+        transition = dt.datetime.combine(day, dt.time()) + dt.timedelta(minutes = compiledSchedule[SCHEDULE_END_MINUTE] + 1)
+        if transition > when:
+            return transition
+
+    return None
+
+
+
+#
+# Returns the first time after when at which the instance enters or leaves its activity window, or None if there is none
+#
+def schedule_next_transition(compiledSchedule, when):
+
+    transitions = [ transition for transition in (schedule_next_start(compiledSchedule, when), schedule_next_stop(compiledSchedule, when)) if transition is not None ]
+
+    if not transitions:
+        return None
+
+    return min(transitions)
@@ -1,19 +1,12 @@
 #!/usr/bin/python
 import sys
-import googleapiclient.discovery as discovery
+import google_api_client_utils as apiClientUtils
 import google_directory_utils as directory_utils
 
-SECRETS_API_CLIENT = None
-SECRETS_API_CLIENT_VERSION = None
-
 # [START secrets_get_api_client]
+# The clients are stored per thread and per version in google_api_client_utils
 def secrets_get_api_client(version = "v1beta1"):
-    global SECRETS_API_CLIENT
-    global SECRETS_API_CLIENT_VERSION
-    if SECRETS_API_CLIENT == None or SECRETS_API_CLIENT_VERSION != version:
-        SECRETS_API_CLIENT = discovery.build('secretmanager', version)
-        SECRETS_API_CLIENT_VERSION = version
-    return SECRETS_API_CLIENT
+    return apiClientUtils.api_client_get('secretmanager', version)
 # [END secrets_get_api_client]
 
 ################################################################################
@@ -6,7 +6,7 @@ import os
 import json
 import httplib2
 import google_constants as constants
-from googleapiclient import discovery
+import google_api_client_utils as apiClientUtils
 from google.cloud import storage
 import oauth2client
 from oauth2client import client
@@ -23,22 +23,12 @@ from oauth2client.client import GoogleCredentials
 #
 ####################################################
 
-STORAGE_API_CLIENT = None
-STORAGE_API_CLIENT_VERSION = None
-
 #
 # API at https://developers.google.com/apis-explorer/#p/cloudresourcemanager/v1/
+# The clients are stored per thread and per version in google_api_client_utils
 #
 def storage_get_api_client(version = "v1"):
-    global STORAGE_API_CLIENT
-    global STORAGE_API_CLIENT_VERSION
-
-    credentials = GoogleCredentials.get_application_default()
-
-    if STORAGE_API_CLIENT == None or STORAGE_API_CLIENT_VERSION != version:
-        STORAGE_API_CLIENT = discovery.build('storage', version = version, credentials = credentials)
-        STORAGE_API_CLIENT_VERSION = version
-    return STORAGE_API_CLIENT
+    return apiClientUtils.api_client_get('storage', version)
 
 
 
@@ -15,6 +15,7 @@ sys.path.insert(0,parentdir)
 import google_constants as constants
 import google_cloudsql_utils as cloudSQLUtils
 import google_cloudresourcemanager_utils as cloudResourceManagerUtils
+import google_inventory_utils as inventoryUtils
 from googleapiclient.errors import HttpError
 from subprocess import check_output, PIPE, STDOUT
 
@@ -52,7 +53,7 @@ def main(projectsArgumentList):
     print "\n\n[INFO] ======================================================================================"
 
     if "all" in projectsArgumentList:
-        projectList = cloudResourceManagerUtils.cloudresourcemanager_get_project_ids()
+        projectList = inventoryUtils.inventory_get_project_ids()
     else:
         projectList = projectsArgumentList
 
@@ -70,7 +71,7 @@ def main(projectsArgumentList):
         instances = []
         try:
 
-            instances = cloudSQLUtils.cloudsql_list_instances(project)
+            instances = cloudSQLUtils.cloudsql_list_instances(project, cloudSQLUtils.CLOUDSQL_INSTANCE_SSL_FIELDS)
             print "[INFO] # CloudSQL Instances: {0}".format(len(instances))
             print "[INFO] ======================================================================================"
 
@@ -1,4 +1,5 @@
 #!/usr/bin/python
+import os
 import sys
 import re
 import argparse
@@ -14,6 +15,8 @@ sys.path.insert(0,parentdir)
 import google_constants as constants
 import google_compute_utils as computeUtils
 import google_cloudresourcemanager_utils as cloudResourceManagerUtils
+import google_inventory_utils as inventoryUtils
+import google_parallel_utils as parallelUtils
 from googleapiclient.errors import HttpError
 
 
@@ -23,7 +26,7 @@ def main(projectsArgumentList, requestedShutdownSchedule, zone):
     print "\n\n[INFO] ======================================================================================"
 
     if "all" in projectsArgumentList:
-        projectList = cloudResourceManagerUtils.cloudresourcemanager_get_project_ids(projectFilter = constants.MANAGED_INSTANCE_SHUTDOWN_PROJECT_FILTER)
+        projectList = inventoryUtils.inventory_get_project_ids(projectFilter = constants.MANAGED_INSTANCE_SHUTDOWN_PROJECT_FILTER)
         print "[INFO] Projects where Compute Instance shutdown management is ENABLED (via {0}):\n[INFO] {1}".format(constants.MANAGED_INSTANCE_SHUTDOWN_LABEL, projectList)
     else:
         projectList = projectsArgumentList
@@ -46,7 +49,8 @@ def main(projectsArgumentList, requestedShutdownSchedule, zone):
                 print "[INFO] ======================================================================================"
                 continue
 
-            instances = computeUtils.compute_list_instances(project, zone)
+            # The labels are part of the listing, so that no instance has to be fetched again to read its shutdown schedule
+            instances = computeUtils.compute_list_instances(project, zone, fields = computeUtils.COMPUTE_INSTANCE_LABELS_FIELDS)
             print "[INFO] # of Compute Instances: {0}".format(len(instances))
             print "[INFO] ======================================================================================"
 
@@ -56,15 +60,19 @@ def main(projectsArgumentList, requestedShutdownSchedule, zone):
             continue
 
 
-        for instance in instances:
+        stoppingInstances = [] # (instanceName, zone, operationName)
+
+        for instanceResource in instances:
 
             shutdownDecision =  False
             shutdownSchedule = constants.SHUTDOWN_SCHEDULE_NOT_SET
 
+            # With "-z all" the instances come from every zone, hence the zone of each instance is used from here on
+            instanceZone = computeUtils.compute_get_resource_zone(instanceResource)
+
             # Check the status of the instance.
             # It can be one of the following values:
             # PROVISIONING, STAGING, RUNNING, STOPPING, STOPPED, SUSPENDING, SUSPENDED, and TERMINATED.
-            instanceResource = computeUtils.compute_get_instance(project, zone, instance['name'])
 
             if "labels" in instanceResource and constants.SHUT_DOWN_SCHEDULE_LABEL in instanceResource['labels']:
                 shutdownSchedule = instanceResource['labels'][constants.SHUT_DOWN_SCHEDULE_LABEL]
@@ -76,18 +84,31 @@ def main(projectsArgumentList, requestedShutdownSchedule, zone):
                         and shutdownSchedule == requestedShutdownSchedule)
 
 
-            print '\n[INFO] Instance {0} - Status: {1}'.format(instance['name'], instanceResource['status'])
-            print '[INFO] Instance {0} - Shutdown Schedule: {1}'.format(instance['name'], shutdownSchedule)
-            print '[INFO] Instance {0} - Shutdown Decision: {1}'.format(instance['name'], shutdownDecision)
+            print '\n[INFO] Instance {0} - Status: {1}'.format(instanceResource['name'], instanceResource['status'])
+            print '[INFO] Instance {0} - Shutdown Schedule: {1}'.format(instanceResource['name'], shutdownSchedule)
+            print '[INFO] Instance {0} - Shutdown Decision: {1}'.format(instanceResource['name'], shutdownDecision)
 
             if shutdownDecision:
 
-                print '[INFO] Instance {0} - Stopping instance'.format(instance['name']),#The comma avoids a new line after the print
-                operation = computeUtils.compute_stop_instance(project, zone, instance['name'])
-                computeUtils.compute_wait_for_operation(project, zone, operation['name'])
+                print '[INFO] Instance {0} - Stopping instance'.format(instanceResource['name'])
+                operation = computeUtils.compute_stop_instance(project, instanceZone, instanceResource['name'])
+                stoppingInstances.append( (instanceResource['name'], instanceZone, operation['name']) )
+
+        # The instances are stopped concurrently, hence their operations are waited for all together
+        if stoppingInstances:
+            print '\n[INFO] Waiting for {0} instances to stop'.format(len(stoppingInstances))
+            results = computeUtils.compute_wait_for_operations([ (project, instanceZone, operationName) for (instanceName, instanceZone, operationName) in stoppingInstances ])
+            parallelUtils.parallel_print_errors(results, "Stop Operation")
 
-                instanceResource = computeUtils.compute_get_instance(project, zone, instance['name'])
-                print '[INFO] Instance {0} - Status: {1}\n'.format(instance['name'], instanceResource['status'])
+            # The final statuses are retrieved with batch requests
+            (stoppedInstances, errors) = computeUtils.compute_batch_get_instances([ (project, instanceZone, instanceName) for (instanceName, instanceZone, operationName) in stoppingInstances ],
+                                                                                  fields = computeUtils.COMPUTE_INSTANCE_STATUS_FIELDS)
+            for (instanceName, instanceZone, operationName) in stoppingInstances:
+                instanceKey = (project, instanceZone, instanceName)
+                if instanceKey in stoppedInstances:
+                    print '[INFO] Instance {0} - Status: {1}'.format(instanceName, stoppedInstances[instanceKey]['status'])
+                else:
+                    print '[ERROR] Instance {0} - Status could not be retrieved: {1}'.format(instanceName, errors.get(instanceKey))
 
 
 
@@ -95,7 +116,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('-s','--schedule', required='True', choices=['daily', 'weekly', 'monthly'])
     parser.add_argument('-p','--projects', required=True, metavar='project', nargs='+', help='List of one or more Google Cloud projects where the actions will be performed.\nUse "-p all" to affect all "managed" projects, i.e.: Projects with a label called '+constants.MANAGED_INSTANCE_SHUTDOWN_LABEL+' set to true) .')
-    parser.add_argument('-z','--zone', default='europe-west1-b', help='Optional Compute Engine zone where the actions will be performed.')
+    parser.add_argument('-z','--zone', default='europe-west1-b', help='Optional Compute Engine zone where the actions will be performed. Use "-z all" to act on the instances of every zone.')
     args = parser.parse_args()
     main(args.projects, args.schedule, args.zone)
 # [END run]
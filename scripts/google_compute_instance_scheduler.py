@@ -1,10 +1,12 @@
 #!/usr/bin/python
+import os
 import sys
 import re
 import argparse
 import time
 import datetime as dt
 import json
+import heapq
 import googleapiclient.discovery
 
 # The libraries are located one level above the scripts folder
@@ -15,21 +17,25 @@ sys.path.insert(0,parentdir)
 import google_constants as constants
 import google_compute_utils as computeUtils
 import google_cloudresourcemanager_utils as cloudResourceManagerUtils
+import google_inventory_utils as inventoryUtils
+import google_schedule_utils as scheduleUtils
+import google_compute_simulation_utils as simulationUtils
 from googleapiclient.errors import HttpError
 
 
 #
-#
+# Returns the compiled activity window (see google_schedule_utils) set in the instance metadata, or None
+# The schedules are compiled once per process, however many instances share them
 #
 def get_instance_activity_window(project, zone, instanceResource, metadataKey):
 
-    schedule = computeUtils.compute_get_metadata_value(project, zone, instanceResource['name'], metadataKey)
+    schedule = computeUtils.compute_get_metadata_value(project, zone, instanceResource['name'], metadataKey, instanceResource)
 
     if schedule != None:
 
-        schedule = schedule.strip()
-        if re.search(constants.SCHEDULER_SCHEDULE_REGEX, schedule):
-            return schedule
+        compiledSchedule = scheduleUtils.schedule_compile(schedule)
+        if compiledSchedule != None:
+            return compiledSchedule
         else:
             print "[ERROR] Metadata Key {0} on VM instance {1} is not a valid VM Activity Window.\n[ERROR] Please follow standard crontab syntax and use Ranges or Lists rather than single values if possible.\n[ERROR] The following special characters are not supported / < >, including the functionality the they support in Crontab".format(metadataKey, instanceResource['name'])
             return None
@@ -44,7 +50,7 @@ def get_instance_activity_window(project, zone, instanceResource, metadataKey):
 #
 def get_instance_dependencies(project, zone, instanceResource, metadataKey):
 
-    dependencies = computeUtils.compute_get_metadata_value(project, zone, instanceResource['name'], metadataKey)
+    dependencies = computeUtils.compute_get_metadata_value(project, zone, instanceResource['name'], metadataKey, instanceResource)
 
     if dependencies != None:
 
@@ -62,340 +68,671 @@ def get_instance_dependencies(project, zone, instanceResource, metadataKey):
 
 
 #
-# Given a Metadata Key that points to a list of dependencies, this function checks if the dependency checks or not
-# Each dependency is a list of Compute Instances specified by strings of the form: project#zone#instanceName / project#instanceName / instanceName / zone#instanceName
+# Converts a dependency of the form project#zone#instanceName / project#instanceName / zone#instanceName / instanceName
+# into a tuple (project, zone, instanceName). The missing parts are those of the instance that declares the dependency
+#
+def parse_instance_dependency(project, zone, dependency):
+
+    fields = dependency.strip().split("#")
+
+    if len(fields) == 3:
+        return (fields[0], fields[1], fields[2])
+
+    elif len(fields) == 2:
+        if re.search(constants.ZONE_REGEX, fields[0]):
+            return (project, fields[0], fields[1])
+        else:
+            return (fields[0], zone, fields[1])
+
+    return (project, zone, fields[0])
+
+
+
+#
+# Returns the dependencies declared under the given metadata key as a list of (project, zone, instanceName) tuples
 # At the moment there are just Startup and Shutdown dependencies
 # - A Compute Instace will not start up unless all the instances in the dependency list are in a RUNNING state
 # - Likewise a Compute Instance will not be shut down unless all the instances in the dependency list are in a TERMINATED state
 #
-def check_instance_dependencies(project, zone, instanceResource, metadataKey):
+def get_instance_dependency_keys(project, zone, instanceResource, metadataKey):
 
     dependencies = get_instance_dependencies(project, zone, instanceResource, metadataKey)
-    checksPassed = True
 
-    if dependencies != None:
+    if dependencies == None:
+        return []
 
-        for dependency in dependencies:
+    return [ parse_instance_dependency(project, zone, dependency) for dependency in dependencies ]
 
-            dependencyProject = project
-            dependencyZone = zone
 
-            if re.search("#", dependency):
 
-                fields = dependency.split("#")
+#
+# Groups the instances of a dependency graph in waves using Kahn's algorithm
+#
+# dependencies is a dict { instanceKey: [instanceKeys it depends on] } where only the keys present in the dict are considered
+# Every instance of a wave depends only on instances of previous waves, hence the instances of a wave can be processed in parallel
+#
+# Returns the list of waves and the list of the instances that are part of a dependency cycle, or depend on one,
+# which can never be processed
+#
+def get_dependency_waves(dependencies):
 
-                if len(fields) == 3:
+    pendingDependencies = {}
+    dependents = dict( (instanceKey, []) for instanceKey in dependencies )
 
-                    dependencyProject = fields[0]
-                    dependencyZone = fields[1]
-                    dependencyInstanceName = fields[2]
+    for instanceKey, instanceDependencies in dependencies.items():
+        instanceDependencies = set(instanceDependencies)
+        pendingDependencies[instanceKey] = len(instanceDependencies)
+        for dependency in instanceDependencies:
+            dependents[dependency].append(instanceKey)
 
-                elif len(fields) == 2:
+    waves = []
+    wave = sorted( instanceKey for instanceKey, pending in pendingDependencies.items() if pending == 0 )
 
-                    dependencyInstanceName = fields[1]
-                    if re.search(constants.ZONE_REGEX, fields[0]):
-                        dependencyZone = fields[0]
-                    else:
-                        dependencyProject = fields[0]
-                else:
-                    dependencyInstanceName = fields[0]
-            else:
-                dependencyInstanceName = dependency
+    while wave:
+        waves.append(wave)
+        nextWave = []
+        for instanceKey in wave:
+            for dependent in dependents[instanceKey]:
+                pendingDependencies[dependent] -= 1
+                if pendingDependencies[dependent] == 0:
+                    nextWave.append(dependent)
+        wave = sorted(nextWave)
 
-            dependencyInstanceResource = computeUtils.compute_get_instance(dependencyProject, dependencyZone, dependencyInstanceName)
+    cyclicInstances = sorted( instanceKey for instanceKey, pending in pendingDependencies.items() if pending > 0 )
 
-            if dependencyInstanceResource != "":
-                print '[INFO] Dependency Instance {0} - Status: {1}'.format(dependencyInstanceName, dependencyInstanceResource['status'])
+    return waves, cyclicInstances
 
-                if metadataKey == constants.SHUTDOWN_DEPENDENCIES_KEY and dependencyInstanceResource['status'] != computeUtils.TERMINATED:
-                    print "[WARNING] Dependency Failed"
-                    checksPassed = False
-                    break
 
-                elif metadataKey == constants.STARTUP_DEPENDENCIES_KEY and dependencyInstanceResource['status'] != computeUtils.RUNNING:
-                    checksPassed = False
-                    print "[WARNING] Dependency Failed"
-                    break
-            else:
-                print '[WARNING] Dependency NOT Found: Instance {0} - Project {1} - Zone {2}'.format(dependencyInstanceName, dependencyProject, dependencyZone)
 
-    else:
-        print '[INFO] No Dependencies Found'
+#
+# Starts or stops the candidate instances of a scheduler pass in dependency order
+#
+# candidates is a dict { (project, zone, instanceName): [dependency keys] } with the instances the schedule wants to start (or stop)
+# instanceStatuses is the instance status cache of the pass (see compute_get_instance_statuses), prefilled with the listed instances
+# The dependencies not in the cache are retrieved with batch requests and the outcome of the operations is stored in it as well
+#
+# - A dependency that is itself a candidate is processed in an earlier wave. Its operation must complete before its dependents are processed
+# - A dependency that is not a candidate must already be in requiredStatus (RUNNING to start, TERMINATED to stop)
+# - Instances in a dependency cycle, with an unmet dependency or depending on a failed instance are skipped until the next pass
+#
+# Returns the set of candidates that were skipped or whose operation failed
+#
+def run_dependency_waves(candidates, operationName, requiredStatus, instanceStatuses):
 
-    if checksPassed:
-        print '[INFO] All dependency checks passed'
-    else:
-        print '[WARNING] Dependency checks failed. Read previous messages to find out the failed dependency.'
+    if not candidates:
+        return set()
+
+    print "\n\n[INFO] ======================================================================================"
+    print "[INFO] {0} - {1} Compute Instances".format(operationName, len(candidates))
+    print "[INFO] ======================================================================================"
+
+    externalDependencies = set( dependency for dependencies in candidates.values() for dependency in dependencies if dependency not in candidates )
+    (dependencyStatuses, dependencyErrors) = computeUtils.compute_get_instance_statuses(instanceStatuses, externalDependencies)
+    for dependency in sorted(dependencyErrors):
+        print '[WARNING] Dependency NOT Found: Instance {0} - Project {1} - Zone {2}'.format(dependency[2], dependency[0], dependency[1])
+
+    failedInstances = set()
+    candidateDependencies = {}
+
+    for instanceKey, dependencies in candidates.items():
+        candidateDependencies[instanceKey] = [ dependency for dependency in dependencies if dependency in candidates ]
+        for dependency in dependencies:
+            dependencyStatus = dependencyStatuses.get(dependency, computeUtils.COMPUTE_INSTANCE_NOT_FOUND)
+            if dependencyStatus != computeUtils.COMPUTE_INSTANCE_NOT_FOUND and dependencyStatus != requiredStatus:
+                print "[WARNING] Instance {0} - Dependency {1} is {2}. No action taken at this time".format(instanceKey[2], dependency[2], dependencyStatus)
+                failedInstances.add(instanceKey)
+
+    (waves, cyclicInstances) = get_dependency_waves(candidateDependencies)
+
+    for instanceKey in cyclicInstances:
+        print "[ERROR] Instance {0} - Part of (or depends on) a dependency cycle. No action taken".format(instanceKey[2])
+        failedInstances.add(instanceKey)
+
+    for waveNumber, wave in enumerate(waves):
+
+        readyInstances = []
+        for instanceKey in wave:
+            if instanceKey in failedInstances:
+                continue
+            if any( dependency in failedInstances for dependency in candidateDependencies[instanceKey] ):
+                print "[WARNING] Instance {0} - A dependency could not be processed. No action taken at this time".format(instanceKey[2])
+                failedInstances.add(instanceKey)
+                continue
+            readyInstances.append(instanceKey)
+
+        if not readyInstances:
+            continue
 
-    return checksPassed
+        print "\n[INFO] {0} - Wave {1}: {2} Compute Instances".format(operationName, waveNumber + 1, len(readyInstances))
+
+        # Each wave has to be DONE before the next one starts, since its instances are the dependencies of the next ones
+        for result in computeUtils.compute_perform_operation_on_instances(readyInstances, operationName, computeUtils.OPERATION_DONE):
+            instanceKey = result[computeUtils.OPERATION_RESULT_INSTANCE]
+            if result[computeUtils.OPERATION_RESULT_ERROR] is None and result[computeUtils.OPERATION_RESULT_STATUS] == requiredStatus:
+                instanceStatuses[instanceKey] = requiredStatus
+            else:
+                failedInstances.add(instanceKey)
+
+    return failedInstances
 
 
 
 
 
 #
-# Gets the Integer equivalent to the Schedule values
+# Checks whether the current time is within the compiled activity window
 #
-def get_integer_values(originalValues):
+# evaluationCache is a dict { schedule string: result } kept for the whole run, since the
+# current time (now) is also fixed for the whole run, so that each schedule is evaluated once
+#
+def check_instance_activity_window(activityWindow, now, evaluationCache):
 
-    values = []
+    schedule = activityWindow[scheduleUtils.SCHEDULE_STRING]
 
-    for originalValue in originalValues:
+    if schedule not in evaluationCache:
+        evaluationCache[schedule] = scheduleUtils.schedule_is_within(activityWindow, now)
+
+    withinActivityWindow = evaluationCache[schedule]
+
+    if not withinActivityWindow:
+        print "[INFO] OUTSIDE Activity Window: {0} (Current Time {1})".format(schedule, now)
+    else:
+        print "[INFO] WITHIN Activity Window: {0} (Current Time {1})".format(schedule, now)
+
+    return withinActivityWindow
 
-        if not re.match("^\d+$", originalValue):
 
-            if re.match(constants.DAYS_OF_WEEK_AS_TEXT_REGEX, originalValue):
-                dayOfWeek = originalValue.upper()
-                values.append( int(constants.DAYS_OF_WEEK[dayOfWeek]) )
 
-            elif re.match(constants.MONTHS_AS_TEXT_REGEX, originalValue):
-                month = originalValue.upper()
-                values.append( int(constants.MONTHS[month]) )
 
-        else:
-            values.append(int(originalValue))
 
-    return values
 
 #
-# Creates a Dict reoresentiung the Schedule Entry and its type
-# Converts text entries into their Integer values for simplicity
+# Returns the list of projects given in the command line, or the managed projects when "-p all" is used
 #
-# * => ANY
-# 2 => SINGLE
-# 2,15,27 or  SUN, MON, TUE => LIST
-# 2-12 or JAN-APR => RANGE
+def get_project_list(projectsArgumentList):
+
+    if "all" in projectsArgumentList:
+        projectList = inventoryUtils.inventory_get_project_ids(projectFilter = constants.MANAGED_INSTANCE_SCHEDULE_PROJECT_FILTER)
+        print "[INFO] Projects where Compute Instance scheduling is ENABLED (via {0}):\n[INFO] {1}".format(constants.MANAGED_INSTANCE_SCHEDULE_LABEL, projectList)
+    else:
+        projectList = projectsArgumentList
+        print "[INFO] Projects provided: {0}".format(projectList)
+
+    return projectList
+
+
+
 #
-# The schedule Field has already passed a Regex match check, therefore it is presumed valid
+# Lists the instances of the managed projects
+# Returns a dict { (project, zone, instanceName): instance resource }
 #
-def get_schedule_entry(scheduleField):
+def list_scheduled_instances(projectList, zone, checkProjectLabel = True):
 
-    scheduleEntry = {}
+    instances = {}
 
-    if scheduleField == "*":
-        scheduleEntry["type"] = constants.SCHEDULE_ENTRY_TYPE_ANY
-        scheduleEntry["values"] = [scheduleField]
+    for project in projectList:
+
+        print "\n\n[INFO] ======================================================================================"
+        print "[INFO] Project: {0}".format(project)
+        print "[INFO] Zone: {0}".format(zone)
 
-    elif re.search(",", scheduleField):
-        scheduleEntry["type"] = constants.SCHEDULE_ENTRY_TYPE_LIST
-        scheduleEntry["values"] = []
-        potentialValues = scheduleField.split(",")
-        for potentialValue in potentialValues: # Lists can contain ranges too
+        try:
 
-            if re.search("-", potentialValue):
-                scheduleEntry["type"] = constants.SCHEDULE_ENTRY_TYPE_LIST_WITH_RANGES
-                rangeValues = get_integer_values(potentialValue.split("-"))
-                minValue = rangeValues[0]
-                maxValue = rangeValues[1]
-                currentValue = minValue
-                while currentValue <= maxValue:
-                    scheduleEntry["values"].append(currentValue)
-                    currentValue+=1
-            else:
-                for integerValue in get_integer_values([potentialValue]):
-                    scheduleEntry["values"].append(integerValue)
+            # If the projects have been given in the command line, check whether they are managed or not
+            if checkProjectLabel and not cloudResourceManagerUtils.checkIfProjectHasLabel(project, constants.MANAGED_INSTANCE_SCHEDULE_LABEL, constants.MANAGED_INSTANCE_SCHEDULE_DEFAULT_VALUE) :
+                print "[ERROR] **********  Compute Instance Scheduling NOT enabled  **************"
+                print "[INFO] ======================================================================================"
+                continue
 
+            projectInstances = computeUtils.compute_list_instances(project, zone, fields = computeUtils.COMPUTE_INSTANCE_SCHEDULER_FIELDS)
+            print "[INFO] # of Compute Instances: {0}".format(len(projectInstances))
+            print "[INFO] ======================================================================================"
 
-    elif re.search("-", scheduleField):
-        scheduleEntry["type"] = constants.SCHEDULE_ENTRY_TYPE_RANGE
-        scheduleEntry["values"] = get_integer_values(scheduleField.split("-"))
+        except HttpError as e:
+            print "[ERROR] **********  PROJECT NOT FOUND  **************"
+            print "[INFO] ======================================================================================"
+            continue
 
-    elif re.search(constants.TIME_REGEX, scheduleField):
-        scheduleEntry["type"] = constants.SCHEDULE_ENTRY_TYPE_TIME
-        scheduleEntry["values"] = [scheduleField]
-    else:
-        scheduleEntry["type"] = constants.SCHEDULE_ENTRY_TYPE_SINGLE
-        scheduleEntry["values"] = get_integer_values([scheduleField])
+        # With "-z all" the instances come from every zone, hence the zone of each instance is used from here on
+        for instanceResource in projectInstances:
+            instances[(project, computeUtils.compute_get_resource_zone(instanceResource), instanceResource['name'])] = instanceResource
 
-    return scheduleEntry
+    return instances
 
 
 
 #
-# Matches a current value taken from datetime.now() with the schedule set for the VM
-# Tolerance applies only to SINGLE values and is used to compare MINUTES only
-# The reason is that this schedule will run every 15 or so and is not exact
-# (not like crontab which runs every minute)
-def check_if_schedule_entry_checks_out (scheduleEntry, currentValue, checkType = constants.EQUAL):
+# Decides which instances have to be started or stopped at the time now and performs the operations
+# instances is a dict { (project, zone, instanceName): instance resource }
+# Returns the set of instances that had to be started or stopped but were not (see run_dependency_waves)
+#
+def schedule_instances(instances, now):
 
-    entryChecksOut = False
+    # The instances to stop and to start, as dicts { (project, zone, instanceName): [dependency keys] }
+    # The operations are performed once every instance has been checked, in dependency order (see run_dependency_waves)
+    instancesToStop = {}
+    instancesToStart = {}
 
-    # * Matches everything
-    if scheduleEntry["type"] == constants.SCHEDULE_ENTRY_TYPE_ANY:
-        #print "[DEBUG] [SUCCESS] Schedule Entry (Type:{0} Value:{1}) matches Current Value: {2}".format(scheduleEntry["type"], scheduleEntry["values"], currentValue)
-        entryChecksOut = True
+    # Instance status cache of the pass, prefilled with the listed instances, so that the dependencies
+    # among them are checked without further requests and any other dependency is only requested once
+    instanceStatuses = dict( (instanceKey, instanceResource['status']) for instanceKey, instanceResource in instances.items() )
 
-    elif scheduleEntry["type"] == constants.SCHEDULE_ENTRY_TYPE_SINGLE:
-        scheduleIntValue = int(scheduleEntry["values"][0])
-        if currentValue == scheduleIntValue:
-            #print "[DEBUG] [SUCCESS] Schedule Entry (Type:{0} Value:{1}) matches Current Value: {2}".format(scheduleEntry["type"], scheduleEntry["values"], currentValue)
-            entryChecksOut = True
+    # All the activity windows are checked against the same time
+    activityWindowChecks = {}
 
-    elif scheduleEntry["type"] == constants.SCHEDULE_ENTRY_TYPE_RANGE:
-        scheduleMinIntValue = int(scheduleEntry["values"][0])
-        scheduleMaxIntValue = int(scheduleEntry["values"][1])
-        if currentValue >= scheduleMinIntValue and currentValue <= scheduleMaxIntValue:
-            #print "[DEBUG] [SUCCESS] Schedule Entry (Type:{0} Value(s):{1}) contain the current value: {2}".format(scheduleEntry["type"], scheduleEntry["values"], currentValue)
-            entryChecksOut = True
+    for instanceKey in sorted(instances):
 
-    elif ( scheduleEntry["type"] == constants.SCHEDULE_ENTRY_TYPE_LIST
-           or scheduleEntry["type"] == constants.SCHEDULE_ENTRY_TYPE_LIST_WITH_RANGES):
-        for value in scheduleEntry["values"]:
-            entryChecksOut = (entryChecksOut or currentValue == int(value))
-        #if entryChecksOut:
-        #    print "[DEBUG] [SUCCESS] Schedule Entry (Type:{0} Value(s):{1}) matches Current Value: {2}".format(scheduleEntry["type"], scheduleEntry["values"], currentValue)
+        (project, instanceZone, instanceName) = instanceKey
+        instanceResource = instances[instanceKey]
 
-    elif ( scheduleEntry["type"] == constants.SCHEDULE_ENTRY_TYPE_TIME ):
+        print "\n\n[INFO] Instance: {0}".format(instanceName)
+        print "[INFO] Project: {0} - Zone: {1}".format(project, instanceZone)
 
-        (entryHour, entryMinute) = scheduleEntry["values"][0].split(":")
-        entryTime = dt.time( hour = int(entryHour), minute = int(entryMinute) )
+        # Check the status of the instance. It can be one of the following values:
+        # PROVISIONING, STAGING, RUNNING, STOPPING, STOPPED, SUSPENDING, SUSPENDED, and TERMINATED.
+        currentStatus = instanceResource['status']
+        print "[INFO] Status: {0}".format(currentStatus)
 
-        (currentHour, currentMinute) = currentValue.split(":")
-        currentTime = dt.time( hour = int(currentHour), minute = int(currentMinute) )
+        # TODO: Allow more than one Start-up and Shutdown Schedules (Weekdays/Weekends, etc)
+        # Get Shutdown and Startup schedules from the instance metadata
+        activityWindow = get_instance_activity_window(project, instanceZone, instanceResource, constants.ACTIVITY_WINDOW_KEY)
 
-        if checkType == constants.GREATER_OR_EQUAL:
-            entryChecksOut = ( currentTime >= entryTime )
+        # Check the target status given the current time and the schedule and decide what actions are required: STOP/START/WAIT
+        if activityWindow != None:
 
-        elif checkType == constants.LESS_OR_EQUAL:
-            entryChecksOut = ( currentTime <= entryTime )
+            scheduleCheck = check_instance_activity_window(activityWindow, now, activityWindowChecks)
 
-        else:
-            entryChecksOut = ( currentTime == entryTime )
+            if currentStatus == "RUNNING" and not scheduleCheck: # Outside of Activity Window
+                print "[INFO] Instance will be stopped"
+                instancesToStop[instanceKey] = get_instance_dependency_keys(project, instanceZone, instanceResource, constants.SHUTDOWN_DEPENDENCIES_KEY)
+            elif currentStatus == "TERMINATED" and scheduleCheck: # Within Acivity Window
+                print "[INFO] Instance will be started"
+                instancesToStart[instanceKey] = get_instance_dependency_keys(project, instanceZone, instanceResource, constants.STARTUP_DEPENDENCIES_KEY)
+            else:
+                print "[INFO] No action required at this time"
 
-        #if entryChecksOut:
-        #    print "[DEBUG] [SUCCESS] Schedule Entry (Type:{0} Value(s):{1}) is {2} Current Value: {3}".format(scheduleEntry["type"], scheduleEntry["values"], checkType, currentValue)
 
-    #if not entryChecksOut:
-    #    print "[DEBUG] [FAILURE] Schedule Entry (Type:{0} Value(s):{1}) failed checks - Current Value: {2}".format(scheduleEntry["type"], scheduleEntry["values"], currentValue)
+    print "\n\n[INFO] ======================================================================================"
+    print "[INFO] Instances to stop: {0} - Instances to start: {1}".format(len(instancesToStop), len(instancesToStart))
+    print "[INFO] ======================================================================================"
 
-    return entryChecksOut
+    failedInstances = run_dependency_waves(instancesToStop, computeUtils.COMPUTE_STOP_OPERATION, computeUtils.TERMINATED, instanceStatuses)
+    failedInstances |= run_dependency_waves(instancesToStart, computeUtils.COMPUTE_START_OPERATION, computeUtils.RUNNING, instanceStatuses)
 
+    return failedInstances
 
 
 
+###########################################################
+#
+# Daemon mode
+#
+###########################################################
+
+# Default minutes between refreshes of the list of instances (and of their schedules) in daemon mode
+# Each refresh lists every project, which is what a cron pass costs, so it has to be far less frequent than the passes
+DAEMON_REFRESH_INTERVAL = 240
+
+# Minutes after which a wake up that failed (e.g. the instances could not be listed) is tried again
+DAEMON_RETRY_INTERVAL = 5
 
 #
-# Checks
+# Returns the activity window string set in the metadata of an instance or None, without printing anything
 #
-def check_instance_activity_window(instanceResource, schedule):
+def get_instance_schedule(instanceResource):
 
-    currentStatus = instanceResource['status']
+    schedule = computeUtils.compute_get_resource_metadata_value(instanceResource, constants.ACTIVITY_WINDOW_KEY)
 
-    now = dt.datetime.now()
-    currentTime = now.strftime("%H:%M")
-    currentDayOfMonth = int(now.strftime("%d"))
-    currentMonth = int(now.strftime("%m"))
-    currentDayOfWeek = int(dt.datetime.today().weekday())
+    if schedule == None or scheduleUtils.schedule_compile(schedule) == None:
+        return None
 
-    # Split the fields of the Crontab-like activity window definition
-    scheduleFields = schedule.split(" ")
-    scheduleStartTime = get_schedule_entry(scheduleFields[0])
-    scheduleEndTime = get_schedule_entry(scheduleFields[1])
-    scheduleDayOfMonth = get_schedule_entry(scheduleFields[2])
-    scheduleMonth = get_schedule_entry(scheduleFields[3])
-    scheduleDayOfWeek = get_schedule_entry(scheduleFields[4])
+    return schedule.strip()
 
 
-    # Function to check if a value is within the activity window definition
-    withinActivityWindow = True
-    withinActivityWindow = withinActivityWindow and check_if_schedule_entry_checks_out (scheduleMonth, currentMonth)
-    withinActivityWindow = withinActivityWindow and check_if_schedule_entry_checks_out (scheduleDayOfMonth, currentDayOfMonth)
-    withinActivityWindow = withinActivityWindow and check_if_schedule_entry_checks_out (scheduleDayOfWeek, currentDayOfWeek)
-    withinActivityWindow = withinActivityWindow and check_if_schedule_entry_checks_out (scheduleEndTime, currentTime, checkType = constants.LESS_OR_EQUAL)
-    withinActivityWindow = withinActivityWindow and check_if_schedule_entry_checks_out (scheduleStartTime, currentTime, checkType = constants.GREATER_OR_EQUAL)
 
-    if not withinActivityWindow:
-        print "[INFO] OUTSIDE Activity Window: {0} (Current Time {1})".format(schedule, now)
-    else:
-        print "[INFO] WITHIN Activity Window: {0} (Current Time {1})".format(schedule, now)
+#
+# Pushes the next transition of an instance into the transitions heap
+# The entries are (transition time, instance key, schedule). An entry is ignored once popped if the
+# schedule of the instance has changed (or the instance has gone) in the meantime
+#
+def push_next_transition(transitions, instanceKey, schedule, now):
 
-    return withinActivityWindow
+    nextTransition = scheduleUtils.schedule_next_transition(scheduleUtils.schedule_compile(schedule), now)
 
+    if nextTransition != None:
+        heapq.heappush(transitions, (nextTransition, instanceKey, schedule))
 
 
 
+#
+# Updates the tracked schedules with the listed instances and pushes the transitions of the new or changed ones
+# Instances that are no longer listed are not tracked anymore
+# Returns the keys of the new or changed ones
+#
+def track_instance_schedules(instances, schedules, transitions, now):
 
+    for instanceKey in list(schedules):
+        if instanceKey not in instances:
+            del schedules[instanceKey]
 
-# [START run]
-def main(projectsArgumentList, zone):
+    changedInstances = []
 
-    print "\n\n[INFO] ======================================================================================"
+    for instanceKey, instanceResource in instances.items():
+        schedule = get_instance_schedule(instanceResource)
+        if schedule != schedules.get(instanceKey):
+            changedInstances.append(instanceKey)
+            if schedule == None:
+                del schedules[instanceKey]
+            else:
+                schedules[instanceKey] = schedule
+                push_next_transition(transitions, instanceKey, schedule, now)
 
-    if "all" in projectsArgumentList:
-        projectList = cloudResourceManagerUtils.cloudresourcemanager_get_project_ids(projectFilter = constants.MANAGED_INSTANCE_SCHEDULE_PROJECT_FILTER)
-        print "[INFO] Projects where Compute Instance scheduling is ENABLED (via {0}):\n[INFO] {1}".format(constants.MANAGED_INSTANCE_SCHEDULE_LABEL, projectList)
-    else:
-        projectList = projectsArgumentList
-        print "[INFO] Projects provided: {0}".format(projectList)
+    return changedInstances
 
-    print "[INFO] ======================================================================================"
 
 
-    for project in projectList:
+#
+# Runs the scheduler until interrupted (or until the time until, if given)
+#
+# Every refreshInterval minutes the instances are listed with listInstances(), which returns a dict like list_scheduled_instances,
+# and a pass is run on the listed instances, so that new instances, changed schedules and instances started or stopped by hand
+# are picked up. The listing is what a cron pass costs, hence the refreshes are hours apart
+# In between, the next start/stop time of every instance is kept in a priority queue. The daemon sleeps until the next
+# transition is due and then only checks (and acts on) the affected instances, whose current status is retrieved with batch requests.
+# The schedules of those instances are read again from the retrieved resources, so a schedule changed on an instance is followed
+# from its next transition on
+# The instances that could not be started or stopped (e.g. a dependency was not ready yet) are checked again at every wake up
+# until they are, so an instance due at 08:00 that depends on another one due at 08:10 is started at 08:10
+# If a wake up fails (e.g. the API cannot be reached), the error is printed and its transitions (or the refresh) are tried
+# again DAEMON_RETRY_INTERVAL minutes later, along with the instances to retry
+#
+# clock and sleep are those of the simulations, which run the daemon on a virtual clock
+#
+def daemon(listInstances, refreshInterval = DAEMON_REFRESH_INTERVAL, clock = dt.datetime.now, sleep = time.sleep, until = None):
 
-        print "\n\n[INFO] ======================================================================================"
-        print "[INFO] Project: {0}".format(project)
-        print "[INFO] Zone: {0}".format(zone)
+    schedules = {} # { instanceKey: schedule string }
+    transitions = []
+    retryInstances = set()
+    nextRefresh = clock()
+    nextRetry = None # Set once a wake up has failed
+
+    while True:
+
+        wakeUpTime = nextRefresh
+        if transitions and transitions[0][0] < wakeUpTime:
+            wakeUpTime = transitions[0][0]
+        if nextRetry is not None and nextRetry < wakeUpTime:
+            wakeUpTime = nextRetry
+
+        print "\n[INFO] Daemon - {0} scheduled instances - {1} to retry - Sleeping until {2}".format(len(schedules), len(retryInstances), wakeUpTime)
+        sleepSeconds = (wakeUpTime - clock()).total_seconds()
+        if sleepSeconds > 0:
+            sleep(sleepSeconds)
+
+        now = clock()
+        if until is not None and now >= until:
+            return
+
+        dueTransitions = {} # { instanceKey: schedule of the transition }
+        while transitions and transitions[0][0] <= now:
+            (transitionTime, instanceKey, schedule) = heapq.heappop(transitions)
+            if schedules.get(instanceKey) == schedule:
+                dueTransitions[instanceKey] = schedule
+
+        refreshing = now >= nextRefresh
+        dueInstances = set()
+        nextRetry = None
 
-        instances = []
         try:
 
-            # If the projects have been given in the command line, check whether they are managed or not
-            if not cloudResourceManagerUtils.checkIfProjectHasLabel(project, constants.MANAGED_INSTANCE_SCHEDULE_LABEL, constants.MANAGED_INSTANCE_SCHEDULE_DEFAULT_VALUE) :
-                print "[ERROR] **********  Compute Instance Scheduling NOT enabled  **************"
-                print "[INFO] ======================================================================================"
+            if refreshing:
+                # The project list comes from the inventory, which is only fetched again once its TTL has expired
+                instances = listInstances()
+                track_instance_schedules(instances, schedules, transitions, now)
+                nextRefresh = now + dt.timedelta(minutes = refreshInterval)
+
+                # The transitions of the new or changed schedules have just been pushed, the others have to be pushed again
+                for instanceKey, schedule in dueTransitions.items():
+                    if schedules.get(instanceKey) == schedule:
+                        push_next_transition(transitions, instanceKey, schedule, now)
+                dueTransitions = {}
+
+                retryInstances = schedule_instances(instances, now)
                 continue
 
-            instances = computeUtils.compute_list_instances(project, zone)
-            print "[INFO] # of Compute Instances: {0}".format(len(instances))
-            print "[INFO] ======================================================================================"
+            dueInstances = set(dueTransitions) | set( instanceKey for instanceKey in retryInstances if instanceKey in schedules )
+            if not dueInstances:
+                continue
 
-        except HttpError as e:
-            print "[ERROR] **********  PROJECT NOT FOUND  **************"
-            print "[INFO] ======================================================================================"
-            continue
+            (dueResources, errors) = computeUtils.compute_batch_get_instances(dueInstances, fields = computeUtils.COMPUTE_INSTANCE_SCHEDULER_FIELDS)
+            for instanceKey in errors:
+                print "[WARNING] Instance {0} - Could not be retrieved: {1}".format(instanceKey[2], errors[instanceKey])
+                schedules.pop(instanceKey, None)
 
+            # The schedules are read again from the retrieved instances, in case they have changed since the last refresh
+            # The instances retried without a transition due still have theirs in the queue, unless their schedule has changed
+            for instanceKey, instanceResource in dueResources.items():
+                schedule = get_instance_schedule(instanceResource)
+                if schedule == None:
+                    schedules.pop(instanceKey, None)
+                elif instanceKey in dueTransitions or schedule != schedules.get(instanceKey):
+                    schedules[instanceKey] = schedule
+                    push_next_transition(transitions, instanceKey, schedule, now)
+            dueTransitions = {}
 
-        for instanceResource in instances:
+            retryInstances = schedule_instances(dueResources, now)
 
-            print "\n\n[INFO] Instance: {0}".format(instanceResource['name'])
+        except Exception as e:
+            nextRetry = now + dt.timedelta(minutes = DAEMON_RETRY_INTERVAL)
+            print "[ERROR] Daemon - {0} failed: {1}. Trying again at {2}".format("Refresh" if refreshing else "Wake up", e, nextRetry)
 
-            # Check the status of the instance. It can be one of the following values:
-            # PROVISIONING, STAGING, RUNNING, STOPPING, STOPPED, SUSPENDING, SUSPENDED, and TERMINATED.
-            currentStatus = instanceResource['status']
-            print "[INFO] Status: {0}".format(currentStatus)
+            # The transitions whose next one has not been pushed yet are due again at the retry time
+            # and the due instances are kept with those to retry (a failed refresh is run again instead)
+            for instanceKey, schedule in dueTransitions.items():
+                heapq.heappush(transitions, (nextRetry, instanceKey, schedule))
+            retryInstances |= dueInstances
+            if refreshing:
+                nextRefresh = nextRetry
 
-            # TODO: Allow more than one Start-up and Shutdown Schedules (Weekdays/Weekends, etc)
-            # Get Shutdown and Startup schedules from the instance metadata
-            activityWindow = get_instance_activity_window(project, zone, instanceResource, constants.ACTIVITY_WINDOW_KEY)
 
-            # Check the target status given the current time and the schedule and decide what actions are required: STOP/START/WAIT
-            # print "[INFO] Checking Activity Window: {0}".format(activityWindow)
 
-            if activityWindow != None:
+###########################################################
+#
+# Simulation
+#
+###########################################################
 
-                scheduleCheck = check_instance_activity_window(instanceResource, activityWindow)
+# Default first time of the simulations (a Monday), so that the runs are repeatable
+SIMULATION_START = "2024-01-01 00:00"
 
-                if currentStatus == "RUNNING" and not scheduleCheck: # Outside of Activity Window
-                    if check_instance_dependencies(project, zone, instanceResource, constants.SHUTDOWN_DEPENDENCIES_KEY):
-                        computeUtils.compute_perform_operation_on_instance(project, zone, instanceResource["name"], computeUtils.COMPUTE_STOP_OPERATION, computeUtils.OPERATION_RUNNING)
-                    else:
-                        print "[INFO] Shutdown Dependency found. No action taken at this time"
-                elif currentStatus == "TERMINATED" and scheduleCheck: # Within Acivity Window
-                    if check_instance_dependencies(project, zone, instanceResource, constants.STARTUP_DEPENDENCIES_KEY):
-                        computeUtils.compute_perform_operation_on_instance(project, zone, instanceResource["name"], computeUtils.COMPUTE_START_OPERATION, computeUtils.OPERATION_RUNNING)
-                    else:
-                        print "[INFO] Start Up Dependency found. No action taken at this time"
-                else:
-                    print "[INFO] No action required at this time"
+#
+# Runs the scheduler against the simulated compute backend (see google_compute_simulation_utils) over a generated fleet
+#
+# A virtual clock is advanced from start through the given number of days, nothing is sleeping, so a week takes as long as the passes themselves
+# - By default a scheduler pass runs every interval minutes, like a cron job would
+# - With daemonMode, the daemon runs on the virtual clock instead, refreshing the instances every refreshInterval minutes
+#   and waking up at their transitions in between (see daemon)
+#
+# The output of the scheduler is discarded unless verbose is True. Instead, a report is printed with the decisions (starts/stops)
+# and the API requests and wall time of each pass (or wake up of the daemon). Every interval minutes, the instances left outside
+# the status expected by their schedule are counted as mismatches
+#
+def simulate(projectCount, instancesPerProject, dependencyRatio, crossScheduleRatio, schedules, interval, days, start, seed, verbose,
+             daemonMode = False, refreshInterval = DAEMON_REFRESH_INTERVAL):
+
+    global computeUtils
+
+    fleet = simulationUtils.simulation_generate_fleet(projectCount, instancesPerProject, schedules, dependencyRatio, seed = seed, crossScheduleRatio = crossScheduleRatio)
+    projectList = sorted(simulationUtils.SIMULATION_PROJECT_INSTANCES)
+    compiledSchedules = dict( (instanceKey, scheduleUtils.schedule_compile(computeUtils.compute_get_resource_metadata_value(instanceResource, constants.ACTIVITY_WINDOW_KEY)))
+                              for instanceKey, instanceResource in fleet.items() )
+
+    print "\n\n[INFO] ======================================================================================"
+    print "[INFO] Simulation: {0} projects x {1} instances - Dependency ratio: {2} - Cross schedule ratio: {3} - Seed: {4}".format(
+        projectCount, instancesPerProject, dependencyRatio, crossScheduleRatio, seed)
+    if daemonMode:
+        print "[INFO] From {0} - {1} days - Daemon refreshing every {2} minutes - Checked every {3} minutes".format(start, days, refreshInterval, interval)
+    else:
+        print "[INFO] From {0} - {1} days - A pass every {2} minutes".format(start, days, interval)
+    print "[INFO] ======================================================================================"
+
+    end = start + dt.timedelta(days = days)
+    simulationUtils.simulation_reset_api_calls()
+    simulationUtils.simulation_reset_operations()
+
+    stdout = sys.stdout
+    report = {
+        "now": start,           # Virtual clock
+        "nextCheck": start,     # Next time at which the mismatches are counted
+        "runs": 0,
+        "checks": 0,
+        "mismatches": 0,
+        "apiCalls": {},
+        "operations": {},
+        "maxApiCalls": 0,
+        "wallTimes": [],
+    }
+
+    #
+    # Counts the instances whose status does not match their schedule at the check times up to (excluding) checkUntil
+    # The statuses do not change in between, since the scheduler is either done with its pass or sleeping
+    #
+    def checkStatuses(checkUntil):
+
+        mismatches = 0
+        while report["nextCheck"] < min(checkUntil, end):
+            for instanceKey, compiledSchedule in compiledSchedules.items():
+                expectedStatus = computeUtils.RUNNING if scheduleUtils.schedule_is_within(compiledSchedule, report["nextCheck"]) else computeUtils.TERMINATED
+                if fleet[instanceKey]['status'] != expectedStatus:
+                    mismatches += 1
+            report["checks"] += 1
+            report["nextCheck"] += dt.timedelta(minutes = interval)
+
+        report["mismatches"] += mismatches
+        return mismatches
+
+    #
+    # Records the API requests and operations of a pass (or wake up) at the time now, which took wallTime seconds
+    #
+    def recordRun(now, wallTime, mismatches):
+
+        apiCalls = simulationUtils.simulation_reset_api_calls()
+        operations = simulationUtils.simulation_reset_operations()
+        report["runs"] += 1
+        report["wallTimes"].append(wallTime)
+
+        for method, count in apiCalls.items():
+            report["apiCalls"][method] = report["apiCalls"].get(method, 0) + count
+        report["maxApiCalls"] = max(report["maxApiCalls"], sum(apiCalls.values()))
+
+        runOperations = {}
+        for (operationName, instanceKey) in operations:
+            runOperations[operationName] = runOperations.get(operationName, 0) + 1
+            report["operations"][operationName] = report["operations"].get(operationName, 0) + 1
+
+        if operations or verbose:
+            print >> stdout, "[INFO] {0} - Started: {1} - Stopped: {2} - Mismatches: {3} - API requests: {4} - Wall time: {5:.3f}s".format(
+                now.strftime("%a %Y-%m-%d %H:%M"), runOperations.get(computeUtils.COMPUTE_START_OPERATION, 0), runOperations.get(computeUtils.COMPUTE_STOP_OPERATION, 0),
+                mismatches, sum(apiCalls.values()), wallTime)
+
+    listInstances = lambda: list_scheduled_instances(projectList, computeUtils.COMPUTE_ALL_ZONES, checkProjectLabel = False)
+
+    # The scheduler goes through computeUtils, which is pointed at the simulated backend for the runs only
+    realComputeUtils = computeUtils
+    computeUtils = simulationUtils
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+
+    try:
+        if daemonMode:
+
+            wakeUp = [time.time()]
+
+            # Called by the daemon once it is done with a wake up: the statuses are checked until it wakes up again
+            def sleep(seconds):
+                wallTime = time.time() - wakeUp[0]
+                wakeUpTime = report["now"] + dt.timedelta(seconds = seconds)
+                recordRun(report["now"], wallTime, checkStatuses(wakeUpTime))
+                report["now"] = wakeUpTime
+                wakeUp[0] = time.time()
+
+            daemon(listInstances, refreshInterval, clock = lambda: report["now"], sleep = sleep, until = end)
+
+        else:
+
+            while report["now"] < end:
+                passStart = time.time()
+                schedule_instances(listInstances(), report["now"])
+                wallTime = time.time() - passStart
+                recordRun(report["now"], wallTime, checkStatuses(report["now"] + dt.timedelta(minutes = interval)))
+                report["now"] += dt.timedelta(minutes = interval)
+
+    finally:
+        computeUtils = realComputeUtils
+        if not verbose:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    runs = report["runs"]
+    checks = report["checks"]
+    totalApiCalls = report["apiCalls"]
+    totalOperations = report["operations"]
+    wallTimes = report["wallTimes"]
+
+    print "\n\n[INFO] ======================================================================================"
+    print "[INFO] Simulation report"
+    print "[INFO] {0}: {1} - Instances: {2}".format("Wake ups" if daemonMode else "Passes", runs, len(fleet))
+    print "[INFO] Started: {0} - Stopped: {1}".format(totalOperations.get(computeUtils.COMPUTE_START_OPERATION, 0), totalOperations.get(computeUtils.COMPUTE_STOP_OPERATION, 0))
+    print "[INFO] Mismatches: {0} in total - {1:.2f} per check every {2} minutes".format(report["mismatches"], float(report["mismatches"]) / max(checks, 1), interval)
+    print "[INFO] API requests: {0} in total - {1:.1f} per {2} - {3} at most".format(sum(totalApiCalls.values()), float(sum(totalApiCalls.values())) / max(runs, 1),
+                                                                                    "wake up" if daemonMode else "pass", report["maxApiCalls"])
+    for method in sorted(totalApiCalls):
+        print "[INFO]   {0}: {1}".format(method, totalApiCalls[method])
+    if wallTimes:
+        print "[INFO] Wall time: {0:.3f}s in total - {1:.3f}s per {2} - {3:.3f}s at most".format(sum(wallTimes), sum(wallTimes) / len(wallTimes),
+                                                                                           "wake up" if daemonMode else "pass", max(wallTimes))
+    print "[INFO] ======================================================================================"
+
+
+
+# [START run]
+def main(projectsArgumentList, zone):
+
+    print "\n\n[INFO] ======================================================================================"
+    projectList = get_project_list(projectsArgumentList)
+    print "[INFO] ======================================================================================"
+
+    schedule_instances(list_scheduled_instances(projectList, zone), dt.datetime.now())
 
 
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
-    parser.add_argument('-p','--projects', required=True, metavar='project', nargs='+', help='List of one or more Google Cloud projects where the actions will be performed.\nUse "-p all" to affect all "managed" projects, i.e.: Projects with a label called '+constants.MANAGED_INSTANCE_SHUTDOWN_LABEL+' set to true) .')
-    parser.add_argument('-z','--zone', default='europe-west1-b', help='Optional Compute Engine zone where the actions will be performed.')
+    parser.add_argument('-p','--projects', metavar='project', nargs='+', help='List of one or more Google Cloud projects where the actions will be performed.\nUse "-p all" to affect all "managed" projects, i.e.: Projects with a label called '+constants.MANAGED_INSTANCE_SHUTDOWN_LABEL+' set to true) .')
+    parser.add_argument('-z','--zone', default='europe-west1-b', help='Optional Compute Engine zone where the actions will be performed. Use "-z all" to act on the instances of every zone.')
+    parser.add_argument('-d','--daemon', action='store_true', help='Optional flag to keep running and act on each instance when its activity window starts or ends, instead of doing a single pass.')
+    parser.add_argument('-r','--refresh-interval', type=int, default=DAEMON_REFRESH_INTERVAL, help='Optional number of minutes between refreshes of the list of instances in daemon mode (default: '+str(DAEMON_REFRESH_INTERVAL)+'). Each refresh lists every project, like a single pass does.')
+    parser.add_argument('--simulate', action='store_true', help='Optional flag to dry-run the scheduler against a simulated fleet instead of the Compute API. The projects and zone are ignored. Combine it with -d to simulate the daemon mode.')
+    parser.add_argument('--simulation-projects', type=int, default=10, help='Optional number of projects of the simulated fleet.')
+    parser.add_argument('--simulation-instances', type=int, default=100, help='Optional number of instances per project of the simulated fleet.')
+    parser.add_argument('--simulation-dependency-ratio', type=float, default=0.2, help='Optional ratio of simulated instances that depend on other instances.')
+    parser.add_argument('--simulation-cross-schedule-ratio', type=float, default=0.25, help='Optional ratio of simulated dependencies drawn from instances with any schedule instead of the same one.')
+    parser.add_argument('--simulation-schedules', metavar='schedule', nargs='+', default=simulationUtils.SIMULATION_SCHEDULES, help='Optional activity windows assigned to the simulated instances.')
+    parser.add_argument('--simulation-interval', type=int, default=15, help='Optional minutes between scheduler passes in the simulation (between status checks when simulating the daemon mode).')
+    parser.add_argument('--simulation-days', type=int, default=7, help='Optional number of days simulated.')
+    parser.add_argument('--simulation-start', default=SIMULATION_START, help='Optional start of the simulation, in the format "YYYY-MM-DD HH:MM".')
+    parser.add_argument('--simulation-seed', type=int, default=0, help='Optional seed of the simulated fleet.')
+    parser.add_argument('-v','--verbose', action='store_true', help='Optional flag to show the output of every simulated pass.')
     args = parser.parse_args()
-    main(args.projects, args.zone)
+    if args.simulate:
+        simulate(args.simulation_projects, args.simulation_instances, args.simulation_dependency_ratio, args.simulation_cross_schedule_ratio, args.simulation_schedules, args.simulation_interval,
+                 args.simulation_days, dt.datetime.strptime(args.simulation_start, "%Y-%m-%d %H:%M"), args.simulation_seed, args.verbose,
+                 args.daemon, args.refresh_interval)
+    elif not args.projects:
+        parser.error("argument -p/--projects is required")
+    elif args.daemon:
+        daemon(lambda: list_scheduled_instances(get_project_list(args.projects), args.zone), args.refresh_interval)
+    else:
+        main(args.projects, args.zone)
 # [END run]
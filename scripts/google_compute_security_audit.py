@@ -14,6 +14,7 @@ sys.path.insert(0,parentdir)
 import google_constants as constants
 import google_compute_utils as computeUtils
 import google_cloudresourcemanager_utils as cloudResourceManagerUtils
+import google_inventory_utils as inventoryUtils
 from googleapiclient.errors import HttpError
 from subprocess import check_output, PIPE, STDOUT
 
@@ -49,7 +50,7 @@ def main(projectsArgumentList, zone):
     print "\n\n[INFO] ======================================================================================"
 
     if "all" in projectsArgumentList:
-        projectList = cloudResourceManagerUtils.cloudresourcemanager_get_project_ids()
+        projectList = inventoryUtils.inventory_get_project_ids()
     else:
         projectList = projectsArgumentList
 
@@ -66,7 +67,7 @@ def main(projectsArgumentList, zone):
 
         instances = []
         try:
-            instances = computeUtils.compute_list_instances(project, zone)
+            instances = computeUtils.compute_list_instances(project, zone, fields = computeUtils.COMPUTE_INSTANCE_SECURITY_AUDIT_FIELDS)
             print "[INFO] # of VMs: {0}".format(len(instances))
             print "[INFO] ======================================================================================"
 
@@ -80,7 +81,7 @@ def main(projectsArgumentList, zone):
         # TODO: FIX THIS. This is the Project Metadata but enable-oslogin belongs to the Compute Metadata and the key is called commonInstanceMetadata
         #
         projectOsLogin = "PROJECT_OS_LOGIN_DISABLED"
-        projectComputeResource = computeUtils.compute_get_project(project)
+        projectComputeResource = computeUtils.compute_get_project(project, computeUtils.COMPUTE_PROJECT_METADATA_FIELDS)
         if "commonInstanceMetadata" in projectComputeResource and "items" in projectComputeResource['commonInstanceMetadata']:
             for item in projectComputeResource['commonInstanceMetadata']['items']:
                 if ( item['key'] == "enable-oslogin" and re.match(constants.TRUE_REGEX, item['value'])):
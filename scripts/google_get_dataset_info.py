@@ -14,17 +14,18 @@ parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir)
 
 import google_cloudresourcemanager_utils as utils
+import google_inventory_utils as inventoryUtils
+import google_api_client_utils as apiClientUtils
 
 
 def get_datasets():
     _datasets = list()
 
-    projects = utils.cloudresourcemanager_get_all_projects()
+    projects = inventoryUtils.inventory_get_all_projects()
     if projects == None:
         return
 
-    credentials = GoogleCredentials.get_application_default()
-    service = discovery.build('bigquery', 'v2', credentials=credentials)
+    service = apiClientUtils.api_client_get('bigquery', 'v2')
     api_service = service.datasets()
 
     for project in projects:
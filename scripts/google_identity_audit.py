@@ -20,13 +20,11 @@ import re
 import sys
 from pprint import pprint
 import json
-from googleapiclient import discovery
 
 import oauth2client
 from oauth2client import tools
 from oauth2client.file import Storage
 from oauth2client import client
-from oauth2client.client import GoogleCredentials
 
 #
 # The common resourcemanager_utils library is supposed to be located in the parent directory
@@ -37,12 +35,18 @@ currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentfram
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir)
 import google_cloudresourcemanager_utils as resourcemanager_utils
+import google_inventory_utils as inventory_utils
 import google_directory_utils as directory_utils
 import google_compute_utils as compute_utils
 import google_storage_utils as storage_utils
+import google_api_client_utils as api_client_utils
 
 
 
+# Number of pages of users requested ahead while the current page is printed
+USERS_PREFETCH_DEPTH = 2
+
+
 def write_stderr(message):
     print(message, file=sys.stderr)
 
@@ -93,49 +97,41 @@ def print_groups_users():
 
 def print_users():
 
-    users = directory_utils.directory_get_users()
-    if not users:
-        print('No users in the domain.')
-    else:
+    # The users are printed as the pages arrive, while the next pages are prefetched in the background
+    users_found = 0
+    current_time = strftime('%Y-%m-%d %H:%M:%S')
+
+    for user in directory_utils.directory_iter_users(prefetchDepth = USERS_PREFETCH_DEPTH):
+
+        users_found += 1
+
         if(flags.format == 'smart'):
-            current_time = strftime('%Y-%m-%d %H:%M:%S')
-            for user in users:
-                if(user.get('suspended','') == True):
-                   continue
-                else:
-                   print(u'{0}|{1}|{2}|{3}|{4}|{5}|{6} {7}'.format(current_time,
-                                                       'GCP_BIGQUERY',
-                                                       user['primaryEmail'],
-                                                       user.get('lastLoginTime', '')[:-1],
-                                                       user.get('creationTime', '')[:-1],
-                                                       '',
-                                                       user.get('name', '').get('givenName', ''),
-                                                       user.get('name', '').get('familyName', '')))
+            if(user.get('suspended','') == True):
+               continue
+            else:
+               print(u'{0}|{1}|{2}|{3}|{4}|{5}|{6} {7}'.format(current_time,
+                                                   'GCP_BIGQUERY',
+                                                   user['primaryEmail'],
+                                                   user.get('lastLoginTime', '')[:-1],
+                                                   user.get('creationTime', '')[:-1],
+                                                   '',
+                                                   user.get('name', '').get('givenName', ''),
+                                                   user.get('name', '').get('familyName', '')))
 
         else:
-            for user in users:
-                print(u'{0}|{1}|{2}|{3}|{4}|{5}'.format(user.get('id', 'None'),
-                                                        user['primaryEmail'],
-                                                        user.get('name', '').get('givenName', ''),
-                                                        user.get('name', '').get('familyName', ''),
-                                                        user.get('lastLoginTime', ''),
-                                                        user.get('suspended', '')))
+            print(u'{0}|{1}|{2}|{3}|{4}|{5}'.format(user.get('id', 'None'),
+                                                    user['primaryEmail'],
+                                                    user.get('name', '').get('givenName', ''),
+                                                    user.get('name', '').get('familyName', ''),
+                                                    user.get('lastLoginTime', ''),
+                                                    user.get('suspended', '')))
+
+    if users_found == 0:
+        print('No users in the domain.')
 
 
 def list_instances ( project, zone):
-    items = []
-    nextPageToken = None
-    while True:
-        result = compute_utils.compute_get_api_client().instances().list(project=project, zone=zone, pageToken=nextPageToken).execute() # maxResults is 500 by default
-        if 'items' in result:
-            items = items + result['items']
-            if ('nextPageToken' not in result or result['nextPageToken'] is None): # No more pages
-                return items
-            else: # There are more pages
-                nextPageToken = result['nextPageToken']
-                #print "[DEBUG] NextPageToken:{0}".format(nextPageToken)
-        else: # No (more) VMs found
-            return items
+    return compute_utils.compute_list_instances(project, zone)
 
 
 
@@ -144,7 +140,7 @@ def get_self_created_service_accounts():
     service_accounts = set()
     user_accounts = set()
 
-    projects = resourcemanager_utils.cloudresourcemanager_get_all_projects()
+    projects = inventory_utils.inventory_get_all_projects()
     if not projects:
         print('No projects Found.')
     else:
@@ -198,7 +194,7 @@ def print_local_accounts():
                                                            ""))
 
 def get_iam_permissions():
-    projects = resourcemanager_utils.cloudresourcemanager_get_all_projects()
+    projects = inventory_utils.inventory_get_all_projects()
     if not projects:
         print('No projects Found.')
     else:
@@ -248,7 +244,7 @@ def get_users_groups():
 
 
 def get_project_owners():
-    projects = resourcemanager_utils.cloudresourcemanager_get_all_projects()
+    projects = inventory_utils.inventory_get_all_projects()
     if not projects:
         print('No projects Founds.')
     else:
@@ -267,7 +263,7 @@ def get_project_owners():
 
 
 def print_folders(parent=None, indent=0, results=list()):
-    folders = resourcemanager_utils.cloudresourcemanager_get_folders(parent)
+    folders = inventory_utils.inventory_get_folders(parent)
     if folders == None:
         return
     for folder in folders:
@@ -287,7 +283,7 @@ def folders():
 def ip_aggregated_audit():
     """Uses the aggregatedList method to get all regions for all projects
     """
-    projects =  resourcemanager_utils.cloudresourcemanager_get_all_projects()
+    projects =  inventory_utils.inventory_get_all_projects()
     for project in projects:
         if(project['lifecycleState'] == 'ACTIVE'):
             regions = dict()
@@ -314,12 +310,11 @@ def ip_aggregated_audit():
 
 
 def get_enabled_apis():
-    projects = resourcemanager_utils.cloudresourcemanager_get_all_projects()
+    projects = inventory_utils.inventory_get_all_projects()
     if projects == None:
         return
 
-    credentials = GoogleCredentials.get_application_default()
-    service = discovery.build('serviceusage', 'v1beta1', credentials = credentials)
+    service = api_client_utils.api_client_get('serviceusage', 'v1beta1')
     api_service = service.services()
 
     for project in projects:
@@ -343,7 +338,7 @@ def get_buckets():
 
     _buckets = list()
 
-    projects = resourcemanager_utils.cloudresourcemanager_get_all_projects()
+    projects = inventory_utils.inventory_get_all_projects()
     if projects == None:
         return
 
@@ -392,12 +387,11 @@ def print_buckets():
 def get_datasets():
     _datasets = list()
 
-    projects = resourcemanager_utils.cloudresourcemanager_get_all_projects()
+    projects = inventory_utils.inventory_get_all_projects()
     if projects == None:
         return
 
-    credentials = GoogleCredentials.get_application_default()
-    service = discovery.build('bigquery', 'v2', credentials=credentials)
+    service = api_client_utils.api_client_get('bigquery', 'v2')
     api_service = service.datasets()
 
     for project in projects:
@@ -430,50 +424,20 @@ def print_datasets():
 
 
 
-def get_zones(project_id):
-
-    _zones = list()
-
-    api_service = compute_utils.compute_get_api_client().zones()
-
-    request = api_service.list(project=project_id)
-    while request is not None:
-        try:
-            results = request.execute()
-        except:
-            break
-        zones = results.get('items')
-        if zones:
-            for zone in zones:
-                _zones.append(zone['name'])
-        request = api_service.list_next(request, results)
-
-    return _zones
-
-
-
 def get_compute_instances():
     _instances = list()
-    projects = resourcemanager_utils.cloudresourcemanager_get_all_projects()
+    projects = inventory_utils.inventory_get_all_projects()
 
     if projects == None:
         return
 
-    api_service = compute_utils.compute_get_api_client().instances()
+    # A single aggregated list per project returns the instances of every zone
     for project in projects:
-        zones = get_zones(project['projectId'])
-        for zone in zones:
-            request = api_service.list(project=project['projectId'], zone=zone)
-            while request is not None:
-                try:
-                    results = request.execute()
-                    instances = results.get('items')
-                    for instance in instances:
-                        print('{0}|{1}|{2}|{3}'.format(project['projectId'], zone, instance['name'], instance['status']))
-                except:
-                    break
-
-                request = api_service.list_next(request, results)
+        try:
+            for instance in compute_utils.compute_iter_aggregated_instances(project['projectId'], fields = compute_utils.COMPUTE_INSTANCE_STATUS_FIELDS):
+                print('{0}|{1}|{2}|{3}'.format(project['projectId'], compute_utils.compute_get_resource_zone(instance), instance['name'], instance['status']))
+        except Exception:
+            continue # e.g. the Compute Engine API is not enabled in the project
 
     return _instances
 
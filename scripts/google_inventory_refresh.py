@@ -0,0 +1,74 @@
+#!/usr/bin/python
+import os
+import sys
+import argparse
+
+# The libraries are located one level above the scripts folder
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import google_constants as constants
+import google_inventory_utils as inventoryUtils
+
+#
+# Project filters used by the scripts when they are run with "-p all"
+#
+PROJECT_FILTERS = [
+    constants.PROJECT_FILTER,
+    constants.MANAGED_INSTANCE_SCHEDULE_PROJECT_FILTER,
+    constants.MANAGED_INSTANCE_SHUTDOWN_PROJECT_FILTER,
+    constants.MANAGED_RESOURCE_DELETION_PROJECT_FILTER,
+]
+
+
+#
+# Fetches the folders under parent and all their subfolders
+#
+def refresh_folders(parent):
+    folders = inventoryUtils.inventory_get_folders(parent, refresh = True)
+    for folder in folders:
+        refresh_folders(folder['name'])
+    return len(folders)
+
+
+# [START run]
+def main(clear, folderParent, zones):
+
+    print "\n\n[INFO] ======================================================================================"
+    print "[INFO] Inventory: {0}".format(inventoryUtils.INVENTORY_DB_PATH)
+
+    if clear:
+        inventoryUtils.inventory_invalidate()
+        print "[INFO] Inventory cleared"
+
+    for projectFilter in PROJECT_FILTERS:
+        projectIds = inventoryUtils.inventory_get_project_ids(projectFilter = projectFilter, refresh = True)
+        print "[INFO] Filter \"{0}\": {1} projects".format(projectFilter, len(projectIds))
+
+    # The instances are refreshed for the projects matching the default filter, which has just been refreshed
+    allProjectIds = inventoryUtils.inventory_get_project_ids()
+
+    if folderParent is not None:
+        print "[INFO] Folders under {0}: {1}".format(folderParent, refresh_folders(folderParent))
+
+    for zone in zones:
+        for projectId in allProjectIds:
+            try:
+                instances = inventoryUtils.inventory_get_instances(projectId, zone, refresh = True)
+                print "[INFO] Project {0} - Zone {1}: {2} compute instances".format(projectId, zone, len(instances))
+            except Exception as e:
+                print "[WARNING] Project {0} - Zone {1}: compute instances could not be listed ({2})".format(projectId, zone, e)
+
+    print "[INFO] ======================================================================================"
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c','--clear', action='store_true', help='Optional flag to remove everything from the inventory before refreshing it.')
+    parser.add_argument('-f','--folders', metavar='parent', help='Optional parent (e.g. organizations/123456) whose folder tree will be refreshed.')
+    parser.add_argument('-z','--zones', metavar='zone', nargs='*', default=[], help='Optional list of Compute Engine zones whose instances will be refreshed for every project. Use "-z all" to refresh the instances of every zone.')
+    args = parser.parse_args()
+    main(args.clear, args.folders, args.zones)
+# [END run]
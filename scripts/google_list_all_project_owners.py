@@ -10,6 +10,7 @@ currentdir = os.path.dirname(os.path.realpath(__file__))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
 import google_cloudresourcemanager_utils as cloudResourceManagerUtils
+import google_inventory_utils as inventoryUtils
 import google_constants as constants
 
 
@@ -17,7 +18,7 @@ import google_constants as constants
 def main(projectsArgumentList):
 
     if "all" in projectsArgumentList:
-        projectList = cloudResourceManagerUtils.cloudresourcemanager_get_project_ids(projectFilter=constants.PROJECT_FILTER)
+        projectList = inventoryUtils.inventory_get_project_ids(projectFilter=constants.PROJECT_FILTER)
     else:
         projectList = projectsArgumentList
 
@@ -27,12 +28,19 @@ def main(projectsArgumentList):
         print("[INFO] {0}".format(p))
     print("[INFO] ======================================================================================")
 
+    # Retrieve all the IAM Policies up front using batch HTTP requests (up to 100 projects per round trip)
+    iamPolicies, iamPolicyErrors = cloudResourceManagerUtils.cloudresourcemanager_batch_get_project_iam_policies(projectList)
+
     for projectId in projectList:
 
         print("\n\n[INFO] ======================================================================================")
         print("[INFO] Project: {0}".format(projectId))
 
-        members = cloudResourceManagerUtils.cloudresourcemanager_get_project_owners(projectId)
+        members = None
+        if projectId in iamPolicies:
+            members = cloudResourceManagerUtils.cloudresourcemanager_get_policy_binding_members(iamPolicies[projectId], 'roles/owner')
+        else:
+            print("[ERROR] {0}".format(iamPolicyErrors.get(projectId)))
 
         if members is None:
             print("[ERROR] UNABLE TO RETRIEVE PROJECT IAM BINDINGS")
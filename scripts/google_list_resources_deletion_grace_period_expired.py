@@ -1,4 +1,5 @@
 #!/usr/bin/python
+import os
 import sys
 import re
 import argparse
@@ -14,46 +15,48 @@ sys.path.insert(0,parentdir)
 import google_constants as constants
 import google_compute_utils as computeUtils
 import google_cloudresourcemanager_utils as resourceManagerUtils
-import google_dataproc_utils as dataprocUtils
+import google_inventory_utils as inventoryUtils
+import google_resource_lifecycle_utils as lifecycleUtils
 from googleapiclient.errors import HttpError
 
 
-###########################################################################
 #
-# Checks which resources have been marked for deletion and are past their grace
-# period end date
+# Reports the resources past their grace period from the expiry index of the inventory, without listing any project
+# The index is kept up to date by the runs of this script and of google_mark_for_deletion.py
+# A project that has never been synced by those runs is reported, since the index only holds the resources those runs have seen
 #
-def checkIfResourcesArePastGracePeriod(resourceList, resourceType):
+def listExpiredFromIndex(projectsArgumentList, until):
 
-    print "\n\n[DEBUG] =============================="
-    print "[DEBUG] # of {0}s: {1}".format(resourceType, len(resourceList))
-    print "[DEBUG] =============================="
+    projects = None if not projectsArgumentList or "all" in projectsArgumentList else projectsArgumentList
+    expiringResources = inventoryUtils.inventory_get_expiring_resources(until, projects)
+    syncs = inventoryUtils.inventory_get_expiry_index_syncs()
 
-    for resource in resourceList:
-
-        if "labels" not in resource or constants.MARKED_FOR_DELETION_LABEL not in resource["labels"] :
-            print "[DEBUG] {0} {1} - Not Marked for Deletion.".format(resourceType, resource['name'])
-            continue
+    print "\n\n[INFO] ======================================================================================"
+    print "[INFO] Expiry index: {0}".format(inventoryUtils.INVENTORY_DB_PATH)
+    print "[INFO] Resources past their grace period on {0}: {1}".format(until, len(expiringResources))
+    print "[INFO] ======================================================================================"
 
-        markedForDeletionValue = resource["labels"][constants.MARKED_FOR_DELETION_LABEL]
-        gracePeriodEndString = re.match("{0}(\\d+)".format(constants.MARKED_FOR_DELETION_VALUE_PREFIX), markedForDeletionValue).group(1)
-        gracePeriodEndDate = dt.datetime.strptime(gracePeriodEndString, "%Y%m%d")
+    if inventoryUtils.inventory_count_expiry_index() == 0:
+        print "[WARNING] The expiry index is empty. Run this script without --from-index (or google_mark_for_deletion.py) to fill it"
 
-        if gracePeriodEndDate > dt.datetime.now() :
-            print "[DEBUG] {0} {1} - Marked for Deletion {2} but still within its grace period.".format(resourceType, resource['name'], markedForDeletionValue)
-            continue
+    for project in projects or []:
+        if project not in syncs:
+            print "[WARNING] [ Project {0} ] - Never synced into the expiry index, some of its expired resources may be missing".format(project)
 
-        print "[INFO] {0} {1} - was marked for deletion {2} and is now past its grace period and CAN BE DELETED".format(resourceType, resource['name'], markedForDeletionValue)
+    for expiringResource in expiringResources:
+        print "[INFO] [ Project {0} ] - {1} {2} ({3}) - was marked for deletion on-or-after-{4} and is now past its grace period and CAN BE DELETED".format(
+            expiringResource[inventoryUtils.EXPIRY_PROJECT], expiringResource[inventoryUtils.EXPIRY_RESOURCE_TYPE], expiringResource[inventoryUtils.EXPIRY_NAME],
+            expiringResource[inventoryUtils.EXPIRY_LOCATION], expiringResource[inventoryUtils.EXPIRY_DATE])
 
 
 
 # [START run]
-def main(projectsArgumentList, region, zone):
+def main(projectsArgumentList, regions, zone):
 
     print "\n\n[INFO] ======================================================================================"
 
     if "all" in projectsArgumentList:
-        projectList = resourceManagerUtils.cloudresourcemanager_get_project_ids(projectFilter = constants.MANAGED_RESOURCE_DELETION_PROJECT_FILTER)
+        projectList = inventoryUtils.inventory_get_project_ids(projectFilter = constants.MANAGED_RESOURCE_DELETION_PROJECT_FILTER)
         print "[INFO] Projects where resource deletion management is ENABLED (via label {0}):\n[INFO] {1}".format(constants.MANAGED_RESOURCE_DELETION_LABEL, projectList)
     else:
         projectList = projectsArgumentList
@@ -66,6 +69,7 @@ def main(projectsArgumentList, region, zone):
         print "\n\n[INFO] ======================================================================================"
         print "[INFO] Project: {0}".format(project)
         print "[INFO] Zone: {0}".format(zone)
+        print "[INFO] Regions: {0}".format(", ".join(regions))
 
         try:
             # Double check that these projects have the label labels.managed-resource-deletion:true
@@ -82,25 +86,27 @@ def main(projectsArgumentList, region, zone):
         print "[INFO] ======================================================================================"
 
 
-        disks = computeUtils.compute_list_disks(project, zone)
-        checkIfResourcesArePastGracePeriod(disks, "DISK")
-
-        instances = computeUtils.compute_list_instances(project, zone)
-        checkIfResourcesArePastGracePeriod(instances, "INSTANCE")
-
-        dataprocClusters = dataprocUtils.dataproc_list_clusters(project, region)
-        checkIfResourcesArePastGracePeriod(dataprocClusters, "DATAPROC CLUSTER")
-
-        # ...etc
+        # The instances, disks and Dataproc clusters are listed concurrently
+        snapshot = lifecycleUtils.lifecycle_get_snapshot(project, zone, regions)
+        evaluations = lifecycleUtils.lifecycle_evaluate(snapshot)
+        lifecycleUtils.lifecycle_index_snapshot(project, zone, snapshot, evaluations)
+        lifecycleUtils.lifecycle_print_expired(evaluations)
 
 
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
-    parser.add_argument('-p','--projects', required=True, metavar='project', nargs='+', help='List of Google Cloud projects where the actions will be performed. Use "-p all" to affect all "managed" projects, i.e.: Projects with a label called '+constants.MANAGED_RESOURCE_DELETION_LABEL+' set to true) .')
-    parser.add_argument('-z','--zone', default='europe-west1-b', help='Optional Compute Engine zone where the actions will be performed.')
-    parser.add_argument('-r','--region', default='europe-west1', help='Optional Compute Engine Region where the actions will be performed.')
+    parser.add_argument('-p','--projects', metavar='project', nargs='+', help='List of Google Cloud projects where the actions will be performed. Use "-p all" to affect all "managed" projects, i.e.: Projects with a label called '+constants.MANAGED_RESOURCE_DELETION_LABEL+' set to true) .')
+    parser.add_argument('-z','--zone', default='europe-west1-b', help='Optional Compute Engine zone where the actions will be performed. Use "-z all" to list the resources of every zone.')
+    parser.add_argument('-r','--regions', metavar='region', nargs='+', default=['europe-west1'], help='Optional list of Compute Engine Regions where the actions will be performed on the Dataproc Clusters. Use "-r all" to act on the clusters of every region.')
+    parser.add_argument('-i','--from-index', action='store_true', help='Optional flag to report the expired resources of every indexed project (or only those given with -p) from the expiry index of the inventory, without listing them.')
+    parser.add_argument('-u','--until', default=dt.datetime.now().strftime('%Y%m%d'), help='Optional date (YYYYMMDD) used with --from-index. Resources whose grace period ends on or before it are reported. Defaults to today.')
     args = parser.parse_args()
-    main(args.projects, args.region, args.zone)
+    if args.from_index:
+        listExpiredFromIndex(args.projects, args.until)
+    elif not args.projects:
+        parser.error("argument -p/--projects is required")
+    else:
+        main(args.projects, args.regions, args.zone)
 # [END run]
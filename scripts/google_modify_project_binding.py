@@ -7,6 +7,7 @@ parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir)
 
 import google_cloudresourcemanager_utils as cloudResourceManagerUtils
+import google_inventory_utils as inventoryUtils
 import google_constants as constants
 
 
@@ -14,7 +15,7 @@ import google_constants as constants
 def main(projectsArgumentList, operation, role, members):
 
     if "all" in projectsArgumentList:
-        projectList = cloudResourceManagerUtils.cloudresourcemanager_get_project_ids(projectFilter=constants.PROJECT_FILTER)
+        projectList = inventoryUtils.inventory_get_project_ids(projectFilter=constants.PROJECT_FILTER)
     else:
         projectList = projectsArgumentList
 
@@ -1,5 +1,8 @@
 #!/usr/bin/python
+import os
+import sys
 import re
+import json
 import argparse
 import datetime as dt
 
@@ -10,6 +13,7 @@ sys.path.insert(0,parentdir)
 
 import google_constants as constants
 import google_cloudresourcemanager_utils as cloudResourceManagerUtils
+import google_inventory_utils as inventoryUtils
 
 
 
@@ -58,10 +62,10 @@ def check_violations (projectId, binding, roleRegex, violation, accountTypeRegex
 
 
 # [START run]
-def main(projectsArgumentList):
+def main(projectsArgumentList, includeOrgPolicies = False):
 
     if "all" in projectsArgumentList:
-        projectList = cloudResourceManagerUtils.cloudresourcemanager_get_project_ids(projectFilter = constants.PROJECT_FILTER)
+        projectList = inventoryUtils.inventory_get_project_ids(projectFilter = constants.PROJECT_FILTER)
     else:
         projectList = projectsArgumentList
 
@@ -71,12 +75,26 @@ def main(projectsArgumentList):
         print("[INFO] {0}".format(p))
     print("[INFO] ======================================================================================")
 
+    # Retrieve all the IAM Policies up front using batch HTTP requests (up to 100 projects per round trip)
+    iamPolicies, iamPolicyErrors = cloudResourceManagerUtils.cloudresourcemanager_batch_get_project_iam_policies(projectList)
+
+    # Retrieving the effective Org Policies is much slower than retrieving the IAM Policies, hence it is optional
+    # All the projects are evaluated concurrently, with the constraint list cached and the lookups batched
+    orgPolicies = {}
+    orgPolicyErrors = {}
+    if includeOrgPolicies:
+        orgPolicies, orgPolicyErrors = cloudResourceManagerUtils.cloudresourcemanager_get_projects_organisation_policies(projectList)
+
     for projectId in projectList:
 
         print("\n\n[INFO] ======================================================================================")
         print("[INFO] Project: {0}".format(projectId))
 
-        iamBindings = cloudResourceManagerUtils.cloudresourcemanager_get_project_iam_bindings(projectId)
+        iamBindings = None
+        if projectId in iamPolicies and 'bindings' in iamPolicies[projectId]:
+            iamBindings = iamPolicies[projectId]['bindings']
+        elif projectId in iamPolicyErrors:
+            print("[ERROR] {0}".format(iamPolicyErrors[projectId]))
 
         if iamBindings is None:
             print("[ERROR] UNABLE TO RETRIEVE PROJECT IAM BINDINGS")
@@ -93,11 +111,10 @@ def main(projectsArgumentList):
 
                 # Ideally check for specific admin permissions within the roles
 
-        #
-        # Retrieving this information makes the script 10 times slower than not doing it
-        #
-        #orgPolicy = cloudResourceManagerUtils.cloudresourcemanager_get_project_organisation_policy(projectId)
-        #print "\n**********************\nORG POLICY:\n***************************\n{0}".format(json.dumps(orgPolicy))
+        if projectId in orgPolicies:
+            print("\n**********************\nORG POLICY:\n***************************\n{0}".format(json.dumps(orgPolicies[projectId])))
+        elif projectId in orgPolicyErrors:
+            print("[ERROR] UNABLE TO RETRIEVE PROJECT ORG POLICY: {0}".format(orgPolicyErrors[projectId]))
 
 
     # Write the report to file
@@ -110,6 +127,7 @@ def main(projectsArgumentList):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('-p', '--projects', required=True, metavar='project', nargs='+', help='List of one or more Google Cloud Project IDs where the actions will be performed.\nUse "-p all" to affect all projects.')
+    parser.add_argument('--org-policies', action='store_true', help='Optional flag to also retrieve the effective Organisation Policies of each project.')
     args = parser.parse_args()
-    main(args.projects)
+    main(args.projects, args.org_policies)
 # [END run]
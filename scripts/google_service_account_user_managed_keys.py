@@ -18,6 +18,8 @@ parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir)
 
 import google_cloudresourcemanager_utils as resourceManagerUtils
+import google_inventory_utils as inventoryUtils
+import google_api_client_utils as apiClientUtils
 import googleapiclient
 import google_constants as constants
 
@@ -57,7 +59,7 @@ def main(projectsArgumentList, region, zone, keytype, serviceaccount, serviceacc
 
         print "[INFO] Projects with user managed keys associated with service accounts and their service accounts/keys"
 
-        projects = resourceManagerUtils.cloudresourcemanager_get_projects( requestedPageSize = 0, projectFilter = "Name:grb-*")
+        projects = inventoryUtils.inventory_get_projects( projectFilter = "Name:grb-*")
         for project in projects:
             if project['lifecycleState'] != 'DELETE_REQUESTED':
                 projectList.append(project['projectId'])
@@ -71,7 +73,7 @@ def main(projectsArgumentList, region, zone, keytype, serviceaccount, serviceacc
     for project in projectList:
 
         try:
-            project_res = resourceManagerUtils.cloudresourcemanager_get_project(project)
+            project_res = resourceManagerUtils.cloudresourcemanager_get_project(project, resourceManagerUtils.CLOUDRESOURCEMANAGER_PROJECT_SUMMARY_FIELDS)
 
         except HttpError as e:
             print("ERROR getting project resource for project: " + project)
@@ -88,9 +90,7 @@ def main(projectsArgumentList, region, zone, keytype, serviceaccount, serviceacc
             print("lifecycleState is: " + project_res['lifecycleState'])
 
 
-        credentials = GoogleCredentials.get_application_default()
-
-        service = googleapiclient.discovery.build('iam', 'v1', credentials=credentials)
+        service = apiClientUtils.api_client_get('iam', 'v1')
 
         try:
             service_accounts = service.projects().serviceAccounts().list(name='projects/' + project_res['projectId']).execute()
@@ -0,0 +1,39 @@
+#!/usr/bin/python
+import os,sys
+import argparse
+import datetime as dt
+
+
+# Unit tests are supposed to be under the subdirectory tests/unit
+# The common utils library is supposed to be located at the root of that path
+# This is needed to find the google_schedule_utils module since this Unit test is not within the same module
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+grandparentdir = os.path.dirname(parentdir)
+sys.path.insert(0, grandparentdir)
+import google_schedule_utils
+
+
+# [START run]
+def main(schedule, time):
+
+    compiledSchedule = google_schedule_utils.schedule_compile(schedule)
+    if compiledSchedule is None:
+        print "[ERROR] {0} is not a valid activity window".format(schedule)
+        return
+
+    when = dt.datetime.strptime(time, "%Y-%m-%d %H:%M") if time else dt.datetime.now()
+    print "[INFO] Activity Window: {0}".format(schedule)
+    print "[INFO] Time: {0} - Within: {1}".format(when, google_schedule_utils.schedule_is_within(compiledSchedule, when))
+    print "[INFO] Next start: {0}".format(google_schedule_utils.schedule_next_start(compiledSchedule, when))
+    print "[INFO] Next stop: {0}".format(google_schedule_utils.schedule_next_stop(compiledSchedule, when))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s','--schedule', required=True, help='Activity window to check, e.g. "08:00 18:00 * * MON-FRI".')
+    parser.add_argument('-t','--time', default=None, help='Optional time to check, in the format "YYYY-MM-DD HH:MM". Defaults to the current time.')
+    args = parser.parse_args()
+
+    main(args.schedule, args.time)
+# [END run]
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+import os,sys
+import unittest
+
+
+# Unit tests are supposed to be under the subdirectory tests/unit
+# The common utils library is supposed to be located at the root of that path and the scripts under its scripts folder
+# This is needed to find the google_compute_instance_scheduler script since this Unit test is not within the same module
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+grandparentdir = os.path.dirname(parentdir)
+sys.path.insert(0, grandparentdir)
+sys.path.insert(0, os.path.join(grandparentdir, 'scripts'))
+import google_constants as constants
+import google_compute_simulation_utils as simulationUtils
+import google_compute_instance_scheduler as scheduler
+
+
+PROJECT = "test-project"
+ZONE = "europe-west1-b"
+
+
+def instance_key(instanceName):
+    return (PROJECT, ZONE, instanceName)
+
+
+#
+# Adds an instance to the simulated backend, with its startup dependencies as "zone#name" entries
+#
+def add_instance(instanceName, status, startupDependencies = None):
+
+    metadataItems = []
+    if startupDependencies:
+        metadataItems.append({ "key": constants.STARTUP_DEPENDENCIES_KEY, "value": ",".join( "{0}#{1}".format(ZONE, dependency) for dependency in startupDependencies ) })
+
+    simulationUtils.SIMULATION_INSTANCES[instance_key(instanceName)] = {
+        "name": instanceName,
+        "zone": "projects/{0}/zones/{1}".format(PROJECT, ZONE),
+        "status": status,
+        "labels": {},
+        "metadata": { "items": metadataItems },
+    }
+    simulationUtils.SIMULATION_PROJECT_INSTANCES.setdefault(PROJECT, []).append(instance_key(instanceName))
+
+
+
+class GetDependencyWavesTest(unittest.TestCase):
+
+    def test_independent_instances_are_in_the_first_wave(self):
+        (waves, cyclicInstances) = scheduler.get_dependency_waves({ "b": [], "a": [], "c": [] })
+        self.assertEqual(waves, [["a", "b", "c"]])
+        self.assertEqual(cyclicInstances, [])
+
+    def test_chain_is_split_in_one_wave_per_instance(self):
+        (waves, cyclicInstances) = scheduler.get_dependency_waves({ "app": ["db"], "web": ["app"], "db": [] })
+        self.assertEqual(waves, [["db"], ["app"], ["web"]])
+        self.assertEqual(cyclicInstances, [])
+
+    def test_diamond_shares_a_wave(self):
+        (waves, cyclicInstances) = scheduler.get_dependency_waves({ "db": [], "app1": ["db"], "app2": ["db"], "lb": ["app1", "app2"] })
+        self.assertEqual(waves, [["db"], ["app1", "app2"], ["lb"]])
+        self.assertEqual(cyclicInstances, [])
+
+    def test_repeated_dependency_is_counted_once(self):
+        (waves, cyclicInstances) = scheduler.get_dependency_waves({ "db": [], "app": ["db", "db"] })
+        self.assertEqual(waves, [["db"], ["app"]])
+        self.assertEqual(cyclicInstances, [])
+
+    def test_cycle_and_its_dependents_are_never_processed(self):
+        (waves, cyclicInstances) = scheduler.get_dependency_waves({ "a": ["b"], "b": ["a"], "c": ["a"], "d": [] })
+        self.assertEqual(waves, [["d"]])
+        self.assertEqual(cyclicInstances, ["a", "b", "c"])
+
+    def test_self_dependency_is_a_cycle(self):
+        (waves, cyclicInstances) = scheduler.get_dependency_waves({ "a": ["a"] })
+        self.assertEqual(waves, [])
+        self.assertEqual(cyclicInstances, ["a"])
+
+
+
+class RunDependencyWavesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.computeUtils = scheduler.computeUtils
+        scheduler.computeUtils = simulationUtils
+        simulationUtils.SIMULATION_INSTANCES.clear()
+        simulationUtils.SIMULATION_PROJECT_INSTANCES.clear()
+        simulationUtils.simulation_reset_api_calls()
+        simulationUtils.simulation_reset_operations()
+
+    def tearDown(self):
+        scheduler.computeUtils = self.computeUtils
+
+    def start(self, candidates):
+        instanceStatuses = dict( (instanceKey, instanceResource['status']) for instanceKey, instanceResource in simulationUtils.SIMULATION_INSTANCES.items() )
+        candidates = dict( (instance_key(instanceName), [ instance_key(dependency) for dependency in dependencies ]) for instanceName, dependencies in candidates.items() )
+        failedInstances = scheduler.run_dependency_waves(candidates, simulationUtils.COMPUTE_START_OPERATION, simulationUtils.RUNNING, instanceStatuses)
+        return (set( instanceKey[2] for instanceKey in failedInstances ), instanceStatuses)
+
+    def started(self):
+        return [ instanceKey[2] for (operationName, instanceKey) in simulationUtils.simulation_reset_operations() if operationName == simulationUtils.COMPUTE_START_OPERATION ]
+
+    def test_dependencies_are_started_first(self):
+        add_instance("db", simulationUtils.TERMINATED)
+        add_instance("app", simulationUtils.TERMINATED, ["db"])
+        add_instance("web", simulationUtils.TERMINATED, ["app"])
+
+        (failedInstances, instanceStatuses) = self.start({ "web": ["app"], "app": ["db"], "db": [] })
+
+        self.assertEqual(failedInstances, set())
+        self.assertEqual(self.started(), ["db", "app", "web"])
+        self.assertEqual(instanceStatuses[instance_key("web")], simulationUtils.RUNNING)
+
+    def test_dependency_already_running_is_not_waited_for(self):
+        add_instance("db", simulationUtils.RUNNING)
+        add_instance("app", simulationUtils.TERMINATED, ["db"])
+
+        (failedInstances, instanceStatuses) = self.start({ "app": ["db"] })
+
+        self.assertEqual(failedInstances, set())
+        self.assertEqual(self.started(), ["app"])
+
+    def test_dependency_not_ready_skips_the_instance_and_its_dependents(self):
+        add_instance("db", simulationUtils.TERMINATED)
+        add_instance("app", simulationUtils.TERMINATED, ["db"])
+        add_instance("web", simulationUtils.TERMINATED, ["app"])
+
+        # db is not a candidate (e.g. its activity window has not started yet), hence app and web have to wait
+        (failedInstances, instanceStatuses) = self.start({ "app": ["db"], "web": ["app"] })
+
+        self.assertEqual(failedInstances, set(["app", "web"]))
+        self.assertEqual(self.started(), [])
+
+    def test_missing_dependency_is_ignored(self):
+        add_instance("app", simulationUtils.TERMINATED, ["deleted-db"])
+
+        (failedInstances, instanceStatuses) = self.start({ "app": ["deleted-db"] })
+
+        self.assertEqual(failedInstances, set())
+        self.assertEqual(self.started(), ["app"])
+
+    def test_missing_dependency_is_requested_once(self):
+        add_instance("app1", simulationUtils.TERMINATED, ["deleted-db"])
+        add_instance("app2", simulationUtils.TERMINATED, ["deleted-db"])
+
+        self.start({ "app1": ["deleted-db"], "app2": ["deleted-db"] })
+        apiCalls = simulationUtils.simulation_reset_api_calls()
+        started = self.started()
+
+        # One GET for the dependency shared by both candidates, then one per started instance for its final status
+        self.assertEqual(sorted(started), ["app1", "app2"])
+        self.assertEqual(apiCalls["instances.get"], 1 + len(started))
+
+    def test_cycle_is_skipped_and_the_rest_is_started(self):
+        add_instance("a", simulationUtils.TERMINATED, ["b"])
+        add_instance("b", simulationUtils.TERMINATED, ["a"])
+        add_instance("c", simulationUtils.TERMINATED)
+
+        (failedInstances, instanceStatuses) = self.start({ "a": ["b"], "b": ["a"], "c": [] })
+
+        self.assertEqual(failedInstances, set(["a", "b"]))
+        self.assertEqual(self.started(), ["c"])
+        self.assertEqual(instanceStatuses[instance_key("a")], simulationUtils.TERMINATED)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
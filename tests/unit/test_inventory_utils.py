@@ -0,0 +1,211 @@
+#!/usr/bin/python
+import os,sys
+import unittest
+import shutil
+import sqlite3
+import tempfile
+
+
+# Unit tests are supposed to be under the subdirectory tests/unit
+# The common utils library is supposed to be located at the root of that path
+# This is needed to find the google_inventory_utils module since this Unit test is not within the same module
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+grandparentdir = os.path.dirname(parentdir)
+sys.path.insert(0, grandparentdir)
+import google_inventory_utils as inventoryUtils
+
+
+#
+# Base class of the inventory tests: each test gets its own database in a temporary directory
+# and the API listings are replaced with fakes that count their calls
+#
+class InventoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.inventoryDir = tempfile.mkdtemp()
+        self.inventoryDbPath = inventoryUtils.INVENTORY_DB_PATH
+        self.getProjects = inventoryUtils.cloudResourceManagerUtils.cloudresourcemanager_get_projects
+        self.listInstances = inventoryUtils.computeUtils.compute_list_instances
+
+        inventoryUtils.INVENTORY_DB_PATH = os.path.join(self.inventoryDir, "inventory.sqlite")
+        inventoryUtils.INVENTORY_CONNECTIONS.connection = None
+
+        self.projects = [ { "projectId": "project-a", "lifecycleState": "ACTIVE", "labels": { "env": "dev" } },
+                          { "projectId": "project-b", "lifecycleState": "ACTIVE", "labels": { "env": "prod" } } ]
+        self.instances = [ { "name": "vm-1", "zone": "projects/project-a/zones/europe-west1-b", "status": "RUNNING" },
+                           { "name": "vm-2", "zone": "projects/project-a/zones/europe-west1-c", "status": "TERMINATED" } ]
+        self.apiCalls = []
+
+        def getProjects(projectFilter = None, lifecycleState = None):
+            self.apiCalls.append("projects")
+            return list(self.projects)
+
+        def listInstances(project, zone, prefetchDepth = 0, fields = None):
+            self.apiCalls.append("instances|{0}|{1}".format(project, zone))
+            return [ instance for instance in self.instances if zone == inventoryUtils.computeUtils.COMPUTE_ALL_ZONES or instance['zone'].endswith("/" + zone) ]
+
+        inventoryUtils.cloudResourceManagerUtils.cloudresourcemanager_get_projects = getProjects
+        inventoryUtils.computeUtils.compute_list_instances = listInstances
+
+    def tearDown(self):
+        self.close()
+        inventoryUtils.INVENTORY_DB_PATH = self.inventoryDbPath
+        inventoryUtils.cloudResourceManagerUtils.cloudresourcemanager_get_projects = self.getProjects
+        inventoryUtils.computeUtils.compute_list_instances = self.listInstances
+        shutil.rmtree(self.inventoryDir)
+
+    # Closes the connection of the test, so that the next one opens the database again like a new run would
+    def close(self):
+        connection = getattr(inventoryUtils.INVENTORY_CONNECTIONS, 'connection', None)
+        if connection is not None:
+            connection.close()
+        inventoryUtils.INVENTORY_CONNECTIONS.connection = None
+
+
+
+class InventoryTtlTest(InventoryTestCase):
+
+    def test_listing_is_answered_from_the_inventory_within_the_ttl(self):
+        projects = inventoryUtils.inventory_get_projects(ttl = 3600)
+        self.close()
+        self.assertEqual(inventoryUtils.inventory_get_projects(ttl = 3600), projects)
+        self.assertEqual(self.apiCalls, ["projects"])
+
+    def test_stale_listing_is_fetched_again(self):
+        inventoryUtils.inventory_get_projects(ttl = 3600)
+        connection = inventoryUtils.inventory_get_connection()
+        with connection:
+            connection.execute("UPDATE fetches SET fetchedAt = fetchedAt - 3601")
+
+        self.projects.pop()
+        self.assertEqual([ project['projectId'] for project in inventoryUtils.inventory_get_projects(ttl = 3600) ], ["project-a"])
+        self.assertEqual(self.apiCalls, ["projects", "projects"])
+
+    def test_refresh_and_zero_ttl_fetch_again(self):
+        inventoryUtils.inventory_get_projects()
+        inventoryUtils.inventory_get_projects(refresh = True)
+        inventoryUtils.inventory_get_projects(ttl = 0)
+        self.assertEqual(self.apiCalls, ["projects", "projects", "projects"])
+
+    def test_labels_of_stored_projects(self):
+        inventoryUtils.inventory_get_projects()
+        self.assertEqual(inventoryUtils.inventory_get_project_ids_with_label("env", "prod"), ["project-b"])
+
+    def test_invalidated_scope_is_fetched_again(self):
+        inventoryUtils.inventory_get_projects()
+        inventoryUtils.inventory_get_instances("project-a", "europe-west1-b")
+
+        inventoryUtils.inventory_invalidate("instances|")
+        inventoryUtils.inventory_get_projects()
+        inventoryUtils.inventory_get_instances("project-a", "europe-west1-b")
+
+        self.assertEqual(self.apiCalls, ["projects", "instances|project-a|europe-west1-b", "instances|project-a|europe-west1-b"])
+
+    def test_all_zones_listing_is_read_back_by_zone(self):
+        inventoryUtils.inventory_get_instances("project-a", inventoryUtils.computeUtils.COMPUTE_ALL_ZONES)
+        self.assertEqual([ instance['name'] for instance in inventoryUtils.inventory_get_instances("project-a", inventoryUtils.computeUtils.COMPUTE_ALL_ZONES) ], ["vm-1", "vm-2"])
+        self.assertEqual(inventoryUtils.inventory_get_connection().execute("SELECT zone FROM instances WHERE name = 'vm-2'").fetchone()[0], "europe-west1-c")
+        self.assertEqual(len(self.apiCalls), 1)
+
+
+
+class ExpiryIndexMigrationTest(InventoryTestCase):
+
+    def setUp(self):
+        InventoryTestCase.setUp(self)
+        self.migrations = list(inventoryUtils.EXPIRY_INDEX_MIGRATIONS)
+
+    def tearDown(self):
+        inventoryUtils.EXPIRY_INDEX_MIGRATIONS[:] = self.migrations
+        InventoryTestCase.tearDown(self)
+
+    def schema_version(self):
+        return inventoryUtils.inventory_get_connection().execute("SELECT version FROM expiry_index_schema").fetchone()[0]
+
+    def test_new_database_gets_every_migration(self):
+        self.assertEqual(self.schema_version(), len(inventoryUtils.EXPIRY_INDEX_MIGRATIONS))
+        self.assertEqual(inventoryUtils.inventory_count_expiry_index(), 0)
+        self.assertEqual(inventoryUtils.inventory_get_expiry_index_syncs(), {})
+
+    def test_expiry_index_of_a_cache_schema_database_is_kept(self):
+        # Databases where the expiry index was one more cache table, with no expiry_index_schema nor expiry_index_syncs
+        connection = sqlite3.connect(inventoryUtils.INVENTORY_DB_PATH)
+        connection.executescript('''
+            CREATE TABLE projects ( projectId TEXT PRIMARY KEY, lifecycleState TEXT, resource TEXT NOT NULL, fetchedAt REAL NOT NULL );
+            INSERT INTO projects VALUES ( 'project-a', 'ACTIVE', '{}', 0 );
+            CREATE TABLE expiry_index ( resourceType TEXT NOT NULL, project TEXT NOT NULL, location TEXT NOT NULL, name TEXT NOT NULL, expiresOn TEXT NOT NULL, indexedAt REAL NOT NULL, PRIMARY KEY (resourceType, project, location, name) );
+            INSERT INTO expiry_index VALUES ( 'instance', 'project-a', 'europe-west1-b', 'vm-1', '20240101', 0 );
+            PRAGMA user_version = 2;
+        ''')
+        connection.close()
+
+        self.assertEqual(inventoryUtils.inventory_count_expiry_index(), 1)
+        self.assertEqual(self.schema_version(), len(inventoryUtils.EXPIRY_INDEX_MIGRATIONS))
+        self.assertEqual(inventoryUtils.inventory_get_connection().execute("SELECT COUNT(*) FROM projects").fetchone()[0], 0)
+
+    def test_cache_schema_change_keeps_the_expiry_index(self):
+        inventoryUtils.inventory_get_projects()
+        inventoryUtils.inventory_index_expiry("instance", "project-a", "europe-west1-b", "vm-1", "20240101")
+        inventoryUtils.inventory_get_connection().execute("PRAGMA user_version = 0")
+        self.close()
+
+        self.assertEqual(inventoryUtils.inventory_get_connection().execute("SELECT COUNT(*) FROM projects").fetchone()[0], 0)
+        self.assertEqual(inventoryUtils.inventory_count_expiry_index(), 1)
+
+    def test_invalidate_keeps_the_expiry_index(self):
+        inventoryUtils.inventory_index_expiry("instance", "project-a", "europe-west1-b", "vm-1", "20240101")
+        inventoryUtils.inventory_invalidate()
+        self.assertEqual(inventoryUtils.inventory_count_expiry_index(), 1)
+
+    def test_new_migration_is_applied_once(self):
+        inventoryUtils.inventory_index_expiry("instance", "project-a", "europe-west1-b", "vm-1", "20240101")
+        self.close()
+
+        # Adding the same column twice would fail
+        inventoryUtils.EXPIRY_INDEX_MIGRATIONS.append("ALTER TABLE expiry_index ADD COLUMN note TEXT;")
+        inventoryUtils.inventory_get_connection()
+        self.close()
+
+        connection = inventoryUtils.inventory_get_connection()
+        self.assertEqual(self.schema_version(), len(self.migrations) + 1)
+        self.assertIn("note", [ row[1] for row in connection.execute("PRAGMA table_info(expiry_index)") ])
+        self.assertEqual(inventoryUtils.inventory_count_expiry_index(), 1)
+
+
+
+class ExpiryIndexTest(InventoryTestCase):
+
+    def expiring_names(self, until, projects = None):
+        return [ resource[inventoryUtils.EXPIRY_NAME] for resource in inventoryUtils.inventory_get_expiring_resources(until, projects) ]
+
+    def test_expiring_resources_are_sorted_by_date(self):
+        inventoryUtils.inventory_index_expiry("instance", "project-a", "europe-west1-b", "vm-late", "20240301")
+        inventoryUtils.inventory_index_expiry("disk", "project-b", "europe-west1-b", "disk-early", "20240101")
+        inventoryUtils.inventory_index_expiry("instance", "project-a", "europe-west1-c", "vm-early", "20240102")
+
+        self.assertEqual(self.expiring_names("20240201"), ["disk-early", "vm-early"])
+        self.assertEqual(self.expiring_names("20240201", ["project-a"]), ["vm-early"])
+
+    def test_sync_only_replaces_the_listed_locations(self):
+        inventoryUtils.inventory_index_expiry("cluster", "project-a", "europe-west1", "cluster-1", "20240101")
+        inventoryUtils.inventory_index_expiry("cluster", "project-a", "us-central1", "cluster-2", "20240101")
+
+        # europe-west1 was listed and cluster-1 is no longer marked, us-central1 could not be listed
+        inventoryUtils.inventory_sync_expiry_index("cluster", "project-a", ["europe-west1"], [("europe-west1", "cluster-3", "20240102")])
+
+        self.assertEqual(self.expiring_names("20240201"), ["cluster-2", "cluster-3"])
+        self.assertEqual(list(inventoryUtils.inventory_get_expiry_index_syncs()["project-a"]), ["cluster"])
+
+    def test_sync_of_every_location_replaces_the_project_entries(self):
+        inventoryUtils.inventory_index_expiry("instance", "project-a", "europe-west1-b", "vm-1", "20240101")
+        inventoryUtils.inventory_index_expiry("instance", "project-b", "europe-west1-b", "vm-2", "20240101")
+
+        inventoryUtils.inventory_sync_expiry_index("instance", "project-a", None, [])
+
+        self.assertEqual(self.expiring_names("20240201"), ["vm-2"])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
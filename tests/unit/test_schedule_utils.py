@@ -0,0 +1,135 @@
+#!/usr/bin/python
+import os,sys
+import unittest
+import datetime as dt
+
+
+# Unit tests are supposed to be under the subdirectory tests/unit
+# The common utils library is supposed to be located at the root of that path
+# This is needed to find the google_schedule_utils module since this Unit test is not within the same module
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+grandparentdir = os.path.dirname(parentdir)
+sys.path.insert(0, grandparentdir)
+import google_schedule_utils as scheduleUtils
+
+
+# 2024-01-01 is a Monday
+def day(dayOfMonth, hour = 0, minute = 0):
+    return dt.datetime(2024, 1, dayOfMonth, hour, minute)
+
+
+
+class ScheduleCompileTest(unittest.TestCase):
+
+    def test_invalid_schedules_are_none(self):
+        self.assertIsNone(scheduleUtils.schedule_compile("24:00 23:59 * * *"))
+        self.assertIsNone(scheduleUtils.schedule_compile("08:00 18:00 * * FOO"))
+        self.assertIsNone(scheduleUtils.schedule_compile("08:00 18:00"))
+
+    def test_compiled_schedule_is_memoized(self):
+        compiledSchedule = scheduleUtils.schedule_compile("08:00 18:00 * * MON-FRI")
+        self.assertIs(scheduleUtils.schedule_compile("08:00 18:00 * * MON-FRI"), compiledSchedule)
+        self.assertIs(scheduleUtils.schedule_compile(" 08:00 18:00 * * MON-FRI "), compiledSchedule)
+        self.assertEqual(compiledSchedule[scheduleUtils.SCHEDULE_STRING], "08:00 18:00 * * MON-FRI")
+
+    def test_times_are_minutes_since_midnight(self):
+        compiledSchedule = scheduleUtils.schedule_compile("00:00 23:59 * * *")
+        self.assertEqual(compiledSchedule[scheduleUtils.SCHEDULE_START_MINUTE], 0)
+        self.assertEqual(compiledSchedule[scheduleUtils.SCHEDULE_END_MINUTE], 23 * 60 + 59)
+
+
+
+class ScheduleIsWithinTest(unittest.TestCase):
+
+    def test_start_and_end_minutes_are_included(self):
+        compiledSchedule = scheduleUtils.schedule_compile("08:00 18:00 * * MON-FRI")
+        self.assertFalse(scheduleUtils.schedule_is_within(compiledSchedule, day(1, 7, 59)))
+        self.assertTrue(scheduleUtils.schedule_is_within(compiledSchedule, day(1, 8, 0)))
+        self.assertTrue(scheduleUtils.schedule_is_within(compiledSchedule, day(1, 18, 0) + dt.timedelta(seconds = 59)))
+        self.assertFalse(scheduleUtils.schedule_is_within(compiledSchedule, day(1, 18, 1)))
+
+    def test_day_of_week_list(self):
+        compiledSchedule = scheduleUtils.schedule_compile("09:00 17:00 * * MON,WED,FRI")
+        self.assertEqual([ scheduleUtils.schedule_is_within(compiledSchedule, day(dayOfMonth, 12)) for dayOfMonth in range(1, 8) ],
+                         [True, False, True, False, True, False, False])
+
+    def test_day_of_month_and_month(self):
+        compiledSchedule = scheduleUtils.schedule_compile("08:00 18:00 1,15 JAN *")
+        self.assertTrue(scheduleUtils.schedule_is_within(compiledSchedule, day(15, 12)))
+        self.assertFalse(scheduleUtils.schedule_is_within(compiledSchedule, day(16, 12)))
+        self.assertFalse(scheduleUtils.schedule_is_within(compiledSchedule, dt.datetime(2024, 2, 1, 12)))
+
+    def test_whole_day_includes_midnight(self):
+        compiledSchedule = scheduleUtils.schedule_compile("00:00 23:59 * * MON-FRI")
+        self.assertTrue(scheduleUtils.schedule_is_within(compiledSchedule, day(1, 0, 0)))
+        self.assertTrue(scheduleUtils.schedule_is_within(compiledSchedule, day(5, 23, 59)))
+        self.assertFalse(scheduleUtils.schedule_is_within(compiledSchedule, day(6, 0, 0)))
+
+
+
+class ScheduleNextTransitionTest(unittest.TestCase):
+
+    def test_next_start_and_stop_on_a_working_day(self):
+        compiledSchedule = scheduleUtils.schedule_compile("08:00 18:00 * * MON-FRI")
+        self.assertEqual(scheduleUtils.schedule_next_start(compiledSchedule, day(1, 7, 0)), day(1, 8, 0))
+        self.assertEqual(scheduleUtils.schedule_next_stop(compiledSchedule, day(1, 9, 0)), day(1, 18, 1))
+        self.assertEqual(scheduleUtils.schedule_next_transition(compiledSchedule, day(1, 9, 0)), day(1, 18, 1))
+
+    def test_transitions_are_strictly_after_when(self):
+        compiledSchedule = scheduleUtils.schedule_compile("08:00 18:00 * * MON-FRI")
+        self.assertEqual(scheduleUtils.schedule_next_start(compiledSchedule, day(1, 8, 0)), day(2, 8, 0))
+        self.assertEqual(scheduleUtils.schedule_next_stop(compiledSchedule, day(1, 18, 1)), day(2, 18, 1))
+
+    def test_next_start_skips_the_weekend(self):
+        compiledSchedule = scheduleUtils.schedule_compile("08:00 18:00 * * MON-FRI")
+        self.assertEqual(scheduleUtils.schedule_next_start(compiledSchedule, day(5, 19, 0)), day(8, 8, 0))
+        self.assertEqual(scheduleUtils.schedule_next_transition(compiledSchedule, day(6, 12, 0)), day(8, 8, 0))
+
+    def test_next_start_with_a_day_list(self):
+        compiledSchedule = scheduleUtils.schedule_compile("09:00 17:00 * * MON,WED,FRI")
+        self.assertEqual(scheduleUtils.schedule_next_start(compiledSchedule, day(1, 18, 0)), day(3, 9, 0))
+        self.assertEqual(scheduleUtils.schedule_next_stop(compiledSchedule, day(2, 12, 0)), day(3, 17, 1))
+
+    def test_window_ending_at_midnight_stops_the_next_day(self):
+        compiledSchedule = scheduleUtils.schedule_compile("22:00 23:59 * * SUN")
+        self.assertEqual(scheduleUtils.schedule_next_stop(compiledSchedule, day(7, 23, 0)), day(8, 0, 0))
+
+    def test_stop_of_the_previous_day_is_found(self):
+        # At 00:00 the window of the previous day is still open until the end of that minute
+        compiledSchedule = scheduleUtils.schedule_compile("00:00 23:59 * * MON")
+        self.assertEqual(scheduleUtils.schedule_next_stop(compiledSchedule, day(1, 12, 0)), day(2, 0, 0))
+        self.assertEqual(scheduleUtils.schedule_next_start(compiledSchedule, day(1, 12, 0)), day(8, 0, 0))
+
+    def test_whole_days_have_no_transition_at_midnight_in_between(self):
+        compiledSchedule = scheduleUtils.schedule_compile("00:00 23:59 * * MON-FRI")
+        self.assertEqual(scheduleUtils.schedule_next_stop(compiledSchedule, day(1, 10, 0)), day(6, 0, 0))
+        self.assertEqual(scheduleUtils.schedule_next_start(compiledSchedule, day(1, 10, 0)), day(8, 0, 0))
+        self.assertEqual(scheduleUtils.schedule_next_start(compiledSchedule, day(6, 0, 0)), day(8, 0, 0))
+
+    def test_always_within_has_no_transition(self):
+        compiledSchedule = scheduleUtils.schedule_compile("00:00 23:59 * * *")
+        self.assertIsNone(scheduleUtils.schedule_next_start(compiledSchedule, day(1, 12, 0)))
+        self.assertIsNone(scheduleUtils.schedule_next_stop(compiledSchedule, day(1, 12, 0)))
+        self.assertIsNone(scheduleUtils.schedule_next_transition(compiledSchedule, day(1, 12, 0)))
+
+    def test_empty_window_has_no_transition(self):
+        compiledSchedule = scheduleUtils.schedule_compile("18:00 08:00 * * *")
+        self.assertFalse(scheduleUtils.schedule_is_within(compiledSchedule, day(1, 20, 0)))
+        self.assertIsNone(scheduleUtils.schedule_next_transition(compiledSchedule, day(1, 12, 0)))
+
+    def test_transition_matches_is_within(self):
+        # Right before a transition the instance is on one side of its window and right at it on the other side
+        for schedule in ["08:00 18:00 * * MON-FRI", "09:00 17:00 * * MON,WED,FRI", "00:00 23:59 * * MON-FRI", "22:00 23:59 * * SUN", "10:00 16:00 * * SAT,SUN"]:
+            compiledSchedule = scheduleUtils.schedule_compile(schedule)
+            when = day(1, 0, 30)
+            while when < day(15):
+                transition = scheduleUtils.schedule_next_transition(compiledSchedule, when)
+                self.assertNotEqual(scheduleUtils.schedule_is_within(compiledSchedule, transition - dt.timedelta(minutes = 1)),
+                                    scheduleUtils.schedule_is_within(compiledSchedule, transition), "{0} at {1}".format(schedule, transition))
+                when = transition
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+#!/usr/bin/python
+import os,sys
+import unittest
+import datetime as dt
+
+
+# Unit tests are supposed to be under the subdirectory tests/unit
+# The common utils library is supposed to be located at the root of that path and the scripts under its scripts folder
+# This is needed to find the google_compute_instance_scheduler script since this Unit test is not within the same module
+currentdir = os.path.dirname(os.path.realpath(__file__))
+parentdir = os.path.dirname(currentdir)
+grandparentdir = os.path.dirname(parentdir)
+sys.path.insert(0, grandparentdir)
+sys.path.insert(0, os.path.join(grandparentdir, 'scripts'))
+import google_constants as constants
+import google_compute_simulation_utils as simulationUtils
+import google_compute_instance_scheduler as scheduler
+
+
+PROJECT = "test-project"
+ZONE = "europe-west1-b"
+
+# 2024-01-01 is a Monday
+START = dt.datetime(2024, 1, 1, 7, 0)
+
+
+def instance_key(instanceName):
+    return (PROJECT, ZONE, instanceName)
+
+
+#
+# Adds an instance to the simulated backend, with its activity window and startup dependencies as "zone#name" entries
+#
+def add_instance(instanceName, status, schedule, startupDependencies = None):
+
+    metadataItems = [{ "key": constants.ACTIVITY_WINDOW_KEY, "value": schedule }]
+    if startupDependencies:
+        metadataItems.append({ "key": constants.STARTUP_DEPENDENCIES_KEY, "value": ",".join( "{0}#{1}".format(ZONE, dependency) for dependency in startupDependencies ) })
+
+    simulationUtils.SIMULATION_INSTANCES[instance_key(instanceName)] = {
+        "name": instanceName,
+        "zone": "projects/{0}/zones/{1}".format(PROJECT, ZONE),
+        "status": status,
+        "labels": {},
+        "metadata": { "items": metadataItems },
+    }
+    simulationUtils.SIMULATION_PROJECT_INSTANCES.setdefault(PROJECT, []).append(instance_key(instanceName))
+
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.computeUtils = scheduler.computeUtils
+        self.batchGetInstances = simulationUtils.compute_batch_get_instances
+        self.performOperation = simulationUtils.compute_perform_operation_on_instances
+        scheduler.computeUtils = simulationUtils
+        simulationUtils.SIMULATION_INSTANCES.clear()
+        simulationUtils.SIMULATION_PROJECT_INSTANCES.clear()
+        simulationUtils.simulation_reset_api_calls()
+        simulationUtils.simulation_reset_operations()
+
+        self.now = START
+        self.listFailures = 0
+        self.batchFailures = 0
+        self.operationFailures = 0
+        self.listings = []
+        self.operations = [] # [ (time, operationName, instanceName) ]
+
+        def batchGetInstances(*args, **kwargs):
+            if self.batchFailures:
+                self.batchFailures -= 1
+                raise IOError("Batch request failed")
+            return self.batchGetInstances(*args, **kwargs)
+
+        def performOperation(*args, **kwargs):
+            if self.operationFailures:
+                self.operationFailures -= 1
+                raise IOError("Operation failed")
+            return self.performOperation(*args, **kwargs)
+
+        simulationUtils.compute_batch_get_instances = batchGetInstances
+        simulationUtils.compute_perform_operation_on_instances = performOperation
+
+    def tearDown(self):
+        scheduler.computeUtils = self.computeUtils
+        simulationUtils.compute_batch_get_instances = self.batchGetInstances
+        simulationUtils.compute_perform_operation_on_instances = self.performOperation
+
+    def list_instances(self):
+        self.listings.append(self.now)
+        if self.listFailures:
+            self.listFailures -= 1
+            raise IOError("Listing failed")
+        return scheduler.list_scheduled_instances([PROJECT], simulationUtils.COMPUTE_ALL_ZONES, checkProjectLabel = False)
+
+    # The daemon is done with a wake up: its operations happened at the current virtual time
+    def sleep(self, seconds):
+        for (operationName, instanceKey) in simulationUtils.simulation_reset_operations():
+            self.operations.append((self.now, operationName, instanceKey[2]))
+        self.now += dt.timedelta(seconds = seconds)
+
+    def run_daemon(self, until, refreshInterval = scheduler.DAEMON_REFRESH_INTERVAL):
+        scheduler.daemon(self.list_instances, refreshInterval, clock = lambda: self.now, sleep = self.sleep, until = until)
+
+    def operation_times(self, instanceName):
+        return [ (operationTime, operationName) for (operationTime, operationName, operationInstance) in self.operations if operationInstance == instanceName ]
+
+    def test_instances_are_started_and_stopped_at_their_transitions(self):
+        add_instance("office", simulationUtils.TERMINATED, "08:00 18:00 * * MON-FRI")
+        add_instance("batch", simulationUtils.RUNNING, "10:00 16:00 * * SAT,SUN")
+
+        self.run_daemon(dt.datetime(2024, 1, 2, 9, 0))
+
+        self.assertEqual(self.operation_times("office"), [ (dt.datetime(2024, 1, 1, 8, 0), simulationUtils.COMPUTE_START_OPERATION),
+                                                           (dt.datetime(2024, 1, 1, 18, 1), simulationUtils.COMPUTE_STOP_OPERATION),
+                                                           (dt.datetime(2024, 1, 2, 8, 0), simulationUtils.COMPUTE_START_OPERATION) ])
+        # The first refresh runs a pass on every listed instance
+        self.assertEqual(self.operation_times("batch"), [ (START, simulationUtils.COMPUTE_STOP_OPERATION) ])
+
+    def test_refreshes_are_refresh_interval_apart(self):
+        add_instance("office", simulationUtils.TERMINATED, "08:00 18:00 * * MON-FRI")
+
+        self.run_daemon(dt.datetime(2024, 1, 1, 20, 0), refreshInterval = 240)
+
+        self.assertEqual(self.listings, [ START + dt.timedelta(hours = hours) for hours in (0, 4, 8, 12) ])
+
+    def test_instance_waiting_for_a_dependency_is_retried(self):
+        add_instance("db", simulationUtils.TERMINATED, "08:10 18:00 * * MON-FRI")
+        add_instance("app", simulationUtils.TERMINATED, "08:00 18:00 * * MON-FRI", ["db"])
+
+        self.run_daemon(dt.datetime(2024, 1, 1, 9, 0))
+
+        # app is due at 08:00 but db is not running until 08:10, hence both are started then, db first
+        self.assertEqual(self.operations, [ (dt.datetime(2024, 1, 1, 8, 10), simulationUtils.COMPUTE_START_OPERATION, "db"),
+                                            (dt.datetime(2024, 1, 1, 8, 10), simulationUtils.COMPUTE_START_OPERATION, "app") ])
+
+    def test_failed_refresh_is_retried(self):
+        add_instance("office", simulationUtils.RUNNING, "08:00 18:00 * * MON-FRI")
+        self.listFailures = 2
+
+        self.run_daemon(dt.datetime(2024, 1, 1, 7, 30))
+
+        retry = dt.timedelta(minutes = scheduler.DAEMON_RETRY_INTERVAL)
+        self.assertEqual(self.listings, [START, START + retry, START + 2 * retry])
+        self.assertEqual(self.operation_times("office"), [ (START + 2 * retry, simulationUtils.COMPUTE_STOP_OPERATION) ])
+
+    def test_failed_wake_up_is_retried(self):
+        add_instance("office", simulationUtils.TERMINATED, "08:00 18:00 * * MON-FRI")
+
+        # The batch request of the 08:00 wake up fails
+        def sleep(seconds):
+            DaemonTest.sleep(self, seconds)
+            if self.now == dt.datetime(2024, 1, 1, 8, 0):
+                self.batchFailures = 1
+        self.sleep = sleep
+
+        self.run_daemon(dt.datetime(2024, 1, 1, 19, 0))
+
+        retryTime = dt.datetime(2024, 1, 1, 8, 0) + dt.timedelta(minutes = scheduler.DAEMON_RETRY_INTERVAL)
+        self.assertEqual(self.operation_times("office"), [ (retryTime, simulationUtils.COMPUTE_START_OPERATION),
+                                                           (dt.datetime(2024, 1, 1, 18, 1), simulationUtils.COMPUTE_STOP_OPERATION) ])
+
+    def test_failed_operation_is_retried(self):
+        add_instance("office", simulationUtils.TERMINATED, "08:00 18:00 * * MON-FRI")
+
+        # The start of the 08:00 wake up fails, once the next transition of the instance has been queued
+        def sleep(seconds):
+            DaemonTest.sleep(self, seconds)
+            if self.now == dt.datetime(2024, 1, 1, 8, 0):
+                self.operationFailures = 1
+        self.sleep = sleep
+
+        self.run_daemon(dt.datetime(2024, 1, 1, 19, 0))
+
+        retryTime = dt.datetime(2024, 1, 1, 8, 0) + dt.timedelta(minutes = scheduler.DAEMON_RETRY_INTERVAL)
+        self.assertEqual(self.operation_times("office"), [ (retryTime, simulationUtils.COMPUTE_START_OPERATION),
+                                                           (dt.datetime(2024, 1, 1, 18, 1), simulationUtils.COMPUTE_STOP_OPERATION) ])
+
+    # Changes the schedule of the instance office right after it has been started at 08:00
+    def change_schedule_after_start(self, schedule):
+        def sleep(seconds):
+            DaemonTest.sleep(self, seconds)
+            if self.now > dt.datetime(2024, 1, 1, 8, 0):
+                simulationUtils.SIMULATION_INSTANCES[instance_key("office")]['metadata']['items'][0]['value'] = schedule
+        self.sleep = sleep
+
+    def test_changed_schedule_is_picked_up_by_the_refresh(self):
+        add_instance("office", simulationUtils.TERMINATED, "08:00 18:00 * * MON-FRI")
+        self.change_schedule_after_start("08:00 12:00 * * MON-FRI")
+
+        self.run_daemon(dt.datetime(2024, 1, 1, 19, 0), refreshInterval = 240)
+
+        # The 11:00 refresh reads the new schedule
+        self.assertEqual(self.operation_times("office"), [ (dt.datetime(2024, 1, 1, 8, 0), simulationUtils.COMPUTE_START_OPERATION),
+                                                           (dt.datetime(2024, 1, 1, 12, 1), simulationUtils.COMPUTE_STOP_OPERATION) ])
+
+    def test_changed_schedule_is_read_at_the_next_transition(self):
+        add_instance("office", simulationUtils.TERMINATED, "08:00 18:00 * * MON-FRI")
+        self.change_schedule_after_start("08:00 12:00 * * MON-FRI")
+
+        self.run_daemon(dt.datetime(2024, 1, 2, 13, 0), refreshInterval = 48 * 60)
+
+        # Without a refresh the new schedule is only read at the 18:01 stop, and followed from then on
+        self.assertEqual(self.operation_times("office"), [ (dt.datetime(2024, 1, 1, 8, 0), simulationUtils.COMPUTE_START_OPERATION),
+                                                           (dt.datetime(2024, 1, 1, 18, 1), simulationUtils.COMPUTE_STOP_OPERATION),
+                                                           (dt.datetime(2024, 1, 2, 8, 0), simulationUtils.COMPUTE_START_OPERATION),
+                                                           (dt.datetime(2024, 1, 2, 12, 1), simulationUtils.COMPUTE_STOP_OPERATION) ])
+        self.assertEqual(self.listings, [START])
+
+    def test_deleted_instance_is_dropped(self):
+        add_instance("office", simulationUtils.TERMINATED, "08:00 18:00 * * MON-FRI")
+
+        def sleep(seconds):
+            DaemonTest.sleep(self, seconds)
+            if self.now > START:
+                simulationUtils.SIMULATION_INSTANCES.pop(instance_key("office"), None)
+                simulationUtils.SIMULATION_PROJECT_INSTANCES[PROJECT] = []
+        self.sleep = sleep
+
+        self.run_daemon(dt.datetime(2024, 1, 1, 19, 0))
+
+        self.assertEqual(self.operations, [])
+
+
+
+if __name__ == '__main__':
+    unittest.main()